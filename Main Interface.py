@@ -32,29 +32,48 @@ Page Descriptions:
          Leakage Information: This page provides information on the status/severity of any Hydrogen leaks occurring in the truck. Includes the same corner buttons and displays as the other screens.
 
          Screen Saver: There is no direct button to access this screen. If there is no user interaction on any of the pages for a designated amount of time (controlled by the variable 'delay') then the app will automatically
-         change to this page. To avoid burn in the Hydra logo is animated to slowly bounce around
+         change to this page. To avoid burn in the Hydra logo is animated to slowly bounce around. While it is shown the display is slowed right down
+         (see IdleManager) and the first touch only wakes it, going back to the fuel gauge
 
 Any reference to the Kivy back end or the Kivy code relates to the code held within the "fuelgauge.kv" file -- it will/needs to be in the same folder as this code for the app to work
 
 """
 """
     Outside References:
-    - For the dusk screen dimming system the https://sunrise-sunset.org/api was used, this provided a very useful list of sunset times
+    - The sunrise and sunset times for the backlight dimming are worked out with NOAA's general solar position equations
+      (https://gml.noaa.gov/grad/solcalc/solareqns.PDF)
     
 
 """
 
 import time
+import math
+import threading
+import asyncio
 import can
 import os
-from threading import Thread
+import traceback
+import socketcan_raw
+from can_replay import ReplayBus, NullBus
+from can_receiver import setCANbaudRate, setCANdown
+from can_signals import loadSignalTable, canFiltersFor
+from can_metrics import formatReport, dumpReport
+from can_archive import LogArchiver
+from can_service import CanService, AggregateFeed, FaultHistoryFeed, loggerConsumers
+from fault_table import loadFaultTable, describeFault
+from fault_history import FaultHistory, formatChange
+from truck_live import publishTruckValues, metricsReport, enableHistory
+from ui_assets import imageSources, registerFonts, preload
+from boot_report import BootReport
+from solar import nextTransition
 
 from kivy.app import App
 from kivy.clock import Clock
 from kivy.config import Config
 from kivy.core.window import Window
-from kivy.properties import NumericProperty, ListProperty, StringProperty
+from kivy.properties import NumericProperty, ListProperty, StringProperty, BooleanProperty
 from kivy.uix.screenmanager import ScreenManager, Screen
+from kivy.uix.widget import Widget
 from kivy.uix.dropdown import DropDown
 
 # The conversion factor is used to convert the raw numerical data into degrees to move the needle
@@ -63,16 +82,95 @@ from kivy.uix.dropdown import DropDown
 # To put it more simply 50 * 1.8 = 90, the needle has to be able to rotate 180˚ total and the gauge is from 0-100, 100 * 1.8 = 180
 # cf = conversion_factor
 cf = 1.8
-# The delay is how long the app goes without user input before it changes to the screen saver
+# Where the truck is (longitude is negative west of Greenwich) and its IANA time zone (None uses the Pi's own), for dimming the backlight
+# at sunset and bringing it back up at sunrise
+latitude = 53.917
+longitude = -122.75
+time_zone = 'America/Vancouver'
+# The backlight's PWM level (out of 1024) in the day and at night, and how it fades between them: backlight_steps steps over backlight_fade
+# seconds. The sunrise/sunset times are worked out again at least every backlight_recheck seconds in case the clock has been set since
+backlight_day = 1024
+backlight_night = 75
+backlight_fade = 30
+backlight_steps = 15
+backlight_recheck = 3600
+# The delay is how long (in seconds) the app goes without user input before it changes to the screen saver
 delay = 2000
+# While the screen saver is up the latest values are only picked up every idle_publish_period seconds (often enough to keep the trend
+# history going) and aren't formatted for the screens. The logo moves saver_fps times a second at saver_speed pixels a second
+idle_publish_period = 2
+saver_fps = 4
+saver_speed = 20
+# The most times a second the latest CAN values are pushed to the screens, however busy the bus is (nothing is pushed while no frames
+# are arriving)
+display_rate = 10
+# The gauge needles glide to a new reading instead of jumping -- needle_fps is the most frames a second the needle animation will draw
+# and needle_response sets how quickly it catches up (roughly 1/needle_response seconds to get most of the way there, higher is snappier)
+needle_fps = 30
+needle_response = 4.0
+# The trend lines on the Fuel Gauge, Injection Rate and Temp & Press pages show the last trend_span seconds. Their history is sampled every
+# history_period seconds and never takes more than history_max_kb of memory -- once it is full the oldest samples are dropped
+trend_span = 1800
+history_period = 2
+history_max_kb = 512
 
 # This is the main directory where everything for this is stored (including this file)
 display_code_dir = '/Users/Xavier Biancardi/PycharmProjects/Hydra_Display_RPi/'
 
-_canIdTank123 = "cff3d17"
-_canIdTank456 = "cff4017"
-_canIdNira3 = "cff3e17"
-_canIdWheelSpeed = "18fef100"
+# The J1939 signal definitions (IDs, bit positions, scale and offset) -- shared with the CAN logger
+signal_file = display_code_dir + 'j1939_signals.csv'
+# The NIRA fault descriptions, one 'code,number,description' per line (compiled into a cache next to it, see fault_table.py)
+fault_file = display_code_dir + 'faultmessages.txt'
+
+# The truck's CAN and tank setup, these are the same settings the CAN logger takes on its command line
+outDir = "/Users/Xavier Biancardi/PycharmProjects/Display_rep/"
+# Display_rep/out/hydraFL
+# "/home/pi/rough/logger-rbp-python-out/lomack150_"
+numCAN = 1  # 2
+bRate = 250000  # 250000 or 500000
+CANtype = "RBP15"  # OCAN or ACAN
+numTank = 5
+volumeStr = "202,202,202,202,148"
+volumeL = [float(x) for x in volumeStr.split(",")]
+
+# How frames are received -- 'raw' reads the SocketCAN socket directly in batches (Linux only), 'python-can' uses bus.recv() and
+# is what the virtual interface needs for testing
+can_backend = 'raw'
+# How the CAN side of the app runs -- 'threads' receives in a background thread and publishes to the screens from a Clock timer, 'asyncio'
+# runs receiving, decoding, the toggle message and publishing as coroutines on the same asyncio loop as Kivy (needs Kivy 2.0 or newer)
+run_mode = 'threads'
+
+# To run the display without a truck, list recorded CAN logger files here and they are played back in place of can0 -- replay_speed is
+# how many times faster than real time to play them (1 is as recorded, 0 is as fast as they can be decoded). Leave empty for the real bus
+replay_files = []
+replay_speed = 1.0
+# What the logger writes while replaying (the log files, stats and live feeds) and the fault history seen in a replay go in this
+# directory instead of outDir, so a replay never mixes its files in with the truck's own
+replay_out_dir = outDir + 'replay/'
+# The CAN receive/decode metrics (frame counts and rates per ID, thrown away frames, decode times, drops, signal ages) are written
+# to this file every metrics_dump_period seconds, and shown on the CAN Settings screen
+metrics_file = outDir + 'can_metrics.json'
+metrics_dump_period = 60
+# Every change of the NIRA fault code and the MIL lamp is kept in this file, the last fault_history_size of them, and shown on the Fault
+# Info page fault_history_page_size at a time
+fault_history_file = outDir + 'fault_history.bin'
+fault_history_size = 4096
+fault_history_page_size = 5
+# How long each part of the start up took, and when the first frame and the first live value were shown (see boot_report.py)
+boot_report_file = outDir + 'boot_report.json'
+# Does everything the CAN logger (recordCANlogger.py) did from inside the display, so it doesn't have to run alongside it: the hourly
+# log files and the liveUpdate-Hmass/liveUpdate-NiraError feeds are written to outDir. The bus is then only opened by this program
+run_logger = False
+# 'text' writes the logger's usual .log files, 'binary' the smaller .bcan files (see can_binlog.py)
+log_format = 'text'
+# Finished hourly logs are zipped in the background and the originals deleted, archives older than archive_retention_days are
+# deleted, as are the oldest ones while all of them together take up more than archive_max_gb
+archive_logs = True
+archive_retention_days = 90
+archive_max_gb = 8
+# Replaying always uses the receive thread
+if replay_files:
+    run_mode = 'threads'
 
 
 # This next block of functions are all derived from Calvin's PI data logging code, the main differences between them in this code and his are where the variables send their contents
@@ -86,395 +184,292 @@ def msg_receiving():
     numTank = int(sys.argv[5])
     volumeStr = sys.argv[6]'''
 
-    outDir = "/Users/Xavier Biancardi/PycharmProjects/Display_rep/"
-    # Display_rep/out/hydraFL
-    # "/home/pi/rough/logger-rbp-python-out/lomack150_"
-    numCAN = 1  # 2
-    bRate = 250000  # 250000 or 500000
-    CANtype = "RBP15"  # OCAN or ACAN
-    numTank = 5
-    volumeStr = "202,202,202,202,148"
+    signals = loadSignalTable(signal_file)
 
-    volumeL = [float(x) for x in volumeStr.split(",")]
-
-    os.system("sudo /sbin/ip link set can0 down")
-    if numCAN == 2:
-        os.system("sudo /sbin/ip link set can1 down")
-
-    # Make CAN interface to 250 or 500kbps
-    setCANbaudRate(numCAN, bRate)
-
-    # Connect to Bus
-    bus0 = connectToLogger('can0')
-    if numCAN == 2:
-        bus1 = connectToLogger('can1')
-
-    # Continually recieved messages
-    readwriteMessageThread(bus0, outDir, numCAN, bRate, CANtype, numTank, volumeL)
-    # if numCAN == 2:
-    #    readwriteMessageThread(bus1, outDir, numCAN, bRate, CANtype + "1", numTank, volumeL)
-
-    # Continually write readMessages
+    def connect():
+        # Connect to Bus -- the raw socket reader is used where it is available, python-can everywhere else (e.g. the virtual interface)
+        if replay_files:
+            # The frames keep the time they were recorded at when they are being logged (or played as fast as possible), so the files
+            # written from them line up with the originals rather than with when the replay was run
+            bus0 = ReplayBus(replay_files, replay_speed, restamp=not (run_logger or (replay_speed == 0)))
+        elif (can_backend == 'raw') and socketcan_raw.isAvailable():
+            bus0 = socketcan_raw.RawCanSocket('can0')
+        else:
+            bus0 = connectToLogger('can0')
+        # if numCAN == 2:
+        #    bus1 = connectToLogger('can1')
+        return bus0
+
+    # The service brings the interface(s) up at 250 or 500kbps, continually receives messages in its own thread, decodes them once for
+    # the display and anything else that wants them (e.g. the log files), and takes the interface(s) back down when it is stopped (a
+    # replay has no interface to bring up). Only the signals this truck's tank layout actually uses are decoded, and unless the logger
+    # is running the kernel is told to only pass on the IDs those decoders handle
+    channels = [] if replay_files else ['can0', 'can1'][:numCAN]
+    service = CanService(channels, bRate, connect, signals, numTank, volumeL)
+    enableHistory(service.truckVars, history_period, history_max_kb * 1024)
+    addLoggerConsumers(service, signals)
+    service.start()
+
+    return (service, service.truckVars)
+
+
+def addLoggerConsumers(service, signals):
+    if replay_files:
+        os.makedirs(replay_out_dir, exist_ok=True)
+    if run_logger:
+        for consumer in loggerConsumers(loggerOutDir(), CANtype, bRate, signals, service.truckVars, log_format, logArchiver()):
+            service.addConsumer(consumer)
+    else:
+        # The per second/minute/hour signal stats are still kept (in truck_vars['aggregates']), just not written out
+        service.addConsumer(AggregateFeed(service.truckVars, signals))
+    # Every fault and MIL lamp change, for the Fault Info page
+    historyFname = (replay_out_dir + os.path.basename(fault_history_file)) if replay_files else fault_history_file
     try:
-        while True:
-            pass
+        service.truckVars['faultHistory'] = FaultHistory(historyFname, fault_history_size)
+    except OSError as e:
+        # An SD card that can't be written (or a missing directory) shouldn't stop the CAN service, the history is just not kept
+        # across restarts
+        print('Could not open the fault history, keeping it in memory only: ' + str(e))
+        service.truckVars['faultHistory'] = FaultHistory(None, fault_history_size)
+    service.addConsumer(FaultHistoryFeed(service.truckVars['faultHistory'], service.truckVars, signals,
+                                         Clock.create_trigger(faultHistoryChanged)))
+
+
+# Runs on the main thread after the receive thread has recorded one or more fault changes, the Fault Info page is bound to the count
+def faultHistoryChanged(dt):
+    app = App.get_running_app()
+    if app.truck_vars is not None:
+        app.fault_history_count = app.truck_vars['faultHistory'].written
 
-    except KeyboardInterrupt:
-        # Catch keyboard interrupt
-        os.system("sudo /sbin/ip link set can0 down")
-        if numCAN == 2:
-            os.system("sudo /sbin/ip link set can1 down")
-        print('\n\rKeyboard interrtupt')
 
+def loggerOutDir():
+    return replay_out_dir if replay_files else outDir
 
-def readwriteMessageThread(bus, outDir, numCAN, bRate, CANv, numTank, volumeL):
-    """
-    In seperate thread continually recieve messages from CAN logger
-    """
-    # Start receive thread
-    t = Thread(target=can_rx_task, args=(bus, outDir, numCAN, bRate, CANv, numTank, volumeL))
-    t.start()
 
+def logArchiver():
+    if not archive_logs:
+        return None
+    return LogArchiver(loggerOutDir(), archive_retention_days, archive_max_gb * 1024 ** 3)
 
-def can_rx_task(bus, outDir, numCAN, bRate, CANv, numTank, volumeL):
+
+def publishLiveValues(dt):
     """
-    CAN receive thread
+    Called on the main thread at most display_rate times a second, after the CAN service has woken it with a new frame (every
+    idle_publish_period seconds while the screen saver is up)
     """
-    curFname = None
-    outF = None
-    prevTime = ("-1", "-1", "-1")
-
-    livefeedNiraErrorFname = "_".join([outDir, CANv, "liveUpdate-NiraError.txt"])
-    livefeedHmassFname = "_".join([outDir, CANv, "liveUpdate-Hmass.txt"])
-
-    prevNiraError = None
-
-    tempL = []
-    maxNumTanks = 6
-    for i in range(maxNumTanks): tempL.append(None)
-    presT1 = None
-    wheelSpeed = None
-    railPressure = None
-
-    prevSec = None
-
-    curVarL = [railPressure, presT1, wheelSpeed]
-
-    while True:
-        # recieve message and extract info
-        (outstr, timeDateV) = createLogLine(bus.recv())
-
-        (ymdFV, hourV, ymdBV, hmsfV) = timeDateV
-
-        prevYmdBV = ymdBV
-        prevHmsfV = hmsfV
-        prevHour = hourV
-        prevTime = (prevYmdBV, prevHmsfV, prevHour)
-
-        (prevNiraError, tempL, curVarL, prevSec) = liveUpdateTruck(outstr, livefeedNiraErrorFname,
-                                                                   livefeedHmassFname,
-                                                                   prevNiraError, prevTime, tempL,
-                                                                   curVarL, volumeL, numTank,
-                                                                   maxNumTanks, prevSec)
-        # if not(HtotalMass == None):
-        #     WRITE CODE HERE ... use HtotalMass
+    app = App.get_running_app()
+    # The CAN service may still be starting up
+    if app.truck_vars is None:
+        return
+    # Set before publishing so a frame that arrives part way through still wakes it again
+    if app.can_service is not None:
+        app.can_service.waiting = True
+    # Nobody can see the screens behind the screen saver, so only the hydrogen mass and the trend history are kept up to date
+    publishTruckValues(app, app.truck_vars, display=not app.idle)
+    # The latency is only counted once a value has actually been shown
+    if app.truck_vars['latency']['count'] and ('first live value' not in app.boot.marks):
+        app.boot.mark('first live value')
 
 
-def createLogLine(message):
+def publishTrigger(idle):
     """
-    Format the CAN message
+    The trigger the CAN receive thread fires to get the latest values published, slower while the display is idle
     """
-    # Time Stamp
-    (ymdFV, hmsfV, hourV, ymdBV) = extractTimeFromEpoch(message.timestamp)
-
-    # PGN
-    pgnV = '0x{:02x}'.format(message.arbitration_id)
+    if idle:
+        return Clock.create_trigger(publishLiveValues, idle_publish_period)
+    return Clock.create_trigger(publishLiveValues, 1.0 / display_rate)
 
-    # Hex
-    hexV = ''
-    for i in range(message.dlc):
-        hexV += '{0:x} '.format(message.data[i])
 
-    outstr = " ".join([hmsfV, "Rx", "1", pgnV, "x", str(message.dlc), hexV]) + " "
-    timeDateV = (ymdFV, hourV, ymdBV, hmsfV)
-    return (outstr, timeDateV)
+def updateCanStats(dt):
+    app = App.get_running_app()
+    # The CAN service may still be starting up
+    if app.truck_vars is None:
+        return
+    app.can_stats = formatReport(metricsReport(app.truck_vars))
 
 
-def extractTimeFromEpoch(timeStamp):
-    """
-    Extract all the relative time and date info from CAN timestamp
-    """
-    ymdFV = time.strftime('%Y%m%d', time.localtime(timeStamp))
-    ymdBV = time.strftime('%d:%m:%Y', time.localtime(timeStamp))
-    hmsV = time.strftime('%H:%M:%S', time.localtime(timeStamp))
-    hourV = time.strftime('%H', time.localtime(timeStamp))
-    millsecondV = str(timeStamp).split(".")[1][:3]
-    return (ymdFV, hmsV + ":" + millsecondV, hourV, ymdBV)
+def dumpCanMetrics(dt):
+    app = App.get_running_app()
+    if app.truck_vars is None:
+        return
+    try:
+        dumpReport(metricsReport(app.truck_vars), metrics_file)
+    except OSError as e:
+        print('Could not write CAN metrics: ' + str(e))
 
 
-def liveUpdateTruck(outstr, livefeedNiraErrorFname, livefeedHmassFname, prevNiraError, YDM,
-                    tempL, curVarL, volumeL, numTank, maxNumTanks, prevSec):
+def connectToLogger(canV, canFilters=None):
     """
-    ...
+    Connect to Bus
     """
 
     app = App.get_running_app()
 
-    splt = outstr.strip().split(" ")
-
-    # Timestamp with date
-    monthNumToChar = {1: "Jan", 2: "Feb", 3: "Mar", 4: "Apr", 5: "May", 6: "Jun", 7: "Jul", 8: "Aug",
-                      9: "Sep", 10: "Oct", 11: "Nov", 12: "Dec"}
-    [dayV, monthV, yearV] = YDM[0].split(":")
-    hmsStr = ":".join(YDM[1].split(":")[:3])
-    outDate = " ".join([dayV, monthNumToChar[int(monthV)], yearV, hmsStr])
-
-    [railPressure, presT1, wheelSpeed] = curVarL
-    # date, can ID, hex value
-    if (outstr[0] != "*"):
-        try:
-            dateV = splt[0]
-            idV = splt[3].lower()[2:]
-            hexVsplt = splt[6:]
-            hexV = ""
-            for h in hexVsplt:
-                if len(h) == 1:
-                    hexV += "0" + h
-                elif len(h) == 2:
-                    hexV += h
-        except IndexError:
-            hexV = ""
-            idV = ""
-
-        if len(hexV) == 16:
-            #######################################################################################
-            # Nirai7LastFaultNumber_spnPropB_3E
-            if (idV == _canIdNira3):
-                dateCond0 = (len(splt[0]) != 12)
-                dateCond1 = ((len(splt[0]) == 13) and (len(splt[0].split(":")[-1]) == 4))
-
-                piCcond = ((len(hexV) != 16) or (dateCond0 and not (dateCond1)))
-
-                if piCcond:
-                    pass
-                else:
-                    nirai7LastFaultNumber = (enforceMaxV(((int(hexV[6:8], 16))), 255) * 1.0)
-
-                    app.error_code = str(int(nirai7LastFaultNumber))
-
-                    if prevNiraError == None:
-                        prevNiraError = nirai7LastFaultNumber
-                    elif nirai7LastFaultNumber != prevNiraError:
-
-                        'INSERT CODE HERE'
-
-            #######################################################################################
-            # Temperature and Pressure T1-T3
-            if (idV == _canIdTank123):
-                presT1 = (enforceMaxV(((int(hexV[0:2], 16)) +
-                                       ((int(hexV[2:4], 16) & 0b00001111) << 8)), 4015) * 0.1)
-                presT2 = (enforceMaxV((((int(hexV[2:4], 16) & 0b11110000) >> 4) +
-                                       ((int(hexV[4:6], 16)) << 4)), 4015) * 0.1)
-                tempL[0] = (enforceMaxV(((int(hexV[10:12], 16))), 250) * 1.0) - 40.0
-                tempL[1] = (enforceMaxV(((int(hexV[12:14], 16))), 250) * 1.0) - 40.0
-                tempL[2] = (enforceMaxV(((int(hexV[14:16], 16))), 250) * 1.0) - 40.0
-
-                app.pressures[0] = str("%.2f" % presT1) + ' bar'
-
-                app.temps[0] = str("%.2f" % tempL[0]) + '˚C'
-                app.temps[1] = str("%.2f" % tempL[1]) + '˚C'
-                app.temps[2] = str("%.2f" % tempL[2]) + '˚C'
-
-            #######################################################################################
-            # Temperature and Pressure T4-T6
-            elif (idV == _canIdTank456):
-                tempL[3] = (enforceMaxV(((int(hexV[10:12], 16))), 250) * 1.0) - 40.0
-                tempL[4] = (enforceMaxV(((int(hexV[12:14], 16))), 250) * 1.0) - 40.0
-                tempL[5] = (enforceMaxV(((int(hexV[14:16], 16))), 250) * 1.0) - 40.0
-
-                app.temps[3] = str("%.2f" % tempL[3]) + '˚C'
-                app.temps[4] = str("%.2f" % tempL[4]) + '˚C'
-                app.temps[5] = str("%.2f" % tempL[5]) + '˚C'
-
-
-
-            #######################################################################################
-            # Rail pressure
-            elif (idV == _canIdNira3):
-                railPressure = (enforceMaxV(((int(hexV[12:14], 16))), 4015) * 0.1)
-
-                app.pressures[1] = str('%.2f' % railPressure) + ' bar'
-
-            #######################################################################################
-            # Wheel-Based Vehicle Speed
-            elif (idV == _canIdWheelSpeed):
-                wheelSpeed = (enforceMaxV(((int(hexV[2:4], 16)) + ((int(hexV[4:6], 16)) << 8)),
-                                          64259) * 0.003906)
-            #######################################################################################
-            # Hydrogen injection rate
-            elif ((idV == "cff3f28") or (idV == "cff3ffa")):
-                app.HinjectionV = (enforceMaxV(((int(hexV[12:14], 16)) + ((int(hexV[14:16], 16)) << 8)), 64255) * 0.02)
-
-            #######################################################################################
-            # Hydrogen leakage
-
-            elif ((idV == "cff3e28") or (idV == "cff3efa")):
-                app.Hleakage = (enforceMaxV(((int(hexV[2:4], 16))), 250) * 0.4)
-
-            # Coolant temperature
-            elif (idV == "18feee00"):
-                coolant_temp = str((enforceMaxV(((int(hexV[0:2], 16))), 250) * 1.0) - 40.0)  # Unit = °C
-
-                if coolant_temp is not '':
-                    app.coolant_temp = coolant_temp + u' \u00BAC'
-
-            # Diagnostic Message 1 -- Active DTCs
-            elif (idV == "18feca00"):
-                DM1 = (enforceMaxV((((int(hexV[0:2], 16) & 0b11000000) >> 6)), 3) * 1.0)  # Unit = bit
+    try:
+        app.bus = can.interface.Bus(channel=canV, bustype='socketcan_native', can_filters=canFilters)
+    except OSError:
+        # The receiver catches this and tries again
+        print('Cannot find PiCAN board.')
+        raise
+    return app.bus
 
-                if DM1 == 0:
-                    app.mil_light = 'Lamp Off'
-                else:
-                    app.mil_light = 'Lamp On'
 
-            # Diesel particulate filter
-            elif (idV == "18fd7c00"):
+#################################################################################################################
+# The asyncio versions of the receive thread, the periodic toggle message and the publishing timer -- only used when run_mode is 'asyncio'
+#################################################################################################################
 
-                dpf = (enforceMaxV((((int(hexV[2:4], 16) & 0b00001100) >> 2)), 3) * 1.0)  # Unit = bit
+# Stands in for python-can's send_periodic task (same modify_data/stop) but sends from a coroutine on the app's loop instead of its own thread
+class AsyncPeriodicSend(object):
 
-                if dpf == 0:
-                    app.dpf_status = 'Not Active'
-                elif dpf == 1:
-                    app.dpf_status = 'Active'
-                elif dpf == 2:
-                    app.dpf_status = 'Regen Needed'
-                else:
-                    app.dpf_status = 'Not Available'
+    def __init__(self, bus, message, period):
+        self.bus = bus
+        self.message = message
+        self.period = period
+        self._future = asyncio.ensure_future(self._run())
 
-            # Mode requests
-            elif idV == 'cff3c17':
+    async def _run(self):
+        while True:
+            try:
+                self.bus.send(self.message)
+            except can.CanError:
+                print('Unable to send the toggle message')
+            await asyncio.sleep(self.period)
 
-                mode_being_requested = (enforceMaxV(((int(hexV[0:2], 16) & 0b00000011)), 3) * 1.0)  # Unit = bit
-                mode_num = (enforceMaxV((((int(hexV[0:2], 16) & 0b00001100) >> 2)), 3) * 1.0)  # Unit = bit
+    def modify_data(self, message):
+        self.message = message
 
-                if (mode_num == 0) or (mode_num == 1):
-                    app.current_mode = 'Hydrogen'
-                    # app.mode_num = str(mode_num)
-                elif mode_num == 2:
-                    app.current_mode = 'Diesel'
-                    # app.mode_num = str(mode_num)
+    def stop(self):
+        self._future.cancel()
 
-                # print(app.mode_being_requested)
 
-                if (mode_being_requested) == 0 or (mode_being_requested == 1):
+# Listens alongside the reader for the Notifier failing to read the bus (it stops reading when it does), so can_rx_coroutine can restart
+class BusErrorListener(can.Listener):
 
-                    app.truck_reqd = u'H\u2082 Mode '
-                    # app.mode_color = [235 / 255, 150 / 255, 72 / 255, 1]
+    def __init__(self):
+        self.exception = None
 
-                elif mode_being_requested == 2:
+    def on_message_received(self, message):
+        pass
 
-                    app.truck_reqd = 'Diesel Mode'
-                    # app.mode_color = [0.431, 0.431, 0.431, 1]
+    def on_error(self, exc):
+        self.exception = exc
 
-                else:
 
-                    app.truck_reqd = 'Missing'
-                    app.mode_color = [1, 0, 0, 1]
-
-                # if (app.mode_num == '0') or (app.mode_num == '1'):
-                #    app.engine_mode = u'H\u2082 Mode '
-                #    app.mode_color = [235 / 255, 150 / 255, 72 / 255, 1]
-                # elif app.mode_num == '2':
-                #    app.engine_mode = 'Diesel Mode'
-                #    app.mode_color = [0.431, 0.431, 0.431, 1]
-
-            #######################################################################################
-            # curHr = int(dateV.split(":")[1])
-            # if ((curHr in [0, 15, 30, 45]) and (curHr != lastQuarterHour)):
-            curSec = int(dateV.split(":")[2])
-            if curSec != prevSec:
-                ###################################################################################
-                # H mass calculation
-                HtotalMass = None
-                if (not (None in tempL) and (presT1 != None)):
-                    HtotalMassL = []
-                    for t in range(numTank):
-                        # Only consider tank 1 hydrogen pressure
-                        currHtotalMassT = hydrogenMassEq2(presT1, tempL[t], volumeL[t])
-                        HtotalMassL.append(currHtotalMassT)
-
-                    HtotalMass = round(sum(HtotalMassL), 1)
-                    app.hMass = HtotalMass
-
-                tempL = []
-                for i in range(maxNumTanks): tempL.append(None)
-                presT1 = None
-                railPressure = None
-                wheelSpeed = None
-
-                prevSec = curSec
-                # lastQuarterHour = curHr
-
-    curVarL = [railPressure, presT1, wheelSpeed]
-
-    return (prevNiraError, tempL, curVarL, prevSec)
-
-
-def connectToLogger(canV):
+async def can_rx_coroutine(app, service, recvTimeout=1.0, restartDelay=2.0):
     """
-    Connect to Bus
+    Connects to the bus (retrying until the PiCAN board is found) then hands every frame to the CAN service (which decodes it and passes
+    it on to its consumers) as the Notifier hands it over -- the Notifier watches the socket from the event loop itself so there is no
+    receive thread. Like the receive thread, anything that goes wrong while receiving is printed, the interface is taken down and brought
+    back up (off the loop) and it connects again restartDelay seconds later
     """
+    handleFrame = service.handleFrame
+    metrics = service.truckVars['metrics']
+    loop = asyncio.get_event_loop()
+    channels = ['can0', 'can1'][:numCAN]
 
-    app = App.get_running_app()
+    while True:
+        try:
+            bus = connectToLogger('can0')
+        except OSError:
+            await asyncio.sleep(restartDelay)
+            continue
 
-    try:
-        app.bus = can.interface.Bus(channel=canV, bustype='socketcan_native')
-    except OSError:
-        print('Cannot find PiCAN board.')
-        exit()
-    return app.bus
+        service.prepareBus(bus)
+        app.task = AsyncPeriodicSend(bus, app.toggle_msg, 0.2)
 
+        reader = can.AsyncBufferedReader()
+        errors = BusErrorListener()
+        notifier = can.Notifier(bus, [reader, errors], loop=loop)
+        try:
+            while True:
+                # The timeout is only there so a bus that has failed is noticed
+                try:
+                    message = await asyncio.wait_for(reader.get_message(), recvTimeout)
+                except asyncio.TimeoutError:
+                    if errors.exception is not None:
+                        raise errors.exception
+                    continue
+                # python-can doesn't report kernel drops, only how far behind the loop is
+                metrics.recordBatch(reader.buffer.qsize() + 1, 0)
+                handleFrame(message.timestamp, message.arbitration_id, message.data)
+
+                # Decode everything else that is already waiting before giving the loop back to Kivy
+                while True:
+                    try:
+                        message = reader.buffer.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    handleFrame(message.timestamp, message.arbitration_id, message.data)
+        except asyncio.CancelledError:
+            # The app is closing (an Exception before Python 3.8, so it has to be let through first)
+            raise
+        except Exception:
+            traceback.print_exc()
+            print('CAN receiver stopped, restarting in ' + str(restartDelay) + 's')
+            service.receiver.restarts += 1
+        finally:
+            notifier.stop()
+            app.task.stop()
+            try:
+                bus.shutdown()
+            except (can.CanError, OSError):
+                pass
 
-def setCANbaudRate(numCAN, bRate):
-    """
-    Make CAN interface to 250 or 500 kbps
-    """
-    os.system("sudo /sbin/ip link set can0 up type can bitrate " + str(bRate))
-    if numCAN == 2:
-        os.system("sudo /sbin/ip link set can1 up type can bitrate " + str(bRate))
-    time.sleep(0.1)
+        # Start again from a known state, same as the receive thread
+        await loop.run_in_executor(None, setCANdown, channels)
+        await loop.run_in_executor(None, setCANbaudRate, channels, bRate)
+        await asyncio.sleep(restartDelay)
 
 
-def hydrogenMassEq2(pressureV, tempV, volumeV):
+async def publish_coroutine(service):
     """
-    Calculate the hydrogen mass using more complex equation
-    Value returns in unit kilo grams
+    The asyncio version of the publisher timer -- sleeps until can_rx_coroutine has handed the service a frame, then publishes at most
+    display_rate times a second (every idle_publish_period seconds while the display is idle)
     """
+    newFrame = asyncio.Event()
+    service.wake = newFrame.set
+    while True:
+        service.waiting = True
+        await newFrame.wait()
+        newFrame.clear()
+        period = idle_publish_period if App.get_running_app().idle else 1.0 / display_rate
+        await asyncio.sleep(period)
+        publishLiveValues(period)
 
-    var1 = 0.000000001348034
-    var2 = 0.000000267013
-    var3 = 0.00004247859
-    var4 = 0.000001195678
-    var5 = 0.0003204561
-    var6 = 0.0867471
 
-    component1 = (((-var1 * (tempV ** 2)) + (var2 * tempV) - var3) * (pressureV ** 2))
-    component2 = ((var4 * (tempV ** 2)) - (var5 * tempV) + var6) * pressureV
+def canInterfaceUp():
+    # Make CAN interface to 250 or 500kbps
+    channels = ['can0', 'can1'][:numCAN]
+    setCANdown(channels)
+    setCANbaudRate(channels, bRate)
 
-    HmassTotal = (component1 + component2) * volumeV
-    HmassTotalKg = HmassTotal / 1000.0
 
-    return HmassTotalKg
+def asyncCanService():
+    """
+    The CAN service for asyncio mode -- its own receive thread is never started, can_rx_coroutine feeds it instead
+    """
+    signals = loadSignalTable(signal_file)
+    service = CanService(['can0', 'can1'][:numCAN], bRate, lambda: connectToLogger('can0'), signals, numTank, volumeL)
+    enableHistory(service.truckVars, history_period, history_max_kb * 1024)
+    addLoggerConsumers(service, signals)
+    return service
 
 
-def enforceMaxV(origV, maxV):
+async def run_async(app):
     """
-    ...
+    Runs the app, and the CAN work once the start up stages have made the service (see FuelGaugeApp.can_ready), on one asyncio loop.
+    Takes the CAN interface(s) down when the app closes
     """
-    if origV < maxV:
-        return origV
-    else:
-        return maxV
+    loop = asyncio.get_event_loop()
+    try:
+        await app.async_run(async_lib='asyncio')
+    finally:
+        for task in app.can_tasks:
+            task.cancel()
+        await asyncio.gather(*app.can_tasks, return_exceptions=True)
+        if app.can_service is not None:
+            app.can_service.close()
+        await loop.run_in_executor(None, setCANdown, ['can0', 'can1'][:numCAN])
 
 
 #################################################################################################################
@@ -482,8 +477,8 @@ def enforceMaxV(origV, maxV):
 #################################################################################################################
 
 # This function checks the value read by modeReader and checks what it is -- if it is 0 or 1 it sets the engine_mode string variable to 'H2\nMODE' which is just H2 MODE on separate lines, otherwise it sets the variable
-# to 'DIESEL\nMODE'. It also then changes the color of the text to either green or grey
-def truckEngineMode(dt):
+# to 'DIESEL\nMODE'. It also then changes the color of the text to either green or grey. Called whenever app.mode_num changes
+def truckEngineMode(*args):
     app = App.get_running_app()
 
     if (app.mode_num == '0') or (app.mode_num == '1'):
@@ -501,7 +496,7 @@ def stateUpdate(dt):
 
 
 # This checks what value the error_code variable has and if it has no value or is 255 then since there is no fault the function sets the error_base string variable to ' ' which is just blank
-# If error_code is any other number it then changes the error_base variable to a couple different things. This function is called repeatedly every 2s so it checks to see what error_base is currently
+# If error_code is any other number it then changes the error_base variable to a couple different things. While there is a fault this function is called every 2s so it checks to see what error_base is currently
 # if it is blank it changes it to 'FAULT' if it says 'FAULT' it changes it to the error code, and if it is the error code it changes it to 'FAULT' essentially flipping between displaying 'FAULT' and
 # the error code every 2s
 def errorMsg(dt):
@@ -518,96 +513,107 @@ def errorMsg(dt):
             app.error_base = 'FAULT'
 
 
-# This function just changes the current page to the 'third' which is what the screen saver page is defined as in the Kivy back end
-def callback(dt):
-    app = App.get_running_app()
-    # app.root.current just calls the the Kivy ScreenManger class that handles all of the screens and changes it to the screen defined as 'third'
-    app.root.current = 'third'
-
-
-# Is called every 10s and checks to see if the current time is equal to the stored dusk time -- If it is, and if the screen is not currently dimmed this will
-# proceed to set pin 18 to PWM and reduce it to 512 out of 1024
-def isDusk(dt):
+# Called whenever the fault code changes -- the flipping between 'FAULT' and the code (errorMsg) only runs while there is a fault, with no
+# fault the corner is cleared and nothing runs at all
+def faultChanged(*args):
     app = App.get_running_app()
-
-    dusk_today = app.dusk_time
-    now = time.strftime('%I:%m')
-    dimmed = app.screen_dim
-    print(now)
-
-    if (not dimmed) and (now == dusk_today):
-
-        try:
-            os.system('gpio -g pwm 18 75')
-        except OSError:
-            exit()
-
-        app.screen_dim = True
-
-
-# This function is called when the display first starts up -- it reads the stored sunset/dusk data file then extracts and stores the sunset time for the current day
-def getDuskTime():
-    dusk_file = open(display_code_dir + '2021PrinceGeorgeSunsets.txt', 'r')
-
-    dusk_list = dusk_file.readlines()
-
-    this_month = time.strftime('%m')
-    real_today = time.strftime('%d')
-
-    # Storing the sunset time for every day of the year would be a lot to sort through -- to speed things up only 5 days a month are used and the display assigns a
-    # 'sudo today' which is the closest stored date to the current day
-    if int(real_today) <= 3:
-        sudo_today = '1'
-    elif int(real_today) <= 10:
-        sudo_today = '7'
-    elif int(real_today) <= 17:
-        sudo_today = '14'
-    elif int(real_today) <= 23:
-        sudo_today = '20'
-    else:
-        sudo_today = '26'
-
-    for line in dusk_list:
-
-        dusk_month = line.split('>')[0].split('-')[1]
-        dusk_day = line.split('>')[0].split('-')[2]
-
-        if dusk_month == this_month:
-
-            dusk_time = line.split('>')[1].strip('\n')
-
-            if dusk_day == sudo_today:
-
-                if (int(this_month) > 3) or (int(this_month) < 11):
-                    DST = True
-
-                elif (int(this_month == 3)) and (int(real_today) >= 14):
-                    DST = True
-
-                elif (int(this_month == 11)) and (int(real_today) < 7):
-                    DST = True
-                else:
-                    DST = False
-
-                if DST == True:
-                    dhour = int(dusk_time.split(':')[0]) + 1
-                    dmin = int(dusk_time.split(':')[1])
-                    if dhour < 10:
-                        dusk_time = '0' + str(dhour) + ':' + str(dmin)
-                    else:
-                        dusk_time = str(dhour) + ':' + str(dmin)
-
-                print(dusk_time)
-
-                dusk_file.close()
-                return dusk_time
+    Clock.unschedule(errorMsg)
+    # Starts again from 'FAULT' so a new code is shown straight away
+    app.error_base = ''
+    errorMsg(0)
+    if app.error_base != '':
+        Clock.schedule_interval(errorMsg, 2)
+
+
+# Owns the screen saver: after 'delay' seconds without a touch anywhere on the screen it shows the screen saver and sets app.idle (which
+# slows the publishing right down, see App.on_idle). Touches are watched on the window itself so none of the pages have to do anything,
+# and the touch that wakes it is swallowed so it can't also press whatever button is under it
+class IdleManager(object):
+
+    def __init__(self, app, delay):
+        self.app = app
+        self.timer = Clock.create_trigger(self.go_idle, delay)
+        Window.bind(on_touch_down=self.on_touch_down)
+        self.timer()
+
+    def on_touch_down(self, window, touch):
+        if self.app.idle:
+            self.wake()
+            return True
+        # A trigger that is already scheduled ignores being called again, so it is cancelled first to start the delay over
+        self.timer.cancel()
+        self.timer()
+        return False
+
+    def go_idle(self, dt):
+        self.app.idle = True
+        # app.root.current just calls the Kivy ScreenManager class that handles all of the screens and changes it to the screen saver
+        self.app.root.current = 'Screensaver'
+
+    def wake(self):
+        self.app.idle = False
+        self.app.root.current = 'Fuel Gauge'
+        self.app.title_changer('Fuel Gauge')
+        self.timer()
+
+
+# Sets the backlight's PWM level on pin 18 (out of 1024)
+def setBacklight(level):
+    os.system('gpio -g pwm 18 ' + str(int(level)))
+
+
+# Dims the backlight at sunset and brings it back up at sunrise, worked out for wherever the truck is set up to be (see solar.py). There
+# is only ever one Clock event waiting, for the next sunrise or sunset (or the next re-check of the clock), and the change is faded in over
+# backlight_fade seconds in equal steps of brightness to the eye rather than jumping
+class BacklightScheduler(object):
+
+    def __init__(self, app):
+        self.app = app
+        self.level = None
+        self.target = None
+        self.fade_from = None
+        self.steps_done = 0
+
+    # Works out whether it is night now and when that next changes, sets the backlight to match and schedules itself for the change
+    def schedule(self, *args):
+        now = time.time()
+        (night, change) = nextTransition(now, latitude, longitude, time_zone)
+        self.app.screen_dim = night
+        self.fade_to(backlight_night if night else backlight_day)
+        # The Pi has no clock of its own and is often set from the network after the display has started, so it is never left longer
+        # than backlight_recheck before working it out again
+        delay = backlight_recheck if change is None else min(change - now, backlight_recheck)
+        Clock.schedule_once(self.schedule, max(delay, 1))
+
+    def fade_to(self, target):
+        if self.level is None:
+            # When the display starts it is just set (by the background start up stage), there is nothing to fade from
+            self.level = self.target = target
+            return
+        if target == self.target:
+            return
+        self.target = target
+        self.fade_from = self.level
+        self.steps_done = 0
+        Clock.unschedule(self.fade_step)
+        Clock.schedule_interval(self.fade_step, backlight_fade / backlight_steps)
+
+    def fade_step(self, dt):
+        self.steps_done += 1
+        # Brightness looks the same step to step when each step is the same ratio, not the same difference
+        ratio = float(max(self.target, 1)) / max(self.fade_from, 1)
+        self.level = int(round(max(self.fade_from, 1) * (ratio ** (float(self.steps_done) / backlight_steps))))
+        setBacklight(self.level)
+        if self.steps_done >= backlight_steps:
+            return False
 
 
 def bus_activator(dt):
     app = App.get_running_app()
 
     try:
-        app.bus = can.interface.Bus(channel='can0', bustype='socketcan_native')
+        app.bus = can.interface.Bus(channel='can0', bustype='socketcan_native',
+                                    can_filters=canFiltersFor([app.toggle_msg.arbitration_id]))
         print('Found PiCAN board!')
     except OSError:
         print('Cannot find PiCAN board')
@@ -622,6 +628,128 @@ def bus_activator(dt):
         return
 
 
+# Moves a gauge value towards its latest reading with a critically damped spring -- the fastest possible approach that never overshoots,
+# so the needle glides to the new value instead of jumping (and jittering when the reading flips between two rounding steps). Frames are only
+# scheduled, at most needle_fps a second, while the needle is actually moving; once it has settled the animation stops until the next new target
+class NeedleAnimator(object):
+
+    def __init__(self, apply, response=needle_response, fps=needle_fps, settle=0.01):
+        # apply is called with the new value on every animation frame
+        self.apply = apply
+        self.response = response
+        self.fps = fps
+        self.settle = settle
+        self.value = None
+        self.velocity = 0.0
+        self.target = None
+        self._event = None
+
+    def set_target(self, target):
+        self.target = target
+
+        # The very first reading is shown straight away
+        if self.value is None:
+            self.value = target
+            self.apply(target)
+            return
+
+        if (self._event is None) and (target != self.value):
+            self._event = Clock.schedule_interval(self._step, 1.0 / self.fps)
+
+    # Jumps straight to the target and stops animating (used when the page isn't being shown anyway)
+    def snap(self):
+        self.stop()
+        if self.target is not None:
+            self.value = self.target
+            self.velocity = 0.0
+            self.apply(self.target)
+
+    def stop(self):
+        if self._event is not None:
+            self._event.cancel()
+            self._event = None
+
+    def _step(self, dt):
+        # A long gap between frames (the app was busy) shouldn't make the needle leap
+        dt = min(dt, 0.1)
+        w = self.response
+
+        # Exact solution of the critically damped spring over dt, so it stays stable at any frame rate
+        offset = self.value - self.target
+        decay = math.exp(-w * dt)
+        temp = (self.velocity + (w * offset)) * dt
+        offset = (offset + temp) * decay
+        self.velocity = (self.velocity - (w * temp)) * decay
+
+        if (abs(offset) < self.settle) and (abs(self.velocity) < self.settle):
+            self.value = self.target
+            self.velocity = 0.0
+            self.apply(self.value)
+            self._event = None
+            # Returning False unschedules the interval
+            return False
+
+        self.value = self.target + offset
+        self.apply(self.value)
+
+
+# A small trend line of one signal's recent history (see signal_history.py). The history is squashed down to a (min, max) pair per pixel
+# column before it is drawn, so drawing it costs the same however much history there is. Its page calls refresh() while it is being shown
+class Sparkline(Widget):
+    signal = StringProperty('')
+    title = StringProperty('')
+    span = NumericProperty(trend_span)
+    points = ListProperty([])
+    range_text = StringProperty('')
+
+    def on_size(self, *args):
+        self.refresh()
+
+    def on_pos(self, *args):
+        self.refresh()
+
+    def refresh(self, *args):
+        truck_vars = getattr(App.get_running_app(), 'truck_vars', None)
+        history = None if truck_vars is None else truck_vars['history']
+        if (history is None) or (self.signal not in history.index) or (self.width < 2) or (history.count < 2):
+            self.points = []
+            self.range_text = ''
+            return
+
+        # Up to now rather than the last sample, so the line stops short if the samples stopped
+        columns = history.downsample(self.signal, self.span, self.width, time.time())
+        filled = [c for c in columns if c is not None]
+        if not filled:
+            self.points = []
+            self.range_text = ''
+            return
+        low = min(c[0] for c in filled)
+        high = max(c[1] for c in filled)
+        self.range_text = '%.1f - %.1f' % (low, high)
+
+        # A flat line sits in the middle instead of along the bottom
+        if high == low:
+            low -= 1
+            high += 1
+        scale = (self.height * 0.9) / (high - low)
+        bottom = self.y + (self.height * 0.05)
+        points = []
+        for (x, column) in enumerate(columns):
+            if column is None:
+                continue
+            points += [self.x + x, bottom + ((column[0] - low) * scale)]
+            if column[1] != column[0]:
+                points += [self.x + x, bottom + ((column[1] - low) * scale)]
+        self.points = points
+
+
+# Redraws all of the trend lines on a page
+def refreshTrends(screen):
+    for widget in screen.walk():
+        if isinstance(widget, Sparkline):
+            widget.refresh()
+
+
 #################################################################################################################
 
 
@@ -629,31 +757,29 @@ def bus_activator(dt):
 #################################################################################################################
 # This is the screen saver page -- for its design/visual setup look in the Kivy back end code (in the 'root_widget')
 class ScreenSaver(Screen):
-    # Sets the speed that the logo will travel at based on the size of the screen
-    velocity = ListProperty([Window.width / 200, Window.height / 200])
-    screen_pos = ListProperty([0, 0])
+    # How far the logo is from the bottom left corner -- the kv file applies it as a Translate on the logo's canvas, so each step only
+    # changes one matrix on the GPU instead of laying the logo out again
+    logo_offset = ListProperty([0, 0])
 
-    # Updates the position of the Hydra logo (animates it)
-    def update(self, dt):
-        self.screen_pos[0] += self.velocity[0]
-        self.screen_pos[1] += self.velocity[1]
-        if self.screen_pos[0] < 0 or self.screen_pos[0] > ((Window.width * 2 / 3)):
-            self.velocity[0] *= -1
-        # or (self.screen_pos[1] + self.height) > Window.height
-        if self.screen_pos[1] < 0 or self.screen_pos[1] > (Window.height * (1 - (1.8 * (2.5 / 12)))):
-            self.velocity[1] *= -1
-
-    app = App.get_running_app()
+    def __init__(self, **kwargs):
+        super(ScreenSaver, self).__init__(**kwargs)
+        # Pixels a second in x and y, the sign flips when the logo reaches an edge
+        self.velocity = [saver_speed, saver_speed]
 
+    # Moves the Hydra logo on by however long it has been since the last step (animates it)
+    def update(self, dt):
+        limits = (Window.width * 2 / 3, Window.height * (1 - (1.8 * (2.5 / 12))))
+        offset = list(self.logo_offset)
+        for i in range(2):
+            offset[i] += self.velocity[i] * dt
+            if (offset[i] < 0) or (offset[i] > limits[i]):
+                self.velocity[i] *= -1
+                offset[i] = min(max(offset[i], 0), limits[i])
+        self.logo_offset = offset
+
+    # The screen saver is slow moving anyway, so a few steps a second is plenty
     def on_enter(self):
-        Clock.unschedule(callback)
-        Clock.schedule_interval(self.update, 1 / 120)
-
-    # Special Kivy function that runs its code when the user touches the screen and releases
-    def on_touch_up(self, touch):
-        if self.collide_point(*touch.pos):
-            # Since this page is the screen saver there is no timer/delay to reset, however when the user touches the screen saver and 'wakes' the device the app will return to the main menu
-            self.manager.current = 'menu'
+        Clock.schedule_interval(self.update, 1.0 / saver_fps)
 
     def on_leave(self):
         Clock.unschedule(self.update)
@@ -666,30 +792,44 @@ class FuelGaugeLayout(Screen):
     dash_label = StringProperty()
     percent_label = StringProperty()
 
-    def mass_reader(self, dt):
+    def __init__(self, **kwargs):
+        super(FuelGaugeLayout, self).__init__(**kwargs)
+        # The needle animates 'dash_val' towards the latest reading
+        self.needle = NeedleAnimator(lambda value: setattr(self, 'dash_val', value))
+
+    # Called with the new value whenever app.hMass changes while the page is shown
+    def mass_reader(self, *args):
         app = App.get_running_app()
+        if app.hMass is None:
+            self.needle.set_target(0)
+            self.percent_label = 'NA'
+            self.dash_label = 'NA'
+            return
         # Divides the current hydrogen mass by the maximum possible then multiplies by 100 to get a percentage
-        # then assigns this value to the 'dash_val' variable
-        self.dash_val = ((app.hMass / 20.7) * 100)
+        # then hands this to the needle which moves 'dash_val' there
+        percent = ((app.hMass / 20.7) * 100)
+        self.needle.set_target(percent)
 
-        self.percent_label = '%.2f' % self.dash_val
+        self.percent_label = '%.2f' % percent
 
         self.dash_label = '%.2f' % app.hMass
 
     # Kivy function runs code on entering the page
     def on_enter(self):
-        Clock.schedule_once(self.mass_reader)
-        Clock.schedule_once(callback, delay)
-        Clock.schedule_interval(self.mass_reader, 0.2)
+        self.mass_reader()
+        App.get_running_app().bind(hMass=self.mass_reader)
+        # The trend line only needs redrawing when a new sample has been taken
+        self.trend_update(0)
+        Clock.schedule_interval(self.trend_update, history_period)
 
-    # Kivy function runs code when the user touches and releases on the screen. This is the delay reset for the screen saver
-    def on_touch_up(self, touch):
-        Clock.unschedule(callback)
-        Clock.schedule_once(callback, delay)
+    def trend_update(self, dt):
+        refreshTrends(self)
 
     # Same as in the other classes
     def on_leave(self):
-        Clock.unschedule(callback)
+        App.get_running_app().unbind(hMass=self.mass_reader)
+        Clock.unschedule(self.trend_update)
+        self.needle.snap()
 
 
 # FuelInjectionLayout is the second screen and does what it says on the tin -- it displays the current H2 injection rate
@@ -698,73 +838,91 @@ class FuelInjectionLayout(Screen):
     hInjection = StringProperty()
     leak_display = StringProperty()
 
+    def __init__(self, **kwargs):
+        super(FuelInjectionLayout, self).__init__(**kwargs)
+        # The injection reading glides to new values the same way the fuel gauge needle does
+        self.injection_needle = NeedleAnimator(lambda value: setattr(self, 'hInjection', '%.2f' % value))
+
     # Same as in the other classes, calls functions as the user enters the page. Upon_entering has the same function as upon_entering_mass and just calls the functions after a 0.5s
     # delay to avoid any issues
     def on_enter(self):
-        Clock.schedule_once(self.injection_reader)
-        Clock.schedule_interval(self.injection_reader, 0.2)
-        # Same as in fuel gauge screen
-        Clock.schedule_once(callback, delay)
+        self.injection_reader()
+        App.get_running_app().bind(HinjectionV=self.injection_reader, Hleakage=self.injection_reader)
+        self.trend_update(0)
+        Clock.schedule_interval(self.trend_update, history_period)
         # Ticker is what checks to see if the time is at a 15min +1 time interval
 
-    # Kivy function that runs code after the user touches the screen
-    def on_touch_up(self, touch):
-        Clock.unschedule(callback)
-        Clock.schedule_once(callback, delay)
+    # Same as in fuel gauge screen
+    def trend_update(self, dt):
+        refreshTrends(self)
 
-    # This function opens the file that contains the data about the injection rate, reads it and sets it to some variables
-    def injection_reader(self, dt):
+    # Takes the latest injection rate and leakage, called whenever either of them changes while the page is shown
+    def injection_reader(self, *args):
         app = App.get_running_app()
 
         # hInj -- This is the variable that contains the injection rate value
 
-        self.hInjection = '%.2f' % app.HinjectionV
+        self.injection_needle.set_target(app.HinjectionV)
 
         leakAmt = app.Hleakage
         self.leak_display = '%.2f' % app.Hleakage
 
     # Same as in the other classes
     def on_leave(self):
-        Clock.unschedule(callback)
-        Clock.unschedule(self.injection_reader)
+        App.get_running_app().unbind(HinjectionV=self.injection_reader, Hleakage=self.injection_reader)
+        Clock.unschedule(self.trend_update)
+        self.injection_needle.snap()
 
 
 # This is the page that displays the Fault code and its corresponding message
 class ErrorPage(Screen):
     error_expl = StringProperty('Missing')
 
-    # Same as in the other classes
-    def on_touch_up(self, touch):
-        Clock.unschedule(callback)
-        Clock.schedule_once(callback, delay)
+    # One page of the fault history (newest first), which page it is and how many there are
+    history_text = StringProperty('')
+    history_page = NumericProperty(0)
+    history_pages = NumericProperty(1)
 
-    # Same as in the other classes, apart from the bottom bit
-    def code_checker(self, dt):
+    # Called whenever the fault code changes while the page is shown
+    def code_checker(self, *args):
         app = App.get_running_app()
 
-        # This part checks to see if the error code is 255 as this means that there is no fault or if the code is greater than 233 as this is out of the possible range of
-        # fault codes, if it is 255 it sets the message to 'Everything is running as expected' and if the code is greater than 233 it sets it as 'ERROR: Code outside of range'
+        # The description is looked up by the code in the fault table -- 255 means there is no fault and a code that isn't in the table
+        # shows as 'Invalid Code'
         try:
             e_c = int(app.error_code)
         except ValueError:
             return ()
 
-        if e_c == 255:
-            self.error_expl = 'Running as expected'
-        elif int(app.error_code) >= 233:
-            self.error_expl = 'Invalid Code'
-        else:
-            self.error_expl = app.error_list[e_c]
+        self.error_expl = describeFault(app.fault_table, e_c)
+
+    # Shows one page of the fault history, each page is read straight from where it is in the history file
+    def show_history_page(self, page):
+        app = App.get_running_app()
+        history = None if app.truck_vars is None else app.truck_vars['faultHistory']
+        if history is None:
+            self.history_text = 'No fault history'
+            return
+        self.history_pages = history.pages(fault_history_page_size)
+        self.history_page = min(max(page, 0), self.history_pages - 1)
+        changes = history.page(self.history_page, fault_history_page_size)
+        lines = [formatChange(change, app.fault_table) for change in changes] or ['No faults recorded']
+        self.history_text = 'Fault history (page %d of %d)\n' % (self.history_page + 1, self.history_pages) + '\n'.join(lines)
+
+    # Called whenever a new fault change has been recorded while the page is shown
+    def history_changed(self, *args):
+        self.show_history_page(self.history_page)
 
     # Same as in the other class
     def on_enter(self):
-        Clock.schedule_once(self.code_checker)
-        Clock.schedule_interval(self.code_checker, 0.2)
-        Clock.schedule_once(callback, delay)
+        self.code_checker()
+        App.get_running_app().bind(error_code=self.code_checker)
+        self.show_history_page(0)
+        App.get_running_app().bind(fault_history_count=self.history_changed)
 
     def on_leave(self):
-        Clock.unschedule(self.code_checker)
-        Clock.unschedule(callback)
+        App.get_running_app().unbind(error_code=self.code_checker)
+        App.get_running_app().unbind(fault_history_count=self.history_changed)
 
 
 # This is the screen that displays the temperatures and pressures of the tanks and lines from the tanks
@@ -773,14 +931,15 @@ class TankTempPress(Screen):
     # Nothing fancy happens on this page, all of the data collection/displaying is handled by the main app class in addition to the kivy code file (fuelgauge.kv)
 
     def on_enter(self):
-        Clock.schedule_once(callback, delay)
+        # Same as in fuel gauge screen
+        self.trend_update(0)
+        Clock.schedule_interval(self.trend_update, history_period)
 
-    def on_touch_up(self, touch):
-        Clock.unschedule(callback)
-        Clock.schedule_once(callback, delay)
+    def trend_update(self, dt):
+        refreshTrends(self)
 
     def on_leave(self):
-        Clock.unschedule(callback)
+        Clock.unschedule(self.trend_update)
 
 
 # This is the screen manager that holds all of the other pages together
@@ -796,17 +955,6 @@ class Mode(Screen):
 
         # app.title_changer('Engine Mode')
 
-        Clock.schedule_once(callback, delay)
-
-    # Kivy function runs code when the user touches and releases on the screen. This is the delay reset for the screen saver
-    def on_touch_up(self, touch):
-        Clock.unschedule(callback)
-        Clock.schedule_once(callback, delay)
-
-    # Same as in the other classes
-    def on_leave(self):
-        Clock.unschedule(callback)
-
 
 # This is the lock screen where technicians can lock or unlock the engine mode toggle button -- accessed by hitting the engine mode descriptor
 class ModeLocking(Screen):
@@ -819,14 +967,6 @@ class ModeLocking(Screen):
     def on_enter(self):
         # When the user enters the screen checks the current lock status
         Clock.schedule_once(self.launch_status)
-        Clock.schedule_once(callback, delay)
-
-    def on_touch_up(self, touch):
-        Clock.unschedule(callback)
-        Clock.schedule_once(callback, delay)
-
-    def on_leave(self):
-        Clock.unschedule(callback)
 
     # Checks the current lock status and sets the descriptor text accordingly
     def launch_status(self, dt):
@@ -874,37 +1014,40 @@ class ModeLocking(Screen):
 
 class Message_settings(Screen):
     def on_enter(self):
-        Clock.schedule_once(callback, delay)
-
-    # Kivy function runs code when the user touches and releases on the screen. This is the delay reset for the screen saver
-    def on_touch_up(self, touch):
-        Clock.unschedule(callback)
-        Clock.schedule_once(callback, delay)
+        # The CAN metrics are only worked out while they are on screen
+        updateCanStats(0)
+        Clock.schedule_interval(updateCanStats, 1)
 
     # Same as in the other classes
     def on_leave(self):
-        Clock.unschedule(callback)
+        Clock.unschedule(updateCanStats)
 
 
 # The main app class that everything runs off of
 class FuelGaugeApp(App):
-    os.system('gpio -g mode 18 pwm')
-    os.system('gpio -g pwm 18 1024')
 
     ####################################################################################################
     # Variable declarations
     ####################################################################################################
+    # Nothing in here reads a file or touches the hardware -- they all start with the values the first frame is drawn with and are
+    # filled in by the start up stages (see start_deferred) once the first frame is on the screen
     temps = ListProperty(['NA', 'NA', 'NA', 'NA', 'NA', 'NA'])
     pressures = ListProperty(['NA', 'NA'])
-    font_file = StringProperty(display_code_dir + 'Montserrat-Regular.ttf')
-    bold_font_file = StringProperty(display_code_dir + 'Montserrat-Bold.ttf')
+    # The fonts are registered with Kivy by name and the images come from the atlas if it has been built (see ui_assets.py), so every
+    # screen shares the same font and textures -- both are set up in build() before the screens are made, Kivy's own font until then
+    font_file = StringProperty('Roboto')
+    bold_font_file = StringProperty('Roboto')
+    image_sources = {}
+    drop_image = StringProperty('')
+    gauge_image = StringProperty('')
+    needle_image = StringProperty('')
+    logo_image = StringProperty('')
     current_page = StringProperty('Fuel Gauge')
     dropdown_list = ListProperty(
         ['Fuel Gauge', 'Injection Rate', 'Engine Mode', 'Temp & Press', 'Fault Info', 'CAN Settings'])
     mode_being_requested = int
-    error_list = []
-    mode_num = str
-    error_code_list = []
+    # {code: (number, description, detail)} from faultmessages.txt (see fault_table.py)
+    fault_table = {}
     screen_dim = False
     Hleakage = NumericProperty()
     HinjectionV = NumericProperty()
@@ -913,128 +1056,186 @@ class FuelGaugeApp(App):
     dpf_status = StringProperty('Missing')
     current_mode = StringProperty('Missing')
     truck_reqd = StringProperty()
-    # The 0 inside the brackets is providing an initial value for hMass -- required or else something breaks
-    hMass = NumericProperty(0)
+    # The 0 inside the brackets is providing an initial value for hMass -- required or else something breaks. It is None while there
+    # are no recent tank temperatures and pressure to work it out from
+    hMass = NumericProperty(0, allownone=True)
     # error_code is a string variable that is used to temporarily store the current error code taken from the text document it is stored in. It is a string because after coming from the .txt the data is a string and
     # must be converted into a float or int to be used as a number
     error_code = StringProperty('Missing')
     # error_base is the text that is displayed in the top left hand of most screens -- if there is a fault this variable becomes "FAULT" and then the error code and flips between them
     # It is a StringProperty() which is a Kivy variable type the essentially tells the Kivy back end code to keep checking what its value is/if it changes
     error_base = StringProperty()
+    # The CAN receive/decode metrics shown on the CAN Settings screen
+    can_stats = StringProperty('')
+    # How many fault changes have been recorded, it changes whenever a new one is (see faultHistoryChanged)
+    fault_history_count = NumericProperty(0)
+    # True while the screen saver is up (set by the IdleManager)
+    idle = BooleanProperty(False)
     # The conversion factor is for changing the discrete data values into a specific angle of rotation for the gauges
     conversion_factor = cf
-    dusk_time = getDuskTime()
-
-    ####################################################################################################
-    # Extracting data from the stored text files
-    ####################################################################################################
-
-    # Opens the NIRA error code file and saves th error codes to error_code_list
-    with open(display_code_dir + 'faultmessages.txt',
-              'r') as f:
-        lines = f.readlines()
-        # Goes line by line and adds the error codes to the 'error_code_list' list
-        for l in lines:
-            error_code_list.append(l.split(',')[0])
-        f.close()
-
-    # Opens the NIRA error code file and saves the fault code descriptions to error_list
-    with open(display_code_dir + 'faultmessages.txt',
-              'r') as f:
-        lines = f.readlines()
-        # Goes line by line and adds the error messages to the 'error_list' list
-        for l in lines:
-            error_list.append(l.split(',')[2])
-        f.close()
-
-    # lock_file.txt and fuel_file.txt contains and holds the lock and engine mode statuses so they are saved after the screen is turned off
-    # Tries to open the file -- if it isn't there it creates it with a default value
-    if os.path.isfile(display_code_dir + "lock_file.txt"):
-        fin = open(display_code_dir + "lock_file.txt", "rt")
-        lock_status = fin.read()
-        fin.close()
-    else:
-        fin = open(display_code_dir + "lock_file.txt", "w")
-        fin.write('0')
-        lock_status = '0'
-        fin.close()
-
-    if os.path.isfile(display_code_dir + "fuel_file.txt"):
-        fin = open(display_code_dir + "fuel_file.txt", "rt")
-        mode_num = fin.read().strip('\n')
-        fin.close()
-    else:
-        fin = open(display_code_dir + "fuel_file.txt", "w")
-        fin.write('2')
-        mode_num = '2'
-        fin.close()
 
-    if os.path.isfile(display_code_dir + "arbitration_file.txt"):
-        fin = open(display_code_dir + "arbitration_file.txt", "r+")
+    # The lock and engine mode statuses and the toggle message's arbitration ID, until load_state has read the stored ones
+    lock_status = '0'
+    arb_id = '0xCFF41F2'
+    arb_address = StringProperty(arb_id)
+    source_id = StringProperty(arb_id[7:9])
+    dest_id = StringProperty(arb_id[5:7])
 
-        stored_id = fin.read()
-        print(stored_id)
+    # The top right corner display zone starts off as Diesel mode, mode_num is a Kivy property so the corner display follows it when
+    # the stored mode is read (see on_mode_num)
+    mode_num = StringProperty('2')
+    engine_mode = StringProperty('Diesel Mode')
+    alignment = StringProperty('center')
+    mode_color = ListProperty([0.431, 0.431, 0.431, 1])
+    msg_data = [0, 0, 0, 0, 0, 0, 0, 0]
 
-        if stored_id == '':
-            arb_id = '0xCFF41F2'
-            arb_address = StringProperty(arb_id)
-            fin.write(arb_id)
-            fin.close()
-        else:
-            arb_id = stored_id
-            arb_address = StringProperty(arb_id)
-            fin.close()
-    else:
-        fin = open(display_code_dir + "arbitration_file.txt", "w")
-        arb_id = '0xCFF41F2'
-        fin.write(arb_id)
-        arb_address = StringProperty(arb_id)
-        fin.close()
+    toggle_msg = can.Message(arbitration_id=0xCFF41F2, data=msg_data, is_extended_id=True)
 
-    # Declaring variables and giving them data from the stored/extracted text files
-    source_id = StringProperty(arb_id[7:9])
-    dest_id = StringProperty(arb_id[5:7])
+    # Set once the background start up stage has brought the CAN service up (see can_ready), in asyncio mode can_tasks are then the
+    # receive and publish coroutines running on Kivy's event loop
+    can_service = None
+    truck_vars = None
+    can_tasks = ()
+    stopped = False
 
     ####################################################################################################
-    # Determines what the current engine mode is (H2 or Diesel) and sets the initial value for the top right corner display zone
+    # Start up -- build() only sets up the fonts and images and makes the screens, everything else is run as timed stages after the first
+    # frame is drawn: the small stored files on the main thread (their values are on the screen), then the backlight and the CAN bring
+    # up on a background thread (in either run mode)
     ####################################################################################################
-    if (mode_num == '0') or (mode_num == '1'):
-        engine_mode = StringProperty(u'H\u2082 Mode ')
-        alignment = StringProperty('right')
-        mode_color = ListProperty([235 / 255, 150 / 255, 72 / 255, 1])
-        msg_data = [1, 0, 0, 0, 0, 0, 0, 0]
-    elif mode_num == '2':
-        engine_mode = StringProperty('Diesel Mode')
-        alignment = StringProperty('center')
-        mode_color = ListProperty([0.431, 0.431, 0.431, 1])
-        msg_data = [0, 0, 0, 0, 0, 0, 0, 0]
+    # Made in build(), it reads when the process started from /proc
+    boot = None
+
+    # Called after every frame swap until the first one
+    def first_frame(self, *args):
+        Window.unbind(on_flip=self.first_frame)
+        self.boot.mark('first frame')
+        Clock.schedule_once(self.start_deferred)
+
+    def start_deferred(self, dt):
+        self.boot.stage('state files', self.load_state)
+        self.boot.stage('fault table', self.load_faults)
+        self.boot.stage('backlight schedule', self.backlight.schedule)
+        # Saves the CAN metrics for looking at later
+        Clock.schedule_interval(dumpCanMetrics, metrics_dump_period)
+        thread = threading.Thread(target=self.background_start, name='display_start')
+        thread.daemon = True
+        thread.start()
+
+    # The lock and engine mode statuses and the arbitration ID are saved in lock_file.txt, fuel_file.txt and arbitration_file.txt so
+    # they are kept when the screen is turned off -- if a file isn't there it is created with a default value
+    def load_state(self):
+        if os.path.isfile(display_code_dir + "lock_file.txt"):
+            with open(display_code_dir + "lock_file.txt", "rt") as fin:
+                self.lock_status = fin.read()
+        else:
+            with open(display_code_dir + "lock_file.txt", "w") as fin:
+                fin.write('0')
+            self.lock_status = '0'
 
-    ####################################################################################################
-    # These are the scheduled functions -- functions that are called every delay (###, delay) seconds
-    ####################################################################################################
-    # This calls errorMsg every 2 seconds to constantly change the error notification text from "FAULT" to the error code, or if there is no error it sets the text to blank
-    Clock.schedule_interval(errorMsg, 2)
-    Clock.schedule_interval(isDusk, 5)
-    # This checks the value of the engine mode number every 2 seconds and changes the notification text if needed
-    Clock.schedule_interval(truckEngineMode, 2)
-    # Starts Calvin's CAN message reading code in another thread so that it is constantly reading while the display is active
-    a = Thread(target=msg_receiving)
-    a.start()
+        if os.path.isfile(display_code_dir + "fuel_file.txt"):
+            with open(display_code_dir + "fuel_file.txt", "rt") as fin:
+                mode_num = fin.read().strip('\n')
+        else:
+            with open(display_code_dir + "fuel_file.txt", "w") as fin:
+                fin.write('2')
+            mode_num = '2'
+
+        if os.path.isfile(display_code_dir + "arbitration_file.txt"):
+            with open(display_code_dir + "arbitration_file.txt", "r+") as fin:
+                stored_id = fin.read()
+                print(stored_id)
+                if stored_id == '':
+                    fin.write(self.arb_id)
+                else:
+                    self.arb_id = stored_id
+        else:
+            with open(display_code_dir + "arbitration_file.txt", "w") as fin:
+                fin.write(self.arb_id)
 
-    try:
-        bus = can.interface.Bus(channel='can0', bustype='socketcan_native')
-    except OSError:
-        print('Cannot find PiCAN board.')
-        Clock.schedule_once(bus_activator)
-        pass
+        # Declaring variables and giving them data from the stored/extracted text files
+        self.arb_address = self.arb_id
+        self.source_id = self.arb_id[7:9]
+        self.dest_id = self.arb_id[5:7]
 
-    toggle_msg = can.Message(arbitration_id=0xCFF41F2, data=msg_data, is_extended_id=True)
+        # Sets the corner display zone (through on_mode_num) and the toggle message's data for the stored engine mode
+        if (mode_num == '0') or (mode_num == '1'):
+            self.msg_data = [1, 0, 0, 0, 0, 0, 0, 0]
+        else:
+            self.msg_data = [0, 0, 0, 0, 0, 0, 0, 0]
+        self.toggle_msg.data = self.msg_data
+        self.mode_num = mode_num
+
+    # The NIRA fault descriptions by code, from the compiled cache of faultmessages.txt when it is up to date
+    def load_faults(self):
+        self.fault_table = loadFaultTable(fault_file)
+
+    # Everything that waits on the hardware, run on its own thread so none of it holds up the screen
+    def background_start(self):
+        # Full brightness to start with
+        self.boot.stage('backlight', self.backlight_on)
+        if run_mode == 'asyncio':
+            # Only the interface and the service are made here, the receiving, toggle message and publishing run as coroutines on Kivy's
+            # loop once can_ready has started them
+            self.boot.stage('CAN interface', canInterfaceUp)
+            service = self.boot.stage('CAN service', asyncCanService)
+            if service is not None:
+                Clock.schedule_once(lambda dt: self.can_ready(service))
+        else:
+            # Starts Calvin's CAN message reading code in another thread so that it is constantly reading while the display is active
+            service = self.boot.stage('CAN service', msg_receiving)
+            if service is not None:
+                Clock.schedule_once(lambda dt: self.can_ready(service[0]))
+            self.boot.stage('toggle message', self.start_toggle_bus)
+        self.boot.save()
+
+    # At the day or night level the backlight schedule has just worked out
+    def backlight_on(self):
+        os.system('gpio -g mode 18 pwm')
+        setBacklight(self.backlight.level if self.backlight.level is not None else backlight_day)
+
+    # Back on the main thread once the CAN service is receiving
+    def can_ready(self, service):
+        # The app was closed while the service was starting, it is taken down here as on_stop never saw it -- closing it finishes off the
+        # log files and stops the archiver
+        if self.stopped:
+            if run_mode == 'threads':
+                service.stop()
+                service.receiver.join(5)
+            service.close()
+            return
+        self.can_service = service
+        self.truck_vars = service.truckVars
+        if run_mode == 'asyncio':
+            self.can_tasks = [asyncio.ensure_future(can_rx_coroutine(self, service)),
+                              asyncio.ensure_future(publish_coroutine(service))]
+            return
+        # Pushes the values decoded by the CAN receive thread to the display -- the receive thread fires the trigger on the first frame
+        # after each publish and it runs 1/display_rate seconds later (a Kivy trigger can be fired from any thread). Anything that
+        # arrived before this is published straight away
+        service.wake = publishTrigger(self.idle)
+        service.waiting = False
+        service.wake()
+
+    # This bus is only used for sending the toggle message -- the filter only lets through our own ID (which nothing else sends)
+    # so the kernel doesn't wake this socket for every frame on the truck bus
+    def start_toggle_bus(self):
+        try:
+            if replay_files:
+                # Nothing to send to when replaying
+                self.bus = NullBus()
+            else:
+                self.bus = can.interface.Bus(channel='can0', bustype='socketcan_native',
+                                             can_filters=canFiltersFor([self.toggle_msg.arbitration_id]))
+        except OSError:
+            print('Cannot find PiCAN board.')
+            Clock.schedule_once(bus_activator)
+            return
 
-    try:
-        task = bus.send_periodic(toggle_msg, 0.2)
-    except NameError:
-        Clock.schedule_once(bus_activator)
-        pass
+        try:
+            self.task = self.bus.send_periodic(self.toggle_msg, 0.2)
+        except NameError:
+            Clock.schedule_once(bus_activator)
 
     ####################################################################################################
     # These are the functions that are used by the kivy side of the app -- they are defined here so that they can be accessed by the
@@ -1043,8 +1244,71 @@ class FuelGaugeApp(App):
 
     # Runs the screen manager that sets everything in motion
     def build(self):
+        self.boot = BootReport(boot_report_file)
         # Clock.schedule_once(self.bus_activator)
-        return MyScreenManager()
+        # The fault corner starts off showing the code it has at the start ('Missing' until the first fault frame arrives)
+        Clock.schedule_once(faultChanged)
+        # Watches for touches and puts the screen saver up when there haven't been any for a while
+        self.idle_manager = IdleManager(self, delay)
+        # Started after the first frame along with the rest of the start up (see start_deferred)
+        self.backlight = BacklightScheduler(self)
+        # The fonts and images are set up before the screens are made so they are built with them, and every image is loaded (and
+        # uploaded to the GPU) once here, the screens built below all use these same textures
+        self.boot.stage('fonts', self.load_fonts)
+        self.boot.stage('image sources', self.load_image_sources)
+        loaded = self.boot.stage('preload images', preload, self.image_sources)
+        if loaded is not None:
+            print('Preloaded %d images as %d textures (%.1f MB) in %.3f s' % (loaded['count'], loaded['textures'],
+                                                                             loaded['bytes'] / 1e6, loaded['seconds']))
+        Window.bind(on_flip=self.first_frame)
+        return self.boot.stage('build screens', MyScreenManager)
+
+    def load_fonts(self):
+        (self.font_file, self.bold_font_file) = registerFonts(display_code_dir)
+
+    # The kv file uses app.<name>_image for each image
+    def load_image_sources(self):
+        self.image_sources = imageSources(display_code_dir)
+        for (name, source) in self.image_sources.items():
+            setattr(self, name + '_image', source)
+
+    # Kivy calls these whenever the property changes
+    def on_error_code(self, instance, value):
+        faultChanged()
+
+    def on_mode_num(self, instance, value):
+        truckEngineMode()
+
+    # Going idle swaps the publish trigger for a slow one, waking swaps it back and publishes straight away so the screens aren't stale
+    def on_idle(self, instance, value):
+        if (run_mode == 'threads') and (self.can_service is not None):
+            self.can_service.wake.cancel()
+            self.can_service.wake = publishTrigger(value)
+            self.can_service.waiting = True
+        if not value:
+            Clock.schedule_once(publishLiveValues)
+
+    # Kivy calls this when the app is closing -- stops the CAN service (which takes can0 back down and closes the log files) and the
+    # toggle message
+    def on_stop(self):
+        self.stopped = True
+        # In asyncio mode run_async takes the service down once the app's loop has finished
+        threaded = (run_mode == 'threads') and (self.can_service is not None)
+        if threaded:
+            self.can_service.stop()
+        try:
+            self.task.stop()
+        except AttributeError:
+            pass
+        if threaded:
+            self.can_service.join(5)
+
+    # (Re)starts sending the toggle message every 0.2s
+    def start_toggle_task(self):
+        if run_mode == 'asyncio':
+            self.task = AsyncPeriodicSend(self.bus, self.toggle_msg, 0.2)
+        else:
+            self.task = self.bus.send_periodic(self.toggle_msg, 0.2)
 
     # Called when the user hits the 'Truck Engine Mode' button
     def ModeSender(self):
@@ -1119,7 +1383,7 @@ class FuelGaugeApp(App):
 
                 self.task.stop()
                 self.toggle_msg = can.Message(arbitration_id=int(self.arb_id, 16), data=self.msg_data)
-                self.task = self.bus.send_periodic(self.toggle_msg, 0.2)
+                self.start_toggle_task()
 
     def destination_changer(self, new_id):
 
@@ -1155,7 +1419,7 @@ class FuelGaugeApp(App):
 
                 self.task.stop()
                 self.toggle_msg = can.Message(arbitration_id=int(self.arb_id, 16), data=self.msg_data)
-                self.task = self.bus.send_periodic(self.toggle_msg, 0.2)
+                self.start_toggle_task()
 
     def title_changer(self, cur_page):
         self.current_page = cur_page
@@ -1172,4 +1436,7 @@ if __name__ == '__main__':
     # Actually sends all of the previously set config options to the KIVY config controller
     Config.write()
     # Runs the app class that controls the screen
-    FuelGaugeApp().run()
+    if run_mode == 'asyncio':
+        asyncio.get_event_loop().run_until_complete(run_async(FuelGaugeApp()))
+    else:
+        FuelGaugeApp().run()
@@ -0,0 +1,102 @@
+"""
+PURPOSE: Times the display's start up, so it can be seen how long the driver looks at a black screen after the ignition and what it is spent on.
+
+         Each part of the start up is run as a named stage (on the main thread or the background start up thread, they are timed the
+         same way) and two milestones are marked when they first happen: the first frame drawn and the first live value from the truck
+         shown. Every time is in seconds from when the process was started (from /proc where there is one, so the Python and Kivy imports
+         are counted as well), and the report is printed and saved as JSON whenever a milestone is reached or the stages are done.
+"""
+
+import json
+import os
+import threading
+import time
+import traceback
+
+
+def processStartTime():
+    """
+    Epoch time the process was started, or now if that can't be found out (anywhere but Linux)
+    """
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            # The command name can have spaces in it, the fields after it are split from the last ')'
+            startTicks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/stat', 'r') as f:
+            bootTime = int([line.split()[1] for line in f if line.startswith('btime')][0])
+        return bootTime + (startTicks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, IndexError, ValueError, AttributeError):
+        return time.time()
+
+
+class BootReport(object):
+
+    def __init__(self, fname=None, start=None):
+        """
+        fname is where the report is saved (not saved if None), start the epoch time everything is measured from
+        """
+        self.fname = fname
+        self.start = processStartTime() if start is None else start
+        self.stages = []
+        self.marks = {}
+        self._lock = threading.Lock()
+        # Both start up threads save, this keeps them from writing the same .tmp file at once
+        self._saveLock = threading.Lock()
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def stage(self, name, fn, *args):
+        """
+        Run fn(*args) as a stage and return what it returns. A stage that fails is recorded (and printed) but doesn't stop the ones
+        after it, it returns None
+        """
+        began = self.elapsed()
+        ok = True
+        result = None
+        try:
+            result = fn(*args)
+        except Exception:
+            traceback.print_exc()
+            ok = False
+        with self._lock:
+            self.stages.append({'name': name, 'thread': threading.current_thread().name, 'start': round(began, 4),
+                                'seconds': round(self.elapsed() - began, 4), 'ok': ok})
+        return result
+
+    def mark(self, name):
+        """
+        Record a milestone the first time it happens, returns True if this was the first time
+        """
+        if name in self.marks:
+            return False
+        with self._lock:
+            self.marks[name] = round(self.elapsed(), 4)
+        self.save()
+        return True
+
+    def report(self):
+        with self._lock:
+            return {'marks': dict(self.marks), 'stages': list(self.stages)}
+
+    def formatReport(self):
+        report = self.report()
+        lines = ['Boot: ' + ', '.join('%s %.2f s' % (name, t) for (name, t) in sorted(report['marks'].items(), key=lambda m: m[1]))]
+        for s in report['stages']:
+            lines.append('  %7.3f s  %-20s %6.3f s  %s%s' % (s['start'], s['name'], s['seconds'], s['thread'],
+                                                            '' if s['ok'] else '  FAILED'))
+        return '\n'.join(lines)
+
+    def save(self):
+        print(self.formatReport())
+        if self.fname is None:
+            return
+        with self._saveLock:
+            try:
+                tmpFname = self.fname + '.tmp'
+                # The report is taken inside the lock, so whichever save finishes last writes the newest one
+                with open(tmpFname, 'w') as f:
+                    json.dump(self.report(), f, indent=1, sort_keys=True)
+                os.replace(tmpFname, self.fname)
+            except OSError as e:
+                print('Could not write the boot report: ' + str(e))
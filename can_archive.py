@@ -0,0 +1,216 @@
+"""
+PURPOSE: Compresses the CAN logger's hourly log files once they are finished with, so the SD card doesn't fill up in a few weeks. The old
+         zipLogF did this on the receive thread at the top of every hour, which stopped frames being read while a whole hour of log was
+         zipped (so it was commented out). Now the log writers only hand the name of the file they just closed to the LogArchiver, which
+         puts it on a queue and returns straight away -- a background thread at the lowest CPU priority does the rest:
+             - streams the file into a .zip a chunk at a time, so memory use doesn't depend on how big the log is
+             - reads the new archive back and checks its CRC and size before anything is deleted
+             - renames it into place and only then deletes the original log (a log of an hour that already has an archive is added on
+               to the end of it, so nothing already archived is ever replaced)
+             - builds the log's query index (can_query.py) first, so queries over old logs don't have to decompress them to find anything
+             - deletes archives older than retentionDays, and the oldest archives while they take up more than maxArchiveBytes (along with
+               their indexes)
+
+         When it starts it also picks up any finished logs that were never compressed (e.g. the power was cut), and throws away any half
+         written archive. It is a can_service.CanService consumer only so that it gets stopped along with the service -- it doesn't look at
+         the frames.
+"""
+
+import os
+import threading
+import time
+import traceback
+import zipfile
+from queue import Queue, Empty
+
+from can_binlog import binaryLogExt, readBinaryHeader
+from can_query import buildIndex, indexExt
+
+# The log file endings that are compressed
+logExts = ('.log', '.bcan')
+archiveExt = '.zip'
+# How much of a log is read and compressed at once
+chunkSize = 256 * 1024
+
+
+def _copyChunks(inF, outF, stopEvent):
+    while True:
+        chunk = inF.read(chunkSize)
+        if not chunk:
+            return
+        outF.write(chunk)
+        if (stopEvent is not None) and stopEvent.is_set():
+            return
+
+
+def compressLog(fname, stopEvent=None):
+    """
+    Compress fname into fname + '.zip' (x.log.zip, so a text and a binary log of the same hour never share an archive) and delete fname
+    once the archive has been checked. Returns the archive's name, or None if it was stopped part way through (the original is kept)
+
+    If there is already an archive of that hour (the log was started again after it had been archived) the log is added on to the end
+    of what is in it rather than replacing it -- a binary log's own header is left out, the archive keeps the first one
+    """
+    archiveFname = fname + archiveExt
+    tmpFname = archiveFname + '.tmp'
+    arcname = os.path.basename(fname)
+    merging = os.path.isfile(archiveFname)
+
+    size = os.path.getsize(fname)
+    with open(fname, 'rb') as inF:
+        skip = readBinaryHeader(inF)[1] if (merging and fname.endswith(binaryLogExt)) else 0
+
+    with zipfile.ZipFile(tmpFname, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open(arcname, mode='w', force_zip64=True) as outF:
+            if merging:
+                with zipfile.ZipFile(archiveFname, mode='r') as oldZf, oldZf.open(arcname, mode='r') as oldF:
+                    _copyChunks(oldF, outF, stopEvent)
+                    size += oldZf.getinfo(arcname).file_size - skip
+            with open(fname, 'rb') as inF:
+                inF.seek(skip)
+                _copyChunks(inF, outF, stopEvent)
+
+    if (stopEvent is not None) and stopEvent.is_set():
+        os.remove(tmpFname)
+        return None
+
+    # Read it all back (testzip checks every CRC) before the original goes
+    with zipfile.ZipFile(tmpFname, mode='r') as zf:
+        bad = zf.testzip()
+        info = zf.getinfo(arcname)
+    if (bad is not None) or (info.file_size != size):
+        os.remove(tmpFname)
+        raise IOError('Archive of ' + fname + ' failed its check, the log has been kept')
+
+    # The archive keeps the log's time so the retention goes by when the log was written
+    stat = os.stat(fname)
+    os.replace(tmpFname, archiveFname)
+    os.utime(archiveFname, (stat.st_atime, stat.st_mtime))
+    os.remove(fname)
+    return archiveFname
+
+
+class LogArchiver(object):
+    # Not called per frame, see the module description
+    onFrame = None
+    allFrames = False
+
+    def __init__(self, outDir, retentionDays=90, maxArchiveBytes=8 * 1024 ** 3, minLogAge=3900):
+        """
+        outDir is the same path prefix the log writers use (their files are outDir + '_' + ...). Logs left over from before are only
+        picked up once they are minLogAge seconds old, so the file for the current hour is never touched
+        """
+        self.logDir = os.path.dirname(os.path.abspath(outDir))
+        self.prefix = os.path.basename(outDir) + '_'
+        self.retentionDays = retentionDays
+        self.maxArchiveBytes = maxArchiveBytes
+        self.minLogAge = minLogAge
+
+        self.compressed = 0
+        self.failed = 0
+        self._queue = Queue()
+        self._stopEvent = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='log_archiver')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, fname):
+        """
+        Called by a log writer when it has closed fname, never blocks
+        """
+        self._queue.put_nowait(fname)
+
+    def close(self, timeout=5):
+        self._stopEvent.set()
+        self._queue.put_nowait(None)
+        self._thread.join(timeout)
+
+    def _ownFiles(self, exts):
+        for name in os.listdir(self.logDir):
+            if name.startswith(self.prefix) and name.endswith(exts):
+                yield os.path.join(self.logDir, name)
+
+    def _run(self):
+        # Only this thread is made low priority (on Linux each thread has its own nice value)
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+
+        try:
+            self._sweep()
+        except OSError:
+            traceback.print_exc()
+
+        while not self._stopEvent.is_set():
+            try:
+                fname = self._queue.get(timeout=3600)
+            except Empty:
+                # Nothing rotated for an hour, pick up any logs that weren't old enough at start up (e.g. the one closed when the display
+                # was last turned off) and keep the retention up to date anyway
+                try:
+                    self._sweep()
+                except OSError:
+                    traceback.print_exc()
+                self._expire()
+                continue
+            if fname is None:
+                break
+            self._archive(fname)
+            self._expire()
+
+    def _sweep(self):
+        """
+        Queue up logs that were finished but never compressed, and remove half written archives
+        """
+        now = time.time()
+        for fname in self._ownFiles((archiveExt + '.tmp',)):
+            os.remove(fname)
+        for fname in sorted(self._ownFiles(logExts)):
+            if now - os.path.getmtime(fname) >= self.minLogAge:
+                self._queue.put_nowait(fname)
+
+    def _archive(self, fname):
+        # Already archived, if it was queued by a sweep as well as by its writer
+        if not os.path.isfile(fname):
+            return
+        # Built from the plain log while it is still there, the index carries on working for the archive. A log that is added on to an
+        # earlier archive of its hour is at a different place in the archive, so that index is built from the archive afterwards
+        merging = os.path.isfile(fname + archiveExt)
+        if not merging:
+            try:
+                buildIndex(fname)
+            except (OSError, ValueError):
+                traceback.print_exc()
+        try:
+            archiveFname = compressLog(fname, self._stopEvent)
+            if archiveFname is not None:
+                self.compressed += 1
+                if merging:
+                    buildIndex(archiveFname)
+        except (OSError, ValueError, zipfile.BadZipFile):
+            self.failed += 1
+            traceback.print_exc()
+
+    def _expire(self):
+        """
+        Delete archives past their retention, then the oldest ones while they are over the size cap
+        """
+        try:
+            archives = sorted((os.path.getmtime(f), os.path.getsize(f), f) for f in self._ownFiles((archiveExt,)))
+        except OSError:
+            traceback.print_exc()
+            return
+
+        oldest = time.time() - (self.retentionDays * 86400)
+        total = sum(size for (mtime, size, f) in archives)
+        for (mtime, size, f) in archives:
+            if (mtime >= oldest) and (total <= self.maxArchiveBytes):
+                break
+            try:
+                os.remove(f)
+                total -= size
+                if os.path.isfile(f[:-len(archiveExt)] + indexExt):
+                    os.remove(f[:-len(archiveExt)] + indexExt)
+            except OSError:
+                traceback.print_exc()
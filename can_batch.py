@@ -0,0 +1,166 @@
+"""
+PURPOSE: Decodes whole recorded CAN sessions at once with NumPy for fleet analysis, instead of pushing every frame through the same per-frame
+         Python code the display and logger use live.
+
+         The frames are held in a NumPy structured array (timestamp, arbitration ID, dlc, 8 data bytes). They are grouped by arbitration ID
+         once, each group's data bytes are viewed as one little endian 64 bit integer per frame, and then every signal in "j1939_signals.csv"
+         is pulled out of a whole group with a single shift/mask/clamp/scale -- the same definitions the live decoders are compiled from. The
+         hydrogen mass for all tanks is then worked out for every second of the session in one pass of hydrogenMassEq2 over whole arrays.
+
+         Run from the command line to turn log files into a .npz of per-signal time series:
+             python3 can_batch.py <out.npz> <signal file> <numTank> <volumeStr> <log file> [<log file> ...]
+"""
+
+import sys
+
+import numpy as np
+
+from can_binlog import isBinaryLog, mapBinaryLog
+from can_logfile import readLogFile
+from can_signals import loadSignalTable, profileSignalNames, tankTempNames, hydrogenMassEq2
+
+# One CAN frame -- the same layout as the records of the binary log format
+frameDtype = np.dtype([('timestamp', '<f8'), ('can_id', '<u4'), ('dlc', 'u1'), ('data', 'u1', (8,))])
+
+
+def framesFromRecords(records):
+    """
+    Build a frame array from (timestamp, arbitration ID, data bytes) tuples, e.g. from can_logfile.readLogFile
+    """
+    timeStamps = []
+    canIds = []
+    dlcs = []
+    payload = bytearray()
+    for (timeStamp, arbId, data) in records:
+        timeStamps.append(timeStamp)
+        canIds.append(arbId)
+        dlcs.append(len(data))
+        payload += bytes(data[:8]).ljust(8, b'\x00')
+
+    frames = np.zeros(len(timeStamps), dtype=frameDtype)
+    frames['timestamp'] = timeStamps
+    frames['can_id'] = canIds
+    frames['dlc'] = dlcs
+    frames['data'] = np.frombuffer(bytes(payload), dtype=np.uint8).reshape(-1, 8)
+    return frames
+
+
+def framesFromLog(fname):
+    """
+    A binary log is already a frame array (memory mapped, so it costs nothing until it is read), a text log has to be parsed
+    """
+    if isBinaryLog(fname):
+        return mapBinaryLog(fname)[1]
+    return framesFromRecords(readLogFile(fname))
+
+
+def framesFromLogs(fnames):
+    """
+    Load one or more log files (text or binary) into a single frame array sorted by time
+    """
+    frames = np.concatenate([framesFromLog(fname) for fname in fnames])
+    return frames[np.argsort(frames['timestamp'], kind='stable')]
+
+
+def decodeSignals(frames, signals, wanted=None):
+    """
+    Extract every signal (or only the wanted ones) from a frame array
+    Returns a dict of signal name -> (timestamps, values), both float64 arrays in time order
+    """
+    # Only full 8 byte frames are decoded, same as live
+    full = frames[frames['dlc'] == 8]
+
+    # Group the frames by arbitration ID once -- after a stable sort each ID's frames are one contiguous run, still in time order
+    order = np.argsort(full['can_id'], kind='stable')
+    sortedIds = full['can_id'][order]
+    (groupIds, groupStarts) = np.unique(sortedIds, return_index=True)
+    groupEnds = np.append(groupStarts[1:], len(sortedIds))
+    groups = dict((int(canId), order[start:end]) for (canId, start, end) in zip(groupIds, groupStarts, groupEnds))
+
+    parts = {}
+    for s in signals:
+        if (wanted is not None) and (s.name not in wanted):
+            continue
+
+        mask = np.uint64((1 << s.length) - 1)
+        for canId in s.can_ids:
+            if canId not in groups:
+                continue
+            rows = groups[canId]
+            # The 8 data bytes of each frame as one little endian integer, exactly what int.from_bytes(data, 'little') gives live
+            raw = np.ascontiguousarray(full['data'][rows]).view('<u8')[:, 0]
+            v = np.minimum((raw >> np.uint64(s.start_bit)) & mask, np.uint64(s.max_raw))
+            parts.setdefault(s.name, []).append((full['timestamp'][rows], (v * s.scale) + s.offset))
+
+    series = {}
+    for (name, pieces) in parts.items():
+        timeStamps = np.concatenate([p[0] for p in pieces])
+        values = np.concatenate([p[1] for p in pieces])
+        # Signals sent under more than one ID need putting back into time order
+        if len(pieces) > 1:
+            byTime = np.argsort(timeStamps, kind='stable')
+            timeStamps = timeStamps[byTime]
+            values = values[byTime]
+        series[name] = (timeStamps, values)
+    return series
+
+
+def lastPerSecond(timeStamps, values):
+    """
+    The last value in each whole second, returns (seconds, values)
+    """
+    secs = np.floor(timeStamps).astype(np.int64)
+    if len(secs) == 0:
+        return (secs, values)
+    last = np.append(np.nonzero(np.diff(secs))[0], len(secs) - 1)
+    return (secs[last], values[last])
+
+
+def hydrogenMassSeries(series, numTank, volumeL):
+    """
+    The total hydrogen mass for every second that has a tank 1 pressure and a temperature for every tank, the same way the live
+    feed works it out (tank 1 pressure is used for all tanks). Returns (seconds, mass in kg rounded to 0.1)
+    """
+    names = ['presT1'] + tankTempNames(numTank)
+    if any(name not in series for name in names):
+        return (np.zeros(0, dtype=np.int64), np.zeros(0))
+
+    perSecond = [lastPerSecond(*series[name]) for name in names]
+
+    # Only the seconds where every value is there
+    secs = perSecond[0][0]
+    for (s, v) in perSecond[1:]:
+        secs = np.intersect1d(secs, s, assume_unique=True)
+
+    aligned = [v[np.searchsorted(s, secs)] for (s, v) in perSecond]
+    presT1 = aligned[0]
+
+    HtotalMass = np.zeros(len(secs))
+    for t in range(numTank):
+        HtotalMass += hydrogenMassEq2(presT1, aligned[t + 1], volumeL[t])
+
+    return (secs, np.round(HtotalMass, 1))
+
+
+def main():
+    outFname = sys.argv[1]
+    signals = loadSignalTable(sys.argv[2])
+    numTank = int(sys.argv[3])
+    volumeL = [float(x) for x in sys.argv[4].split(",")]
+    logFnames = sys.argv[5:]
+
+    frames = framesFromLogs(logFnames)
+    series = decodeSignals(frames, signals, profileSignalNames(signals, numTank))
+    (massSecs, mass) = hydrogenMassSeries(series, numTank, volumeL)
+
+    arrays = {'H2mass_time': massSecs, 'H2mass': mass}
+    for (name, (timeStamps, values)) in series.items():
+        arrays[name + '_time'] = timeStamps
+        arrays[name] = values
+    np.savez(outFname, **arrays)
+
+    print(str(len(frames)) + ' frames, ' + str(len(series)) + ' signals, ' + str(len(mass)) + ' seconds of H2 mass written to ' + outFname)
+
+
+if __name__ == "__main__":
+    main()
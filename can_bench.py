@@ -0,0 +1,367 @@
+"""
+PURPOSE: Measures the hot paths of the display and the CAN logger so releases can be compared before a build goes into the trucks: formatting log
+         lines (createLogLine), decoding frames (liveUpdateTruck), the hydrogen mass calculation (hydrogenMassEq2), pushing values onto the
+         app's properties (publishTruckValues), and end to end how long a frame takes to reach an app property (display) or the log file
+         (logger).
+
+         The traffic is synthetic J1939: every arbitration ID in the signal table plus some IDs the display doesn't use, the way the truck bus
+         has them. For the end to end runs it is either written to a log file and played back through can_replay.ReplayBus ('replay'), or
+         sent on python-can's virtual bus ('virtual'), and received by the same CanReceiver the display uses.
+
+         Each hot path reports frames (or calls) per second, per-frame time percentiles, and what each frame allocates (measured with
+         tracemalloc: the memory blocks a frame leaves behind and the most extra memory it needed at once). The results are saved as JSON, and
+         given a previous results file the run is compared against it and exits with 1 if anything got slower than the allowed margin:
+             python3 can_bench.py <signal file> <out.json> <replay|virtual> [<baseline.json>]
+"""
+
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from can_logfile import createLogLine, TimeFormatter
+from can_receiver import CanReceiver
+from can_replay import ReplayBus
+from can_signals import loadSignalTable, hydrogenMassEq2
+from truck_live import newTruckVars, liveUpdateTruck, publishTruckValues, applyTruckProfile
+
+# Frames per second on the synthetic bus (a busy 250kbps J1939 bus is around 1500)
+bus_rate = 1000
+# How many frames the hot path benchmarks run through
+num_frames = 50000
+# How many frames the allocation measurement looks at (tracemalloc is slow)
+alloc_frames = 2000
+# How long each end to end run lasts, in seconds at real time
+e2e_seconds = 5.0
+# The truck setup to benchmark with
+numTank = 5
+volumeL = [202.0, 202.0, 202.0, 202.0, 148.0]
+display_rate = 10
+
+# IDs that are on the truck bus but that the display doesn't use (engine, transmission and brake messages)
+other_ids = [0x0CF00400, 0x0CF00300, 0x18F00500, 0x18FEF200, 0x18FEE900, 0x18FEF500, 0x0C000F00, 0x18FEBF0B]
+
+# Slower by more than this fraction than the baseline counts as a regression
+allowed_slowdown = 0.10
+
+
+class BenchApp(object):
+    """
+    Has the same properties the publishers set on the real app
+    """
+
+    def __init__(self):
+        self.error_code = ''
+        self.pressures = ['', '']
+        self.temps = [''] * 6
+        self.HinjectionV = 0.0
+        self.Hleakage = 0.0
+        self.coolant_temp = ''
+        self.mil_light = ''
+        self.dpf_status = ''
+        self.current_mode = ''
+        self.truck_reqd = ''
+        self.mode_color = [1, 1, 1, 1]
+        self.hMass = 0.0
+
+
+class BenchBus(object):
+    """
+    Just takes the filters applyTruckProfile sets
+    """
+
+    def set_filters(self, canFilters=None):
+        pass
+
+
+def synthFrames(signals, count, rate=bus_rate, startTime=None, seed=1):
+    """
+    Returns a list of (timestamp, arbitration ID, data) -- half of the frames carry the IDs in the signal table, half are other traffic
+    """
+    rng = random.Random(seed)
+    handledIds = sorted(set(canId for s in signals for canId in s.can_ids))
+    if startTime is None:
+        startTime = time.time()
+
+    frames = []
+    for i in range(count):
+        if rng.random() < 0.5:
+            arbId = rng.choice(handledIds)
+        else:
+            arbId = rng.choice(other_ids)
+        frames.append((startTime + (i / float(rate)), arbId, bytes(rng.getrandbits(8) for _ in range(8))))
+    return frames
+
+
+def writeSyntheticLog(fname, frames):
+    """
+    Write frames out the way the CAN logger does so they can be played back
+    """
+    formatter = TimeFormatter()
+    with open(fname, 'w') as f:
+        f.write('***START DATE AND TIME ' + formatter.extract(frames[0][0])[3] + '\n')
+        for (timeStamp, arbId, data) in frames:
+            f.write(createLogLine(timeStamp, arbId, data, formatter)[0] + '\n')
+
+
+def percentiles(samples):
+    """
+    Percentiles of a list of times in seconds, reported in microseconds
+    """
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    result = {}
+    for (name, fraction) in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p99.9', 0.999)):
+        result[name] = round(ordered[int(round(fraction * last))] * 1000000.0, 2)
+    result['max'] = round(ordered[last] * 1000000.0, 2)
+    return result
+
+
+def measureAllocations(processFrame, frames):
+    """
+    Run frames through processFrame under tracemalloc -- returns the blocks and bytes each frame leaves behind (its result is kept) and
+    the most extra memory any one frame needed while it ran
+    """
+    kept = []
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        peakBytes = 0
+        for frame in frames:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            kept.append(processFrame(frame))
+            peakBytes = max(peakBytes, tracemalloc.get_traced_memory()[1] - current)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    # Only count what was allocated in the code under test, not the list holding the results
+    stats = [s for s in after.compare_to(before, 'filename') if s.traceback[0].filename != __file__]
+    blocks = sum(s.count_diff for s in stats)
+    size = sum(s.size_diff for s in stats)
+    return {'blocksPerFrame': round(blocks / float(len(frames)), 3), 'bytesPerFrame': round(size / float(len(frames)), 1),
+            'peakTransientBytes': peakBytes}
+
+
+def benchHotPath(processFrame, frames):
+    """
+    Time processFrame over every frame, returns the rate, the per-frame percentiles and the allocations
+    """
+    # Once through without timing so the first calls (imports, caches) don't count
+    for frame in frames[:1000]:
+        processFrame(frame)
+
+    perFrame = []
+    clock = time.perf_counter
+    start = clock()
+    for frame in frames:
+        t0 = clock()
+        processFrame(frame)
+        perFrame.append(clock() - t0)
+    elapsed = clock() - start
+
+    return {'count': len(frames), 'perSecond': round(len(frames) / elapsed, 1), 'latencyUs': percentiles(perFrame),
+            'allocations': measureAllocations(processFrame, frames[:alloc_frames])}
+
+
+def hotPathBenchmarks(signals, frames):
+    results = {}
+
+    formatter = TimeFormatter()
+    results['createLogLine'] = benchHotPath(lambda f: createLogLine(f[0], f[1], f[2], formatter), frames)
+
+    decoderTable = {}
+    truckVars = newTruckVars(signals, numTank, volumeL)
+    applyTruckProfile(BenchBus(), decoderTable, signals, truckVars)
+    values = truckVars['snapshot'].values
+    metrics = truckVars['metrics']
+    results['liveUpdateTruck'] = benchHotPath(lambda f: liveUpdateTruck(f[0], f[1], f[2], decoderTable, values, metrics), frames)
+
+    # One call works out all of the tanks, the same as once a second live
+    rng = random.Random(2)
+    tankReadings = [(rng.uniform(50, 700), [rng.uniform(-20, 60) for t in range(numTank)]) for i in range(len(frames) // 10)]
+
+    def hydrogenMass(reading):
+        (presT1, tempL) = reading
+        return round(sum(hydrogenMassEq2(presT1, tempL[t], volumeL[t]) for t in range(numTank)), 1)
+
+    results['hydrogenMassEq2'] = benchHotPath(hydrogenMass, tankReadings)
+
+    # Publishing after every frame so that most calls have something that changed to push
+    app = BenchApp()
+
+    def publish(f):
+        liveUpdateTruck(f[0], f[1], f[2], decoderTable, values, metrics)
+        publishTruckValues(app, truckVars)
+
+    results['publishTruckValues'] = benchHotPath(publish, frames)
+    return results
+
+
+def startSource(source, signals, tmpDir):
+    """
+    Returns (connect function for the CanReceiver, thread sending the frames or None)
+    """
+    count = int(e2e_seconds * bus_rate)
+    if source == 'replay':
+        fname = os.path.join(tmpDir, 'bench_replay.log')
+        writeSyntheticLog(fname, synthFrames(signals, count, startTime=time.time() - 3600))
+        return (lambda: ReplayBus([fname], 1.0), None)
+
+    import can
+
+    def send():
+        bus = can.interface.Bus('bench', bustype='virtual')
+        start = time.time()
+        for (i, (timeStamp, arbId, data)) in enumerate(synthFrames(signals, count, startTime=start)):
+            wait = timeStamp - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            bus.send(can.Message(arbitration_id=arbId, data=data, is_extended_id=True, timestamp=time.time()))
+        bus.shutdown()
+
+    sender = threading.Thread(target=send, name='bench_sender')
+    sender.daemon = True
+    return (lambda: can.interface.Bus('bench', bustype='virtual'), sender)
+
+
+def runEndToEnd(source, connect, sender, handleFrame, onTick=None):
+    receiver = CanReceiver([], 0, connect, handleFrame, recvTimeout=0.1)
+    receiver.start()
+    # Give the receiver time to connect before anything is sent
+    time.sleep(0.5)
+    if sender is not None:
+        sender.start()
+
+    end = time.time() + e2e_seconds + 0.5
+    while time.time() < end:
+        time.sleep(1.0 / display_rate)
+        if onTick is not None:
+            onTick()
+
+    receiver.stop()
+    receiver.join(5)
+
+
+def displayEndToEnd(source, signals, tmpDir):
+    """
+    Frame received to value on an app property, with the display publishing display_rate times a second
+    """
+    (connect, sender) = startSource(source, signals, tmpDir)
+    decoderTable = {}
+    truckVars = newTruckVars(signals, numTank, volumeL)
+    values = truckVars['snapshot'].values
+    metrics = truckVars['metrics']
+    app = BenchApp()
+    samples = []
+
+    def connectAndProfile():
+        bus = connect()
+        applyTruckProfile(bus, decoderTable, signals, truckVars)
+        return bus
+
+    def handleFrame(timeStamp, arbId, data):
+        liveUpdateTruck(timeStamp, arbId, data, decoderTable, values, metrics)
+
+    def onTick():
+        latency = truckVars['latency']
+        count = latency['count']
+        publishTruckValues(app, truckVars)
+        if latency['count'] != count:
+            samples.append(latency['last'])
+
+    runEndToEnd(source, connectAndProfile, sender, handleFrame, onTick)
+    return {'frames': metrics.seen, 'accepted': metrics.accepted, 'publishes': len(samples),
+            'frameToPropertyUs': percentiles(samples)}
+
+
+def loggerEndToEnd(source, signals, tmpDir):
+    """
+    Frame received to its line written in the log file
+    """
+    (connect, sender) = startSource(source, signals, tmpDir)
+    formatter = TimeFormatter()
+    samples = []
+    logFile = open(os.path.join(tmpDir, 'bench_out.log'), 'w')
+
+    def handleFrame(timeStamp, arbId, data):
+        logFile.write(createLogLine(timeStamp, arbId, data, formatter)[0] + '\n')
+        samples.append(time.time() - timeStamp)
+
+    try:
+        runEndToEnd(source, connect, sender, handleFrame)
+    finally:
+        logFile.close()
+    return {'frames': len(samples), 'frameToFileUs': percentiles(samples)}
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compareResults(results, baseline):
+    """
+    Prints how each hot path compares with the baseline, returns the names of the ones that got slower than allowed
+    """
+    regressions = []
+    for (name, result) in results['hotPaths'].items():
+        old = baseline.get('hotPaths', {}).get(name)
+        if old is None:
+            continue
+        change = (result['perSecond'] / old['perSecond']) - 1
+        oldP99 = old['latencyUs'].get('p99')
+        newP99 = result['latencyUs'].get('p99')
+        print(name + ': ' + ('%+.1f%%' % (change * 100)) + ' per second, p99 ' + str(oldP99) + ' -> ' + str(newP99) + 'us')
+        if change < -allowed_slowdown:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    signals = loadSignalTable(sys.argv[1])
+    outFname = sys.argv[2]
+    source = sys.argv[3]
+    baselineFname = sys.argv[4] if len(sys.argv) > 4 else None
+
+    frames = synthFrames(signals, num_frames)
+    results = {'commit': gitCommit(), 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+               'machine': platform.machine(), 'source': source, 'busRate': bus_rate, 'numTank': numTank,
+               'hotPaths': hotPathBenchmarks(signals, frames)}
+
+    tmpDir = tempfile.mkdtemp(prefix='can_bench_')
+    results['display'] = displayEndToEnd(source, signals, tmpDir)
+    results['logger'] = loggerEndToEnd(source, signals, tmpDir)
+
+    with open(outFname, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    for (name, result) in sorted(results['hotPaths'].items()):
+        print(name + ': ' + ('%.0f' % result['perSecond']) + '/s, p50 ' + str(result['latencyUs']['p50']) + 'us, p99 ' +
+              str(result['latencyUs']['p99']) + 'us, ' + str(result['allocations']['blocksPerFrame']) + ' blocks/frame')
+    print('display frame to property: ' + str(results['display']['frameToPropertyUs']))
+    print('logger frame to file: ' + str(results['logger']['frameToFileUs']))
+    print('Results written to ' + outFname)
+
+    if baselineFname is not None:
+        with open(baselineFname, 'r') as f:
+            regressions = compareResults(results, json.load(f))
+        if regressions:
+            print('Slower than ' + baselineFname + ': ' + ', '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+PURPOSE: An optional binary version of the CAN logger's hourly log files. Every frame is a fixed 21 byte record -- float64 timestamp, uint32
+         arbitration ID, uint8 DLC and the 8 data bytes, little endian with no padding -- instead of a ~45 character text line, so a third of
+         the writing to the SD card and nothing to parse when reading it back.
+
+         A file starts with a small header: the magic bytes, the length of the session description, then the description itself as JSON
+         (bit rate, CANtype, truck, number of tanks and their volumes, when the file was started). The records follow straight after it and
+         are exactly can_batch.frameDtype, so mapBinaryLog can hand the whole file to NumPy as a memory mapped structured array without copying
+         or converting anything. readBinaryLog reads the records without NumPy (for replaying), and binaryToText turns a file back into the
+         original text format for anything that needs it:
+             python3 can_binlog.py <binary log file> [<text log file>]
+
+         Writing only needs the standard library so it is fine on the Pi, NumPy is only needed for mapBinaryLog.
+"""
+
+import json
+import os
+import struct
+import sys
+import time
+
+from can_logfile import TimeFormatter, createLogLine, topOfFile, bottomOfFile
+
+binaryLogExt = '.bcan'
+_magic = b'HYDRACAN'
+_headerLength = struct.Struct('<I')
+# Must stay the same as can_batch.frameDtype
+binaryRecord = struct.Struct('<dIB8s')
+recordSize = binaryRecord.size
+binaryLogVersion = 1
+
+
+def isBinaryLog(fname):
+    return fname.endswith(binaryLogExt)
+
+
+def sessionInfo(bRate, CANtype, truck, numTank, volumeL, startTime=None):
+    """
+    The description of the logging session that goes in the file header
+    """
+    return {'version': binaryLogVersion, 'bRate': bRate, 'CANtype': CANtype, 'truck': truck, 'numTank': numTank,
+            'volumeL': list(volumeL), 'startTime': time.time() if startTime is None else startTime}
+
+
+def writeBinaryHeader(outF, info):
+    description = json.dumps(info, sort_keys=True).encode('utf-8')
+    outF.write(_magic + _headerLength.pack(len(description)) + description)
+
+
+def readBinaryHeader(f):
+    """
+    Reads the header from an open file, returns (session info dict, offset of the first record)
+    """
+    start = f.read(len(_magic) + _headerLength.size)
+    if start[:len(_magic)] != _magic:
+        raise ValueError('Not a binary CAN log: ' + str(getattr(f, 'name', f)))
+    (length,) = _headerLength.unpack_from(start, len(_magic))
+    info = json.loads(f.read(length).decode('utf-8'))
+    return (info, len(start) + length)
+
+
+def packFrame(timeStamp, arbId, data):
+    dlc = len(data)
+    return binaryRecord.pack(timeStamp, arbId, dlc, bytes(data[:8]))
+
+
+def readBinaryLog(fname):
+    """
+    Yields (timestamp, arbitration ID, data bytes) for every frame, the same as can_logfile.readLogFile
+    """
+    with open(fname, 'rb') as f:
+        (info, offset) = readBinaryHeader(f)
+        unpack = binaryRecord.unpack
+        while True:
+            record = f.read(recordSize)
+            # A record cut short means the logger stopped mid write
+            if len(record) < recordSize:
+                break
+            (timeStamp, arbId, dlc, payload) = unpack(record)
+            yield (timeStamp, arbId, payload[:dlc])
+
+
+def mapBinaryLog(fname):
+    """
+    Returns (session info, the records as a read only NumPy structured array of can_batch.frameDtype) -- the array is a memory map of
+    the file, nothing is read until it is used
+    """
+    import numpy as np
+    from can_batch import frameDtype
+
+    with open(fname, 'rb') as f:
+        (info, offset) = readBinaryHeader(f)
+    count = (os.path.getsize(fname) - offset) // recordSize
+    if count == 0:
+        return (info, np.zeros(0, dtype=frameDtype))
+    return (info, np.memmap(fname, dtype=frameDtype, mode='r', offset=offset, shape=(count,)))
+
+
+def binaryToText(binFname, textFname):
+    """
+    Write a binary log out in the CAN logger's text format
+    """
+    formatter = TimeFormatter()
+    with open(binFname, 'rb') as f:
+        (info, offset) = readBinaryHeader(f)
+
+    prevTime = None
+    with open(textFname, 'w') as outF:
+        for (timeStamp, arbId, data) in readBinaryLog(binFname):
+            (outstr, (ymdFV, hourV, ymdBV, hmsfV)) = createLogLine(timeStamp, arbId, data, formatter)
+            if prevTime is None:
+                outF.write(topOfFile(ymdBV, hmsfV, info['bRate']))
+            outF.write(outstr + "\n")
+            prevTime = (ymdBV, hmsfV)
+        if prevTime is not None:
+            outF.write(bottomOfFile(*prevTime))
+
+
+class HourlyBinaryLogWriter(object):
+    """
+    The binary version of can_logfile.HourlyLogWriter -- a new file every hour, named the same way but ending in .bcan. As there,
+    onClosed(fname) is only called with a file once its hour is over
+    """
+    allFrames = True
+
+    def __init__(self, outDir, CANv, info, onClosed=None):
+        self.outDir = outDir
+        self.CANv = CANv
+        self.info = info
+        self.onClosed = onClosed
+        self.formatter = TimeFormatter()
+        self.outF = None
+        self.curFname = None
+        self.prevHour = None
+
+    def onFrame(self, timeStamp, arbId, data):
+        # The hour (and the date for the file name) only have to be worked out again when the second changes
+        if self.formatter.setSecond(int(timeStamp)) or (self.outF is None):
+            if self.formatter.hourV != self.prevHour:
+                self._newFile(timeStamp)
+        self.outF.write(packFrame(timeStamp, arbId, data))
+
+    def _newFile(self, timeStamp):
+        prevFname = self.curFname if self.outF is not None else None
+        self.close()
+        if (prevFname is not None) and (self.onClosed is not None):
+            self.onClosed(prevFname + binaryLogExt)
+        self.curFname = self.outDir + "_" + self.formatter.ymdFV + self.formatter.hourV + "_" + self.CANv
+        fname = self.curFname + binaryLogExt
+        # Carrying on with an existing file for this hour (after a restart) just adds records on the end, after cutting off any record
+        # that was only half written when it stopped
+        if os.path.isfile(fname) and (os.path.getsize(fname) > 0):
+            with open(fname, 'rb') as f:
+                (info, offset) = readBinaryHeader(f)
+            wholeRecords = (os.path.getsize(fname) - offset) // recordSize
+            self.outF = open(fname, 'ab')
+            self.outF.truncate(offset + (wholeRecords * recordSize))
+        else:
+            self.outF = open(fname, 'wb')
+            info = dict(self.info)
+            info['startTime'] = timeStamp
+            writeBinaryHeader(self.outF, info)
+        self.prevHour = self.formatter.hourV
+
+    def close(self):
+        if self.outF is not None:
+            self.outF.close()
+            self.outF = None
+            self.prevHour = None
+
+
+def main():
+    binFname = sys.argv[1]
+    if len(sys.argv) > 2:
+        textFname = sys.argv[2]
+    else:
+        textFname = binFname[:-len(binaryLogExt)] + '.log'
+    binaryToText(binFname, textFname)
+    print('Written ' + textFname)
+
+
+if __name__ == "__main__":
+    main()
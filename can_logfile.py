@@ -0,0 +1,266 @@
+"""
+PURPOSE: Everything to do with turning received CAN frames into the text the CAN logger writes: the time/date strings, the log line for each
+         frame and (further down) the hourly log files themselves. Shared by the display and the CAN logger.
+
+         Timestamps are kept as float epoch seconds everywhere and are only turned into strings here. Formatting a time with time.localtime and
+         time.strftime is slow compared to everything else done per frame, but every frame within the same wall-clock second shares the same
+         date/hour/minute/second strings -- so TimeFormatter works those out once when a new second starts and only adds the milliseconds for
+         each frame.
+"""
+
+import os
+import time
+
+monthNumToChar = {1: "Jan", 2: "Feb", 3: "Mar", 4: "Apr", 5: "May", 6: "Jun", 7: "Jul", 8: "Aug",
+                  9: "Sep", 10: "Oct", 11: "Nov", 12: "Dec"}
+
+# The lower case hex text of every byte value followed by its separating space, built once
+_hexByte = ['{0:x} '.format(i) for i in range(256)]
+
+
+class TimeFormatter(object):
+    """
+    Caches the formatted parts of the current second -- only used from one thread at a time (each receive thread has its own)
+    """
+    __slots__ = ('sec', 'ymdFV', 'hmsV', 'hourV', 'ymdBV', 'outDateV')
+
+    def __init__(self):
+        self.sec = None
+
+    def setSecond(self, sec):
+        """
+        Work out all of the strings for the whole second 'sec', returns True if this is a different second to the last one
+        """
+        if sec == self.sec:
+            return False
+
+        t = time.localtime(sec)
+        self.sec = sec
+        self.ymdFV = time.strftime('%Y%m%d', t)
+        self.ymdBV = time.strftime('%d:%m:%Y', t)
+        self.hmsV = time.strftime('%H:%M:%S', t)
+        self.hourV = time.strftime('%H', t)
+        self.outDateV = " ".join([time.strftime('%d', t), monthNumToChar[t.tm_mon], time.strftime('%Y', t), self.hmsV])
+        return True
+
+    def extract(self, timeStamp):
+        """
+        Same as extractTimeFromEpoch: (ymdFV, hmsfV, hourV, ymdBV), e.g. ('20210520', '19:43:02:051', '19', '20:05:2021')
+        """
+        sec = int(timeStamp)
+        self.setSecond(sec)
+        return (self.ymdFV, self.hmsV + ":" + millisecondStr(timeStamp, sec), self.hourV, self.ymdBV)
+
+    def outDate(self, timeStamp):
+        """
+        The date format used in the live feed files, e.g. '20 May 2021 19:43:02'
+        """
+        self.setSecond(int(timeStamp))
+        return self.outDateV
+
+
+def millisecondStr(timeStamp, sec):
+    """
+    Always 3 digits -- the old str(timeStamp).split(".") version gave '5' for 0.05s and broke on timestamps with no fractional part
+    """
+    # CAN timestamps have microsecond resolution, rounding to whole microseconds first stops float error turning e.g. .123 into 122.99999
+    ms = int(round((timeStamp - sec) * 1000000.0)) // 1000
+    if ms > 999:
+        ms = 999
+    return '%03d' % ms
+
+
+_formatter = TimeFormatter()
+
+
+def extractTimeFromEpoch(timeStamp):
+    """
+    Extract all the relative time and date info from CAN timestamp
+    """
+    return _formatter.extract(timeStamp)
+
+
+def createLogLine(timeStamp, arbId, data, formatter=_formatter):
+    """
+    Format the CAN frame
+    """
+    (ymdFV, hmsfV, hourV, ymdBV) = formatter.extract(timeStamp)
+
+    # PGN
+    pgnV = '0x{:02x}'.format(arbId)
+
+    # Hex
+    hexV = ''.join([_hexByte[b] for b in data])
+
+    outstr = " ".join([hmsfV, "Rx", "1", pgnV, "x", str(len(data)), hexV]) + " "
+    timeDateV = (ymdFV, hourV, ymdBV, hmsfV)
+    return (outstr, timeDateV)
+
+
+def headerDayStart(line):
+    """
+    The epoch time of midnight on the day in a '***START DATE AND TIME dd:mm:YYYY ...' header line, None for any other line
+    """
+    if not line.startswith('***START DATE AND TIME '):
+        return None
+    [dayV, monthV, yearV] = line[len('***START DATE AND TIME '):].split(' ')[0].split(':')
+    return time.mktime((int(yearV), int(monthV), int(dayV), 0, 0, 0, 0, 0, -1))
+
+
+def parseLogLine(line):
+    """
+    Returns (seconds since midnight, arbitration ID, data bytes) for a frame line, None for anything else
+    """
+    if line[0] == '*':
+        return None
+    splt = line.split()
+    try:
+        [hourV, minV, secV, msV] = splt[0].split(':')
+        arbId = int(splt[3], 16)
+        dlc = int(splt[5])
+        data = bytes(int(h, 16) for h in splt[6:6 + dlc])
+        secOfDay = (int(hourV) * 3600) + (int(minV) * 60) + int(secV)
+        # Older logs wrote the fraction's leading digits without padding ('5' for .5s, '05' for .05s), reading them as a
+        # decimal fraction works for those and for the 3 digit milliseconds alike
+        fraction = float('0.' + msV)
+    except (IndexError, ValueError):
+        return None
+    if len(data) != dlc:
+        return None
+    return (secOfDay + fraction, arbId, data)
+
+
+def readLogLines(lines, dayStart=0.0):
+    """
+    Yields (timestamp, arbitration ID, data bytes) for the frame lines in lines, starting from the day dayStart (epoch time of midnight)
+    """
+    prevSecOfDay = None
+    for line in lines:
+        if line[0] == '*':
+            newDayStart = headerDayStart(line)
+            if newDayStart is not None:
+                dayStart = newDayStart
+                prevSecOfDay = None
+            continue
+
+        frame = parseLogLine(line)
+        if frame is None:
+            continue
+        (secOfDay, arbId, data) = frame
+
+        # The file went past midnight
+        if (prevSecOfDay is not None) and (int(secOfDay) < prevSecOfDay):
+            dayStart += 86400
+        prevSecOfDay = int(secOfDay)
+
+        yield (dayStart + secOfDay, arbId, data)
+
+
+def readLogFile(fname):
+    """
+    Read back a log file written by the CAN logger, yields (timestamp, arbitration ID, data bytes) for every frame
+    The lines only have the time of day so the date comes from the '***START DATE AND TIME' header line
+    """
+    with open(fname, 'r') as f:
+        for frame in readLogLines(f):
+            yield frame
+
+
+def topOfFile(ymdBV, hmsfV, bRate):
+    """
+    Top of log file message
+    """
+    loggerVersion = "1.1.1"
+    topLineL = ["***RPIMASTER Ver " + loggerVersion + "***",
+                "***PROTOCOL CAN***",
+                "***NOTE: PLEASE DO NOT EDIT THIS DOCUMENT***",
+                "***[START LOGGING SESSION]***",
+                "***START DATE AND TIME " + ymdBV + " " + hmsfV + "***",
+                "***HEX***",
+                "***SYSTEM MODE***",
+                "***START CHANNEL BAUD RATE***",
+                "***CHANNEL 1 - Kvaser - Kvaser Leaf Light v2 #0 (Channel 0), Serial Number- 0, Firmware- 0x000000ef 0x00040003 - " + str(bRate) + " bps***",
+                "***END CHANNEL BAUD RATE***",
+                "***START DATABASE FILES***",
+                "***END DATABASE FILES***",
+                "***<Time><Tx/Rx><Channel><CAN ID><Type><DLC><DataBytes>***"]
+    return "\n".join(topLineL) + "\n"
+
+
+def bottomOfFile(prevYmdBV, prevHmsfV):
+    """
+    Bottom of the file
+    """
+    bottomLineL = ["***END DATE AND TIME " + prevYmdBV + " " + prevHmsfV + "***",
+                   "***[STOP LOGGING SESSION]***"]
+    return "\n".join(bottomLineL) + "\n"
+
+
+def writeToFile(outstr, timeDateV, outF, outDir, prevTime, CANv, bRate, curFname):
+    """
+    Write formated CAN message to log file
+    Make sure a new log file is created on the hour
+    """
+    (prevYmdBV, prevHmsfV, prevHour) = prevTime
+    (ymdFV, hourV, ymdBV, hmsfV) = timeDateV
+
+    # If new hour then create a new file
+    if (prevHour == hourV):
+        outF.write(outstr + "\n")
+    else:
+        if (prevHour != "-1"):
+            outF.write(bottomOfFile(prevYmdBV, prevHmsfV))
+            outF.close()
+        curFname = outDir + "_" + ymdFV + hourV + "_" + CANv
+
+        if os.path.isfile(curFname + ".log"):
+            outF = open(curFname + ".log", "a")
+        else:
+            outF = open(curFname + ".log", "w")
+            outF.write(topOfFile(ymdBV, hmsfV, bRate))
+        # The frame that starts the new file goes in it too (the CAN logger used to lose the first frame of every hour)
+        outF.write(outstr + "\n")
+
+    prevTime = (ymdBV, hmsfV, hourV)
+    return (outF, prevTime, curFname)
+
+
+class HourlyLogWriter(object):
+    """
+    Writes every frame to the CAN logger's hourly .log files -- a consumer for can_service.CanService. onClosed(fname) is called with
+    each file once its hour is over (e.g. can_archive.LogArchiver.submit). The file being written when it is closed isn't passed on,
+    its hour may not be over yet (the display could be started again within it) -- the archiver picks it up once it is old enough
+    """
+    # The log has every frame on the bus in it, not only the ones that are decoded
+    allFrames = True
+
+    def __init__(self, outDir, CANv, bRate, onClosed=None):
+        self.outDir = outDir
+        self.CANv = CANv
+        self.bRate = bRate
+        self.onClosed = onClosed
+        self.formatter = TimeFormatter()
+        self.outF = None
+        self.curFname = None
+        self.prevTime = ("-1", "-1", "-1")
+
+    def onFrame(self, timeStamp, arbId, data):
+        (outstr, timeDateV) = createLogLine(timeStamp, arbId, data, self.formatter)
+        prevFname = self.curFname
+        (self.outF, self.prevTime, self.curFname) = writeToFile(outstr, timeDateV, self.outF, self.outDir, self.prevTime, self.CANv,
+                                                                self.bRate, self.curFname)
+        if (prevFname is not None) and (self.curFname != prevFname):
+            self._closed(prevFname)
+
+    def _closed(self, curFname):
+        if self.onClosed is not None:
+            self.onClosed(curFname + ".log")
+
+    def close(self):
+        if self.outF is not None:
+            (prevYmdBV, prevHmsfV, prevHour) = self.prevTime
+            self.outF.write(bottomOfFile(prevYmdBV, prevHmsfV))
+            self.outF.close()
+            self.outF = None
+            self.prevTime = ("-1", "-1", "-1")
+            self.curFname = None
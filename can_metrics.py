@@ -0,0 +1,132 @@
+"""
+PURPOSE: Counters for the CAN receive and decode path, so when a gauge shows 'NA' or an old value it can be told apart whether the ECU stopped
+         sending that ID, its frames were thrown away (an ID with no decoder, or not 8 bytes long), or the receive thread fell behind (frames
+         waiting in each batch, frames the kernel dropped because the socket queue was full).
+
+         The receive thread only does plain increments and dict updates per frame -- the decode time is only measured for one frame in every
+         sampleEvery, and everything else (rates, ages, the text for the screen) is worked out when a report is asked for on the main thread.
+"""
+
+import json
+import os
+import time
+from bisect import bisect_left
+
+# Upper edges of the decode time histogram buckets in microseconds, the last bucket is everything slower
+decodeBucketsUs = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class CanMetrics(object):
+
+    def __init__(self, sampleEvery=16, rateWindow=5.0):
+        """
+        sampleEvery must be a power of 2. Rates are averaged over at least rateWindow seconds
+        """
+        # Written by the receive thread
+        self.seen = 0
+        self.accepted = 0
+        self.unknownId = 0
+        self.malformed = 0
+        self.lastFrameTime = None
+        self.idCounts = {}
+        self.idLastSeen = {}
+        self.decodeHist = [0] * (len(decodeBucketsUs) + 1)
+        self.sampleMask = sampleEvery - 1
+        self.queueDepth = 0
+        self.maxQueueDepth = 0
+        self.kernelDrops = 0
+
+        self.startTime = time.time()
+        self.rateWindow = rateWindow
+        self._windowStart = self.startTime
+        self._windowCounts = {}
+        self._rates = {}
+        self._fullWindow = False
+
+    def recordDecodeTime(self, seconds):
+        self.decodeHist[bisect_left(decodeBucketsUs, seconds * 1000000.0)] += 1
+
+    def recordBatch(self, size, kernelDrops):
+        """
+        size is how many frames were waiting when the receive thread woke up, kernelDrops the socket's running total of dropped frames
+        """
+        self.queueDepth = size
+        if size > self.maxQueueDepth:
+            self.maxQueueDepth = size
+        self.kernelDrops = kernelDrops
+
+    def _updateRates(self, now, idCounts):
+        elapsed = now - self._windowStart
+        # Until the first window is over the rates are worked out over however long it has been so far
+        if (elapsed <= 0) or ((elapsed < self.rateWindow) and self._fullWindow):
+            return
+        windowCounts = self._windowCounts
+        self._rates = dict((arbId, (count - windowCounts.get(arbId, 0)) / elapsed) for (arbId, count) in idCounts.items())
+        if elapsed >= self.rateWindow:
+            self._windowCounts = idCounts
+            self._windowStart = now
+            self._fullWindow = True
+
+    def report(self, signals=(), latency=None, now=None):
+        """
+        Everything as a dict that can be saved as JSON -- signals are the ones being decoded (for their last seen ages), latency is the
+        display's frame to screen latency dict if there is one
+        """
+        if now is None:
+            now = time.time()
+        # Copies, the receive thread keeps adding to these
+        idCounts = self.idCounts.copy()
+        idLastSeen = self.idLastSeen.copy()
+        self._updateRates(now, idCounts)
+
+        ids = {}
+        for (arbId, count) in sorted(idCounts.items()):
+            lastSeen = idLastSeen.get(arbId)
+            ids['%x' % arbId] = {'count': count, 'rate': round(self._rates.get(arbId, 0.0), 2),
+                                 'age': None if lastSeen is None else round(now - lastSeen, 3)}
+
+        signalAges = {}
+        for s in signals:
+            lastSeen = [idLastSeen[arbId] for arbId in s.can_ids if arbId in idLastSeen]
+            signalAges[s.name] = round(now - max(lastSeen), 3) if lastSeen else None
+
+        buckets = ['<=' + str(edge) + 'us' for edge in decodeBucketsUs] + ['>' + str(decodeBucketsUs[-1]) + 'us']
+        report = {'time': now, 'uptime': round(now - self.startTime, 1), 'seen': self.seen, 'accepted': self.accepted,
+                  'unknownId': self.unknownId, 'malformed': self.malformed, 'queueDepth': self.queueDepth,
+                  'maxQueueDepth': self.maxQueueDepth, 'kernelDrops': self.kernelDrops,
+                  'decodeTimeHist': [list(b) for b in zip(buckets, self.decodeHist)], 'ids': ids, 'signalAges': signalAges}
+        if latency is not None:
+            report['screenLatency'] = {'last': round(latency['last'], 4), 'max': round(latency['max'], 4),
+                                       'mean': round(latency['total'] / latency['count'], 4) if latency['count'] else None}
+        return report
+
+
+def formatReport(report):
+    """
+    A few lines of text for the CAN Settings screen
+    """
+    lines = ['Frames ' + str(report['seen']) + '  used ' + str(report['accepted']) + '  unknown ID ' + str(report['unknownId']) +
+             '  bad length ' + str(report['malformed']) + '  kernel drops ' + str(report['kernelDrops']) + '  queue ' +
+             str(report['queueDepth']) + ' (max ' + str(report['maxQueueDepth']) + ')']
+
+    idText = []
+    for (arbId, stats) in report['ids'].items():
+        age = '-' if stats['age'] is None else ('%.1fs' % stats['age'])
+        idText.append(arbId + ' ' + ('%.1f' % stats['rate']) + '/s ' + age)
+    lines.append('   '.join(idText))
+
+    # Only the signals that are late are worth the space
+    stale = [name + ' ' + ('never' if age is None else ('%.0fs' % age)) for (name, age) in sorted(report['signalAges'].items())
+             if (age is None) or (age > 2)]
+    lines.append('Stale: ' + (', '.join(stale) if stale else 'none'))
+    return '\n'.join(lines)
+
+
+def dumpReport(report, fname):
+    """
+    Write the report to fname, through a temporary file so a reader never sees half of it
+    """
+    tmpFname = fname + '.tmp'
+    with open(tmpFname, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    os.replace(tmpFname, fname)
@@ -0,0 +1,313 @@
+"""
+PURPOSE: Answers "what did this signal (or these IDs) do between these two times" from the recorded CAN logs without reading through them all.
+
+         Two things make that quick. The hourly log files are named after the hour they hold (outDir_YYYYMMDDHH_CANtype.log), so only the
+         files that overlap the time range are opened at all. Inside each file a sparse index -- kept next to it as <log>.idx -- has one
+         entry for every blockSeconds of log: the times of its first and last frames, where it starts in the file, the date the lines in
+         it belong to (text logs only have the time of day) and which arbitration IDs are in it. A query seeks straight to the blocks that
+         overlap the range and have one of the wanted IDs in them, and only parses those.
+
+         Text (.log), binary (.bcan, see can_binlog.py) and archived (.zip, see can_archive.py) logs are all handled the same way -- the
+         offsets are into the uncompressed log, so an archived log still only has to be decompressed up to the end of the range. An index
+         is built the first time a file is queried (the archiver also builds one before it compresses a log), and for a log that is still
+         being written it is extended from where it got to rather than built again.
+
+             python3 can_query.py <outDir> <CANtype> <'YYYY-mm-dd HH:MM:SS'> <'YYYY-mm-dd HH:MM:SS'> [<signal name> ...]
+"""
+
+import json
+import os
+import sys
+import time
+import zipfile
+
+from can_binlog import binaryLogExt, binaryRecord, readBinaryHeader, recordSize
+from can_logfile import headerDayStart, readLogLines
+from can_signals import loadSignalTable, SignalSnapshot, compileDecoders
+
+indexExt = '.idx'
+indexVersion = 1
+# One index entry for this many seconds of log
+blockSeconds = 10
+
+
+def logicalName(fname):
+    """
+    The name of the log itself, whether or not it has been archived
+    """
+    if fname.endswith('.zip'):
+        return fname[:-len('.zip')]
+    return fname
+
+
+def openLog(fname):
+    """
+    Returns (binary file object that can seek, size of the uncompressed log)
+    """
+    if fname.endswith('.zip'):
+        zf = zipfile.ZipFile(fname, mode='r')
+        name = os.path.basename(logicalName(fname))
+        return (zf.open(name, mode='r'), zf.getinfo(name).file_size)
+    return (open(fname, 'rb'), os.path.getsize(fname))
+
+
+def _textBlocks(f, offset, dayStart, blocks):
+    """
+    Add index entries for a text log from offset onwards
+    """
+    f.seek(offset)
+    prevSecOfDay = None
+    blockId = None
+    block = None
+    for line in f:
+        lineOffset = offset
+        offset += len(line)
+        if line[:1] == b'*':
+            newDayStart = headerDayStart(line.decode('ascii', 'replace'))
+            if newDayStart is not None:
+                dayStart = newDayStart
+                prevSecOfDay = None
+            continue
+
+        # Only the time and ID are needed, the data bytes aren't looked at
+        splt = line.split(b' ', 4)
+        try:
+            [hourV, minV, secV, msV] = splt[0].split(b':')
+            secOfDay = (int(hourV) * 3600) + (int(minV) * 60) + int(secV)
+            arbId = int(splt[3], 16)
+        except (IndexError, ValueError):
+            continue
+        if (prevSecOfDay is not None) and (secOfDay < prevSecOfDay):
+            dayStart += 86400
+        prevSecOfDay = secOfDay
+
+        timeStamp = dayStart + secOfDay
+        if timeStamp // blockSeconds != blockId:
+            blockId = timeStamp // blockSeconds
+            block = [timeStamp, timeStamp, lineOffset, dayStart, set()]
+            blocks.append(block)
+        # The milliseconds aren't read, so the last time is rounded up to the next second
+        block[1] = timeStamp + 1
+        block[4].add(arbId)
+
+
+def _binaryBlocks(f, offset, size, blocks):
+    """
+    Add index entries for a binary log from offset onwards
+    """
+    f.seek(offset)
+    blockId = None
+    block = None
+    while offset + recordSize <= size:
+        chunk = f.read(min(4096, (size - offset) // recordSize) * recordSize)
+        if len(chunk) < recordSize:
+            break
+        for (i, (timeStamp, arbId, dlc, payload)) in enumerate(binaryRecord.iter_unpack(chunk[:len(chunk) - (len(chunk) % recordSize)])):
+            if timeStamp // blockSeconds != blockId:
+                blockId = timeStamp // blockSeconds
+                block = [timeStamp, timeStamp, offset + (i * recordSize), None, set()]
+                blocks.append(block)
+            block[1] = timeStamp
+            block[4].add(arbId)
+        offset += len(chunk) - (len(chunk) % recordSize)
+
+
+def buildIndex(fname, index=None):
+    """
+    Build the index for a log (or bring an index of a log that has grown since up to date) and save it next to the log
+    """
+    (f, size) = openLog(fname)
+    with f:
+        binary = logicalName(fname).endswith(binaryLogExt)
+        if index is not None and index['blocks']:
+            # Carry on from the start of the last block, it may not have been complete
+            blocks = [b[:4] + [set(b[4])] for b in index['blocks'][:-1]]
+            (firstTime, lastTime, offset, dayStart, ids) = index['blocks'][-1]
+        else:
+            blocks = []
+            dayStart = 0.0
+            if binary:
+                offset = readBinaryHeader(f)[1]
+            else:
+                offset = 0
+
+        if binary:
+            _binaryBlocks(f, offset, size, blocks)
+        else:
+            _textBlocks(f, offset, dayStart, blocks)
+
+    index = {'version': indexVersion, 'size': size, 'blockSeconds': blockSeconds,
+             'blocks': [b[:4] + [sorted(b[4])] for b in blocks]}
+    try:
+        with open(logicalName(fname) + indexExt + '.tmp', 'w') as outF:
+            json.dump(index, outF, separators=(',', ':'))
+        os.replace(logicalName(fname) + indexExt + '.tmp', logicalName(fname) + indexExt)
+    except OSError as e:
+        # Still fine to use, it just has to be built again next time
+        print('Could not save the index for ' + fname + ': ' + str(e))
+    return index
+
+
+def loadIndex(fname):
+    """
+    The index for a log, built or brought up to date first if it needs to be
+    """
+    index = None
+    try:
+        with open(logicalName(fname) + indexExt, 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    if fname.endswith('.zip'):
+        with zipfile.ZipFile(fname, mode='r') as zf:
+            size = zf.getinfo(os.path.basename(logicalName(fname))).file_size
+    else:
+        size = os.path.getsize(fname)
+
+    if (index is None) or (index.get('version') != indexVersion) or (index.get('blockSeconds') != blockSeconds) or \
+            (index['size'] > size):
+        return buildIndex(fname)
+    if index['size'] < size:
+        return buildIndex(fname, index)
+    return index
+
+
+def _readBlock(f, fname, start, end, dayStart):
+    """
+    Yields (timestamp, arbitration ID, data) for every frame between the two offsets
+    """
+    f.seek(start)
+    chunk = f.read(end - start)
+    if logicalName(fname).endswith(binaryLogExt):
+        for (timeStamp, arbId, dlc, payload) in binaryRecord.iter_unpack(chunk[:len(chunk) - (len(chunk) % recordSize)]):
+            yield (timeStamp, arbId, payload[:dlc])
+    else:
+        for frame in readLogLines(chunk.decode('ascii', 'replace').splitlines(), dayStart):
+            yield frame
+
+
+def queryFile(fname, start, end, canIds=None):
+    """
+    Yields (timestamp, arbitration ID, data) for the frames in one log between start and end (epoch seconds) with one of canIds
+    (every ID if None)
+    """
+    index = loadIndex(fname)
+    blocks = index['blocks']
+    f = None
+    try:
+        # Every block is checked rather than stopping at the first one past the end, in case the clock was set back part way through
+        for (i, (firstTime, lastTime, offset, dayStart, ids)) in enumerate(blocks):
+            if (firstTime > end) or (lastTime < start):
+                continue
+            if (canIds is not None) and canIds.isdisjoint(ids):
+                continue
+
+            if f is None:
+                (f, size) = openLog(fname)
+            blockEnd = blocks[i + 1][2] if (i + 1 < len(blocks)) else index['size']
+            for (timeStamp, arbId, data) in _readBlock(f, fname, offset, blockEnd, dayStart):
+                if (start <= timeStamp <= end) and ((canIds is None) or (arbId in canIds)):
+                    yield (timeStamp, arbId, data)
+    finally:
+        if f is not None:
+            f.close()
+
+
+class LogQuery(object):
+
+    def __init__(self, outDir, CANtype, signals=()):
+        """
+        outDir and CANtype as given to the CAN logger, signals (from can_signals.loadSignalTable) are needed for signalSeries
+        """
+        self.logDir = os.path.dirname(os.path.abspath(outDir))
+        self.prefix = os.path.basename(outDir) + '_'
+        self.suffix = '_' + CANtype
+        self.signals = list(signals)
+
+    def logFiles(self, start, end):
+        """
+        The log files for the hours that overlap start to end, in time order, one per hour so no frame is returned twice. If an hour
+        was logged both as text and as binary the binary log is used (its times are exact), and if it has both a plain and an archived
+        copy the plain one is used
+        """
+        byHour = {}
+        for name in os.listdir(self.logDir):
+            if not name.startswith(self.prefix):
+                continue
+            log = logicalName(name)
+            (stem, ext) = os.path.splitext(log)
+            if (ext not in ('.log', binaryLogExt)) or (not stem.endswith(self.suffix)):
+                continue
+            hourV = stem[len(self.prefix):-len(self.suffix)]
+            try:
+                hourStart = time.mktime(time.strptime(hourV, '%Y%m%d%H'))
+            except ValueError:
+                continue
+            if (hourStart > end) or (hourStart + 3600 <= start):
+                continue
+            # Lower is better
+            rank = (ext != binaryLogExt, name.endswith('.zip'))
+            if (hourStart not in byHour) or (rank < byHour[hourStart][0]):
+                byHour[hourStart] = (rank, os.path.join(self.logDir, name))
+        return [byHour[hourStart][1] for hourStart in sorted(byHour)]
+
+    def frames(self, start, end, canIds=None):
+        """
+        Yields (timestamp, arbitration ID, data) for every recorded frame between start and end (epoch seconds) with one of canIds
+        """
+        if canIds is not None:
+            canIds = frozenset(canIds)
+        for fname in self.logFiles(start, end):
+            for frame in queryFile(fname, start, end, canIds):
+                yield frame
+
+    def signalSeries(self, start, end, names):
+        """
+        The decoded values of the named signals between start and end, as a dict of name -> ([timestamps], [values])
+        """
+        wanted = [s for s in self.signals if s.name in names]
+        snapshot = SignalSnapshot([s.name for s in wanted])
+        decoderTable = compileDecoders(wanted, snapshot.index)
+        values = snapshot.values
+
+        # The slots each ID fills in, so only the signals that frame carries are recorded
+        slotsById = {}
+        for s in wanted:
+            for canId in s.can_ids:
+                slotsById.setdefault(canId, []).append(snapshot.index[s.name])
+
+        series = dict((s.name, ([], [])) for s in wanted)
+        columns = [series[name] for name in snapshot.names]
+        for (timeStamp, arbId, data) in self.frames(start, end, decoderTable.keys()):
+            if len(data) != 8:
+                continue
+            decoderTable[arbId](data, values)
+            for slot in slotsById[arbId]:
+                (timeStamps, seriesValues) = columns[slot]
+                timeStamps.append(timeStamp)
+                seriesValues.append(values[slot])
+        return series
+
+
+def main():
+    outDir = sys.argv[1]
+    CANtype = sys.argv[2]
+    start = time.mktime(time.strptime(sys.argv[3], '%Y-%m-%d %H:%M:%S'))
+    end = time.mktime(time.strptime(sys.argv[4], '%Y-%m-%d %H:%M:%S'))
+    names = sys.argv[5:]
+
+    signals = loadSignalTable(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'j1939_signals.csv'))
+    query = LogQuery(outDir, CANtype, signals)
+
+    if names:
+        for (name, (timeStamps, values)) in sorted(query.signalSeries(start, end, names).items()):
+            for (timeStamp, value) in zip(timeStamps, values):
+                print('\t'.join([name, '%.3f' % timeStamp, str(value)]))
+    else:
+        for (timeStamp, arbId, data) in query.frames(start, end):
+            print('\t'.join(['%.3f' % timeStamp, '%x' % arbId, ' '.join('%02x' % b for b in data)]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+PURPOSE: Owns the CAN interface(s) for the life of the program. The receiver brings the interface up at the right bit rate, connects to the bus,
+         hands every received message to a handler function in its own thread, and if anything goes wrong (the PiCAN board isn't found, the
+         socket errors out, the handler raises) it closes the bus and tries again after a short wait. stop() is what shuts everything down:
+         the receive thread notices within one receive timeout, closes the bus and takes the interface(s) back down with 'ip link'.
+
+         Nothing in here spins -- when there is no traffic the receive thread is asleep in bus.recv() and the thread that started the receiver
+         is free to do other work (or wait in join()).
+"""
+
+import os
+import time
+import traceback
+from threading import Thread, Event
+
+import can
+
+
+def setCANbaudRate(channels, bRate):
+    """
+    Make CAN interface to 250 or 500 kbps
+    """
+    for canV in channels:
+        os.system("sudo /sbin/ip link set " + canV + " up type can bitrate " + str(bRate))
+    time.sleep(0.1)
+
+
+def setCANdown(channels):
+    """
+    Take the CAN interface(s) down
+    """
+    for canV in channels:
+        os.system("sudo /sbin/ip link set " + canV + " down")
+
+
+class CanReceiver(object):
+    """
+    connect() must return a connected bus -- either a python-can bus or a socketcan_raw.RawCanSocket. handleFrame(timestamp, arbId, data)
+    is called in the receive thread for every frame. If metrics (a can_metrics.CanMetrics) is given, the size of every batch and the
+    kernel's dropped frame count are recorded in it
+    """
+
+    def __init__(self, channels, bRate, connect, handleFrame, recvTimeout=1.0, restartDelay=2.0, metrics=None):
+        self.channels = channels
+        self.bRate = bRate
+        self.connect = connect
+        self.handleFrame = handleFrame
+        self.recvTimeout = recvTimeout
+        self.restartDelay = restartDelay
+        self.metrics = metrics
+
+        self.bus = None
+        self.restarts = 0
+        self._stopEvent = Event()
+        self._thread = None
+
+    def start(self):
+        if self.is_alive():
+            return
+        self._stopEvent.clear()
+        self._thread = Thread(target=self._run, name='can_rx_task')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopEvent.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def is_alive(self):
+        return (self._thread is not None) and self._thread.is_alive()
+
+    def _run(self):
+        """
+        CAN receive thread
+        """
+        while not self._stopEvent.is_set():
+            try:
+                # Start from a known state -- the interface is taken down and brought back up at the right bit rate
+                setCANdown(self.channels)
+                setCANbaudRate(self.channels, self.bRate)
+                self.bus = self.connect()
+                self._receive()
+            except Exception:
+                traceback.print_exc()
+                print('CAN receiver stopped, restarting in ' + str(self.restartDelay) + 's')
+                self.restarts += 1
+            finally:
+                self._closeBus()
+
+            # Waits on the stop event rather than sleeping so a stop() during the wait takes effect right away
+            self._stopEvent.wait(self.restartDelay)
+
+        setCANdown(self.channels)
+
+    def _receive(self):
+        bus = self.bus
+        handleFrame = self.handleFrame
+        recvTimeout = self.recvTimeout
+        stopEvent = self._stopEvent
+        metrics = self.metrics
+
+        # The receive calls block until a frame arrives or the timeout runs out -- the timeout is only there so stop() is noticed
+        if hasattr(bus, 'recv_batch'):
+            # Raw socket, every frame that is waiting is taken in one go and there are no Message objects
+            while not stopEvent.is_set():
+                frames = bus.recv_batch(recvTimeout)
+                if metrics is not None:
+                    metrics.recordBatch(len(frames), bus.drops)
+                for (timeStamp, arbId, dlc, data) in frames:
+                    handleFrame(timeStamp, arbId, data)
+        else:
+            while not stopEvent.is_set():
+                message = bus.recv(recvTimeout)
+                if message is not None:
+                    handleFrame(message.timestamp, message.arbitration_id, message.data)
+
+    def _closeBus(self):
+        if self.bus is not None:
+            try:
+                self.bus.shutdown()
+            except (can.CanError, OSError):
+                pass
+            self.bus = None
@@ -0,0 +1,199 @@
+"""
+PURPOSE: Plays recorded CAN logs (text or binary) back through the same receive and decode path that live frames take, so the display can be run (and timed)
+         without a truck or a PiCAN board.
+
+         ReplayBus looks like a bus to the CAN receiver (it has recv_batch, set_filters and shutdown like socketcan_raw.RawCanSocket) and hands
+         out the recorded frames either at the speed they were recorded (speed=1), N times faster (speed=N), or as fast as the decoder can take
+         them (speed=0). Filters set on it behave like the kernel filters on a real socket, so only the IDs the decoders use come through.
+
+         Run from the command line to push recordings through the compiled decoders as fast as possible and report how long it took:
+             python3 can_replay.py <signal file> <speed> <log file> [<log file> ...]
+
+         or to work the signal stats and the liveUpdate-Hmass/liveUpdate-NiraError feeds out again from recordings, written to their own
+         output directory (never the live one, which the logger may still be writing to) with the times the frames were recorded at:
+             python3 can_replay.py --backfill <out dir> <CANtype> <numTank> <volumes> <signal file> <log file> [<log file> ...]
+"""
+
+import sys
+import time
+
+from can_binlog import isBinaryLog, readBinaryLog
+from can_logfile import readLogFile
+from can_service import CanService, feedConsumers
+from can_signals import loadSignalTable, SignalSnapshot, compileDecoders
+
+
+def readRecording(fname):
+    """
+    Yields (timestamp, arbitration ID, data) for every frame of a recorded file, text or binary
+    """
+    if isBinaryLog(fname):
+        return readBinaryLog(fname)
+    return readLogFile(fname)
+
+
+def readRecordings(fnames):
+    for fname in fnames:
+        for frame in readRecording(fname):
+            yield frame
+
+
+class ReplayBus(object):
+
+    def __init__(self, fnames, speed=1.0, restamp=True, batchSize=64):
+        """
+        speed is how many times faster than real time to play back, 0 plays as fast as possible. With restamp the frames get the time they
+        are played back at instead of the time they were recorded (so the display's latency figures make sense)
+        """
+        self.fnames = fnames
+        self.speed = speed
+        self.restamp = restamp
+        self.batchSize = batchSize
+        self.wantedIds = None
+        self.finished = False
+        # Nothing is ever dropped, here for the receiver's metrics like RawCanSocket.drops
+        self.drops = 0
+
+        self._frames = readRecordings(fnames)
+        self._next = next(self._frames, None)
+        self._firstTime = None if self._next is None else self._next[0]
+        self._wallStart = time.time()
+
+    def set_filters(self, canFilters=None):
+        if canFilters is None:
+            self.wantedIds = None
+        else:
+            self.wantedIds = set(f['can_id'] for f in canFilters)
+
+    def _dueTime(self, timeStamp):
+        # When a frame recorded at timeStamp should be played back
+        return self._wallStart + ((timeStamp - self._firstTime) / self.speed)
+
+    def recv_batch(self, timeout=None):
+        """
+        Returns a list of (timestamp, arbitration ID, dlc, data) for the frames that are due, waiting up to timeout for the first one
+        """
+        frames = []
+        if self._next is None:
+            self.finished = True
+            if timeout is not None:
+                time.sleep(timeout)
+            return frames
+
+        if self.speed > 0:
+            wait = self._dueTime(self._next[0]) - time.time()
+            if (timeout is not None) and (wait > timeout):
+                time.sleep(timeout)
+                return frames
+            if wait > 0:
+                time.sleep(wait)
+
+        now = time.time()
+        while (self._next is not None) and (len(frames) < self.batchSize):
+            (timeStamp, arbId, data) = self._next
+            if (self.speed > 0) and (self._dueTime(timeStamp) > now):
+                break
+
+            if (self.wantedIds is None) or (arbId in self.wantedIds):
+                if self.restamp:
+                    timeStamp = self._dueTime(timeStamp) if (self.speed > 0) else now
+                frames.append((timeStamp, arbId, len(data), data))
+
+            self._next = next(self._frames, None)
+
+        return frames
+
+    def send(self, message):
+        # Nothing is listening on a recording
+        pass
+
+    def shutdown(self):
+        self._frames.close()
+
+
+class NullBus(object):
+    """
+    Stands in for the bus the toggle message is sent on while replaying -- sends go nowhere
+    """
+
+    def send(self, message):
+        pass
+
+    def send_periodic(self, message, period):
+        return _NullTask()
+
+    def shutdown(self):
+        pass
+
+
+class _NullTask(object):
+
+    def modify_data(self, message):
+        pass
+
+    def stop(self):
+        pass
+
+
+def backfill(fnames, outDir, CANtype, signals, numTank, volumeL):
+    """
+    Push the recordings through the decoders and the stats/feed consumers as fast as they go, keeping each frame's recorded time so
+    the output is the same as if it had been written live. Returns the number of frames
+    """
+    service = CanService([], None, None, signals, numTank, volumeL)
+    for consumer in feedConsumers(outDir, CANtype, signals, service.truckVars):
+        service.addConsumer(consumer)
+    bus = ReplayBus(fnames, 0, restamp=False)
+    service.prepareBus(bus)
+    numFrames = 0
+    try:
+        while True:
+            frames = bus.recv_batch()
+            if bus.finished:
+                break
+            for (timeStamp, arbId, dlc, data) in frames:
+                service.handleFrame(timeStamp, arbId, data)
+            numFrames += len(frames)
+    finally:
+        bus.shutdown()
+        service.close()
+    return numFrames
+
+
+def main():
+    if sys.argv[1] == '--backfill':
+        (outDir, CANtype, numTank, volumeStr, signalFname) = sys.argv[2:7]
+        numFrames = backfill(sys.argv[7:], outDir, CANtype, loadSignalTable(signalFname), int(numTank),
+                             [float(x) for x in volumeStr.split(",")])
+        print(str(numFrames) + ' frames written to ' + outDir)
+        return
+
+    signals = loadSignalTable(sys.argv[1])
+    speed = float(sys.argv[2])
+    fnames = sys.argv[3:]
+
+    snapshot = SignalSnapshot([s.name for s in signals])
+    decoderTable = compileDecoders(signals, snapshot.index)
+    values = snapshot.values
+
+    bus = ReplayBus(fnames, speed, restamp=False)
+    numFrames = 0
+    start = time.time()
+    while True:
+        frames = bus.recv_batch(0.1)
+        if bus.finished:
+            break
+        for (timeStamp, arbId, dlc, data) in frames:
+            decoder = decoderTable.get(arbId)
+            if (decoder is not None) and (dlc == 8):
+                decoder(data, values)
+        numFrames += len(frames)
+    elapsed = time.time() - start
+
+    print(str(numFrames) + ' frames in ' + ('%.2f' % elapsed) + 's (' + ('%.0f' % (numFrames / max(elapsed, 1e-9))) + ' frames/s)')
+    for (name, value) in zip(snapshot.names, values):
+        print(name + ': ' + str(value))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+"""
+PURPOSE: The one thing on the truck that owns the CAN bus. The display and the CAN logger used to each bring can0 down and up, open their own
+         socket and decode every frame themselves -- and every time one of them restarted it took the interface down under the other. Now the
+         CanService receives every frame once, decodes it once into the shared values snapshot (truck_live.liveUpdateTruck), and then hands
+         the frame to each consumer in the same receive thread:
+             - the display reads the snapshot on its own timer (publishTruckValues), it isn't called per frame
+             - HourlyLogWriter (can_logfile.py) writes the hourly .log files
+             - AggregateFeed keeps the per second/minute/hour stats of every signal (signal_aggregates.py) and writes the minutes and
+               hours to stats-1min.txt and stats-1h.txt
+             - HmassFeed writes the once a second hydrogen mass line to liveUpdate-Hmass.txt from each finished second's stats
+             - NiraErrorFeed adds a line to liveUpdate-NiraError.txt whenever the NIRA fault number changes
+             - FaultHistoryFeed records every change of the NIRA fault number and the DM1 lamp in the display's fault history
+               (fault_history.py)
+
+         A consumer is any object with onFrame(timestamp, arbId, data) (or None if it doesn't want frames), close() and an allFrames
+         attribute (True if it needs every frame on the bus rather than just the IDs that are decoded, which turns the kernel filters off).
+         The data may be a view into the receive buffer that is only good until onFrame returns. A consumer that raises is reported and
+         dropped so it can't take the bus down with it.
+
+         Something that only needs to look at the snapshot once new values have arrived (the display's publisher) can set wake and then
+         waiting -- the next frame clears waiting and calls wake() once, from the receive thread, so nothing has to run on a timer while the
+         bus is quiet.
+
+         Run on its own it replaces recordCANlogger.py for trucks with no display, and takes the same command line:
+             python3 can_service.py <outDir> <numCAN> <bRate> <CANtype> <numTank> <volumeStr> [text|binary]
+"""
+
+import os
+import sys
+import traceback
+
+import socketcan_raw
+from can_archive import LogArchiver
+from can_binlog import HourlyBinaryLogWriter, sessionInfo
+from can_logfile import HourlyLogWriter, TimeFormatter
+from can_receiver import CanReceiver
+from can_signals import loadSignalTable, tankTempNames, hydrogenMassEq2, profileSignalNames
+from fault_history import faultKind, lampKind
+from signal_aggregates import resolutions
+from truck_live import newTruckVars, liveUpdateTruck, applyTruckProfile
+
+
+class CanService(object):
+
+    def __init__(self, channels, bRate, openBus, signals, numTank, volumeL, consumers=()):
+        """
+        openBus() returns a newly connected bus (it is called again after every restart)
+        """
+        self.openBus = openBus
+        self.signals = signals
+        self.consumers = list(consumers)
+        self.decoderTable = {}
+        self.truckVars = newTruckVars(signals, numTank, volumeL)
+        self._values = self.truckVars['snapshot'].values
+        self._metrics = self.truckVars['metrics']
+        self._onFrames = self._frameHandlers()
+        self.wake = None
+        self.waiting = False
+        self.receiver = CanReceiver(channels, bRate, self._connect, self.handleFrame, metrics=self._metrics)
+
+    def addConsumer(self, consumer):
+        """
+        Consumers that need truckVars are made after the service, add them before start()
+        """
+        self.consumers.append(consumer)
+        self._onFrames = self._frameHandlers()
+
+    def _frameHandlers(self):
+        # A consumer with no onFrame (e.g. the log archiver) only wants to be closed with the service
+        return [c.onFrame for c in self.consumers if c.onFrame is not None]
+
+    def prepareBus(self, bus):
+        """
+        Compile the decoders for this truck and set the kernel filters to match (or let everything through if a consumer needs it)
+        """
+        applyTruckProfile(bus, self.decoderTable, self.signals, self.truckVars)
+        if any(c.allFrames for c in self.consumers):
+            bus.set_filters(None)
+
+    def _connect(self):
+        bus = self.openBus()
+        self.prepareBus(bus)
+        return bus
+
+    def handleFrame(self, timeStamp, arbId, data):
+        liveUpdateTruck(timeStamp, arbId, data, self.decoderTable, self._values, self._metrics)
+        if self.waiting:
+            self.waiting = False
+            self.wake()
+        for onFrame in self._onFrames:
+            try:
+                onFrame(timeStamp, arbId, data)
+            except Exception:
+                self._dropConsumer(onFrame)
+
+    def _dropConsumer(self, onFrame):
+        traceback.print_exc()
+        for c in self.consumers:
+            if c.onFrame == onFrame:
+                print('CAN consumer ' + type(c).__name__ + ' failed and has been stopped')
+                self.consumers.remove(c)
+                self._closeConsumer(c)
+                break
+        # Replaced rather than changed so the loop in handleFrame that is still running over the old list isn't affected
+        self._onFrames = self._frameHandlers()
+
+    def _closeConsumer(self, consumer):
+        try:
+            consumer.close()
+        except Exception:
+            traceback.print_exc()
+
+    def start(self):
+        self.receiver.start()
+
+    def stop(self):
+        self.receiver.stop()
+
+    def join(self, timeout=None):
+        """
+        Waits for the receive thread, and once it has finished closes the consumers (which finishes off the log files)
+        """
+        self.receiver.join(timeout)
+        if not self.receiver.is_alive():
+            self.close()
+
+    def is_alive(self):
+        return self.receiver.is_alive()
+
+    def close(self):
+        for c in self.consumers:
+            self._closeConsumer(c)
+
+
+class AggregateFeed(object):
+    """
+    Adds every decoded value to truckVars' SignalAggregator, and if statsPrefix is given writes each finished minute and hour to
+    statsPrefix + 'stats-1min.txt' / 'stats-1h.txt' (a line per signal: start of the period, name, count, min, max, mean, last). The
+    lines are only written out every flushMinutes minutes, when an hour finishes and when it is closed, so the SD card sees a few
+    writes an hour rather than one a second
+    """
+    allFrames = False
+
+    def __init__(self, truckVars, signals, statsPrefix=None, flushMinutes=10):
+        self.aggregator = truckVars['aggregates']
+        self.values = truckVars['snapshot'].values
+        self.names = truckVars['snapshot'].names
+        self.statsPrefix = statsPrefix
+        self.flushMinutes = flushMinutes
+        self.formatter = TimeFormatter()
+
+        # Only the signals this truck's decoders fill in
+        index = truckVars['snapshot'].index
+        wanted = profileSignalNames(signals, truckVars['numTank'])
+        slotsById = {}
+        for s in signals:
+            if s.name in wanted:
+                for canId in s.can_ids:
+                    slotsById.setdefault(canId, []).append(index[s.name])
+        self.slotsById = dict((canId, tuple(slots)) for (canId, slots) in slotsById.items())
+
+        self.pending = dict((seconds, []) for seconds in resolutions[1:])
+        self.pendingMinutes = 0
+        if statsPrefix is not None:
+            for seconds in resolutions[1:]:
+                self.aggregator.listen(seconds, self._finished)
+
+    def onFrame(self, timeStamp, arbId, data):
+        aggregator = self.aggregator
+        if not (aggregator.secondStart <= timeStamp < aggregator.secondEnd):
+            aggregator.roll(timeStamp)
+        slots = self.slotsById.get(arbId)
+        if (slots is None) or (len(data) != 8):
+            return
+        # The service has already decoded this frame into the snapshot
+        values = self.values
+        for slot in slots:
+            aggregator.add(slot, values[slot])
+
+    def _finished(self, timeStamp, bucket):
+        date = self.formatter.outDate(bucket.start)
+        lines = self.pending[bucket.seconds]
+        for (slot, n) in enumerate(bucket.count):
+            if n:
+                lines.append("\t".join([date, self.names[slot], str(n), str(bucket.low[slot]), str(bucket.high[slot]),
+                                        str(round(bucket.total[slot] / n, 3)), str(bucket.last[slot])]))
+        if bucket.seconds == 60:
+            self.pendingMinutes += 1
+        if (self.pendingMinutes >= self.flushMinutes) or (bucket.seconds != 60):
+            self.flush()
+
+    def flush(self):
+        for (seconds, lines) in self.pending.items():
+            if not lines:
+                continue
+            fname = self.statsPrefix + ('stats-1min.txt' if seconds == 60 else 'stats-1h.txt')
+            newFile = not os.path.isfile(fname)
+            with open(fname, "a") as outF:
+                if newFile:
+                    outF.write("\t".join(["date", "signal", "count", "min", "max", "mean", "last"]) + "\n")
+                outF.write("\n".join(lines) + "\n")
+            del lines[:]
+        self.pendingMinutes = 0
+
+    def close(self):
+        if self.statsPrefix is not None:
+            self.flush()
+
+
+class HmassFeed(object):
+    """
+    Once a second writes the hydrogen mass, wheel speed, rail pressure, tank 1 pressure and tank temperatures to liveUpdate-Hmass.txt,
+    same as the CAN logger did. It is called with each second's aggregates as the second finishes (so it needs an AggregateFeed), and
+    only writes a line if every value it needs had a frame during that second
+    """
+    onFrame = None
+    allFrames = False
+
+    def __init__(self, fname, truckVars, signals):
+        self.fname = fname
+        self.numTank = truckVars['numTank']
+        self.volumeL = truckVars['volumeL']
+        self.formatter = TimeFormatter()
+        self.outF = None
+
+        index = truckVars['snapshot'].index
+        self.tempSlots = [index[name] for name in tankTempNames(self.numTank)]
+        self.wheelSpeedSlot = index['wheelSpeed']
+        self.railPressureSlot = index['railPressure']
+        self.presT1Slot = index['presT1']
+        truckVars['aggregates'].listen(1, self._writeSecond)
+
+    def _writeSecond(self, timeStamp, bucket):
+        if self.outF is None:
+            newFile = not os.path.isfile(self.fname)
+            self.outF = open(self.fname, "a")
+            if newFile:
+                self.outF.write("\t".join(["date", "H2mass", "RPM", "H2RailPressure", "TankPressure"] +
+                                          [("Tank" + str(x + 1) + "Temp") for x in range(self.numTank)]) + "\n")
+
+        # The last value of each signal in the second, None if it didn't arrive
+        last = bucket.last
+        tempL = [last[slot] for slot in self.tempSlots]
+        presT1 = last[self.presT1Slot]
+        wheelSpeed = last[self.wheelSpeedSlot]
+        railPressure = last[self.railPressureSlot]
+
+        if (None in tempL) or (presT1 is None) or (wheelSpeed is None) or (railPressure is None):
+            return
+
+        # Only consider tank 1 hydrogen pressure
+        HtotalMass = round(sum(hydrogenMassEq2(presT1, tempL[t], self.volumeL[t]) for t in range(self.numTank)), 1)
+        self.outF.write("\t".join([self.formatter.outDate(timeStamp), str(HtotalMass), str(wheelSpeed), str(railPressure),
+                                   str(round(presT1, 1))] + [str(x) for x in tempL]) + "\n")
+        self.outF.flush()
+
+    def close(self):
+        if self.outF is not None:
+            self.outF.close()
+            self.outF = None
+
+
+class NiraErrorFeed(object):
+    """
+    Adds a line to liveUpdate-NiraError.txt every time the NIRA last fault number changes, same as the CAN logger did
+    """
+    allFrames = False
+
+    def __init__(self, fname, truckVars, signals):
+        self.fname = fname
+        self.values = truckVars['snapshot'].values
+        self.slot = truckVars['snapshot'].index['nirai7LastFaultNumber']
+        self.canIds = frozenset([canId for s in signals if s.name == 'nirai7LastFaultNumber' for canId in s.can_ids])
+        self.formatter = TimeFormatter()
+        self.prevNiraError = None
+
+    def onFrame(self, timeStamp, arbId, data):
+        if (arbId not in self.canIds) or (len(data) != 8):
+            return
+
+        nirai7LastFaultNumber = self.values[self.slot]
+        if self.prevNiraError is None:
+            self.prevNiraError = nirai7LastFaultNumber
+        elif nirai7LastFaultNumber != self.prevNiraError:
+            (ymdFV, hmsfV, hourV, ymdBV) = self.formatter.extract(timeStamp)
+            with open(self.fname, "a") as livefeedNiraErrorF:
+                livefeedNiraErrorF.write("\t".join(["-".join([ymdBV, hmsfV, hourV]), hmsfV, str(nirai7LastFaultNumber)]) + "\n")
+            self.prevNiraError = nirai7LastFaultNumber
+
+    def close(self):
+        pass
+
+
+class FaultHistoryFeed(object):
+    """
+    Records every change of the NIRA last fault number and the DM1 lamp in a fault_history.FaultHistory as the frame that carries it
+    arrives, so a fault that only lasts between two display updates (or while the screen saver is up) is still kept
+    """
+    allFrames = False
+
+    def __init__(self, history, truckVars, signals, changed=None):
+        """
+        changed() is called from the receive thread after each change is recorded (the display passes a Kivy trigger)
+        """
+        self.history = history
+        self.changed = changed
+        self.values = truckVars['snapshot'].values
+        index = truckVars['snapshot'].index
+        # (kind, slot) of each watched signal, for each of the IDs it is sent under
+        self.watched = {}
+        for (kind, name) in ((faultKind, 'nirai7LastFaultNumber'), (lampKind, 'DM1')):
+            for s in signals:
+                if s.name == name:
+                    for canId in s.can_ids:
+                        self.watched.setdefault(canId, []).append((kind, index[name]))
+        # Carries on from the last values in the history, so a change while the display was off is recorded too
+        self.prev = dict(history.lastValue)
+
+    def onFrame(self, timeStamp, arbId, data):
+        watched = self.watched.get(arbId)
+        if (watched is None) or (len(data) != 8):
+            return
+
+        for (kind, slot) in watched:
+            value = self.values[slot]
+            if value is None:
+                continue
+            value = int(value)
+            if value != self.prev.get(kind):
+                self.history.append(timeStamp, kind, self.prev.get(kind), value)
+                self.prev[kind] = value
+                if self.changed is not None:
+                    self.changed()
+
+    def close(self):
+        # The history's file is only flushed as it goes, it is closed with the service
+        self.history.close()
+
+
+def loggerConsumers(outDir, CANtype, bRate, signals, truckVars, logFormat='text', archiver=None):
+    """
+    Everything the CAN logger used to do: the hourly log files (as text, or in the binary format of can_binlog.py) and the two live
+    feed files, plus the per minute and per hour signal stats. With an archiver (can_archive.LogArchiver) every finished hourly file
+    is compressed in the background
+    """
+    onClosed = None if archiver is None else archiver.submit
+    if logFormat == 'binary':
+        info = sessionInfo(bRate, CANtype, os.path.basename(outDir), truckVars['numTank'], truckVars['volumeL'])
+        logWriter = HourlyBinaryLogWriter(outDir, CANtype, info, onClosed)
+    else:
+        logWriter = HourlyLogWriter(outDir, CANtype, bRate, onClosed)
+    consumers = [logWriter] + feedConsumers(outDir, CANtype, signals, truckVars)
+    # Last, so it is closed after the log writer has handed over its final file
+    if archiver is not None:
+        consumers.append(archiver)
+    return consumers
+
+
+def feedConsumers(outDir, CANtype, signals, truckVars):
+    """
+    The signal stats and the two live feed files, written under outDir the same way the CAN logger names them
+    """
+    return [AggregateFeed(truckVars, signals, "_".join([outDir, CANtype, ""])),
+            HmassFeed("_".join([outDir, CANtype, "liveUpdate-Hmass.txt"]), truckVars, signals),
+            NiraErrorFeed("_".join([outDir, CANtype, "liveUpdate-NiraError.txt"]), truckVars, signals)]
+
+
+def openCanBus(canV):
+    """
+    The raw socket reader where it is available, python-can everywhere else
+    """
+    if socketcan_raw.isAvailable():
+        return socketcan_raw.RawCanSocket(canV)
+    import can
+    return can.interface.Bus(channel=canV, bustype='socketcan_native')
+
+
+def main():
+    outDir = sys.argv[1]  # "/home/pi/rough/logger-rbp-python-out/lomack150_"
+    numCAN = int(sys.argv[2])  # 2
+    bRate = int(sys.argv[3])  # 250000 or 500000
+    CANtype = sys.argv[4]  # OCAN or ACAN
+    numTank = int(sys.argv[5])
+    volumeStr = sys.argv[6]
+    # Optional, 'text' (the default) or 'binary'
+    logFormat = sys.argv[7] if len(sys.argv) > 7 else 'text'
+
+    volumeL = [float(x) for x in volumeStr.split(",")]
+    signals = loadSignalTable(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'j1939_signals.csv'))
+
+    # Only can0 is received, same as the CAN logger (which brought can1 up but never read it)
+    service = CanService(['can0', 'can1'][:numCAN], bRate, lambda: openCanBus('can0'), signals, numTank, volumeL)
+    # Finished hourly logs are compressed in the background, with the archiver's default retention and size cap
+    for consumer in loggerConsumers(outDir, CANtype, bRate, signals, service.truckVars, logFormat, LogArchiver(outDir)):
+        service.addConsumer(consumer)
+    service.start()
+
+    try:
+        while service.is_alive():
+            service.join(1)
+    except KeyboardInterrupt:
+        print('\n\rKeyboard interrupt')
+    service.stop()
+    service.join(5)
+
+
+if __name__ == "__main__":
+    main()
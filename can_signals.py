@@ -0,0 +1,134 @@
+"""
+PURPOSE: Loads the J1939 signal definitions in "j1939_signals.csv" and compiles them into the decoders that are used on every received CAN frame.
+         Both the display ("Main Interface.py") and the CAN logger (recordCANlogger.py) use this file so there is only one place where a signal's
+         byte position, clamp, scale and offset are written down.
+
+         Every row of the signal file describes one signal: its name, the arbitration ID(s) it is sent under, where its bits are in the 8 data bytes,
+         the maximum raw value (anything above is clamped, this is what enforceMaxV used to do), and the scale and offset to turn the raw value into
+         real units. At startup the rows are grouped by arbitration ID and turned into one decoder function per ID, each decoder only has to do a
+         single int.from_bytes on the frame and then a shift/mask/clamp/scale for each of its signals.
+"""
+
+from collections import namedtuple
+
+# One row of the signal definition file, can_ids is a tuple of integer arbitration IDs
+Signal = namedtuple('Signal', ['name', 'can_ids', 'start_bit', 'length', 'max_raw', 'scale', 'offset', 'unit'])
+
+# The largest number of tanks a truck profile can have -- the signal file has a temperature for each of these
+maxNumTanks = 6
+
+
+def loadSignalTable(fname):
+    """
+    Read the signal definition file, blank lines and lines starting with '#' are skipped
+    """
+    signals = []
+    with open(fname, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if (line == '') or line.startswith('#'):
+                continue
+
+            [name, canIds, startBit, length, maxRaw, scale, offset, unit] = [x.strip() for x in line.split(',')]
+
+            signals.append(Signal(name, tuple(int(x, 16) for x in canIds.split(';')), int(startBit), int(length),
+                                  int(maxRaw), float(scale), float(offset), unit))
+    return signals
+
+
+def tankTempNames(numTank):
+    """
+    The names of the tank temperature signals for a truck with numTank tanks
+    """
+    return ['tankTemp' + str(t + 1) for t in range(numTank)]
+
+
+def profileSignalNames(signals, numTank):
+    """
+    The names of the signals a truck with numTank tanks actually uses -- temperatures for tanks the truck doesn't have are left out
+    """
+    unusedTemps = set(tankTempNames(maxNumTanks)) - set(tankTempNames(numTank))
+    return set(s.name for s in signals if s.name not in unusedTemps)
+
+
+class SignalSnapshot(object):
+    """
+    The latest decoded value of every signal, kept in a flat list with one slot per signal. The decoders (in the receive thread) only
+    ever store into the list and whoever shows or records the values reads it whenever it likes -- single list item stores and loads
+    are atomic in Python so no lock is needed
+    """
+    __slots__ = ('names', 'index', 'values')
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        self.index = dict((name, i) for (i, name) in enumerate(self.names))
+        self.values = [None] * len(self.names)
+
+    def get(self, name):
+        return self.values[self.index[name]]
+
+
+def makeDecoder(fields):
+    """
+    Build the decoder for one arbitration ID, fields is a tuple of (slot, shift, mask, maxRaw, scale, offset)
+    The decoder stores the decoded values into their slots of the 'values' list
+    """
+
+    def decode(data, values):
+        raw = int.from_bytes(data, 'little')
+        for (slot, shift, mask, maxRaw, scale, offset) in fields:
+            v = (raw >> shift) & mask
+            if v > maxRaw:
+                v = maxRaw
+            values[slot] = (v * scale) + offset
+
+    return decode
+
+
+def compileDecoders(signals, slotIndex, wanted=None):
+    """
+    Group the signals by arbitration ID and build one decoder per ID that stores into the slots given by slotIndex (signal name -> slot,
+    usually a SignalSnapshot's index). If wanted is given only the signals named in it are included and IDs with none of the wanted
+    signals are left out completely
+    Returns a dict of arbitration ID -> decoder
+    """
+    fieldsById = {}
+    for s in signals:
+        if (wanted is not None) and (s.name not in wanted):
+            continue
+        field = (slotIndex[s.name], s.start_bit, (1 << s.length) - 1, s.max_raw, s.scale, s.offset)
+        for canId in s.can_ids:
+            fieldsById.setdefault(canId, []).append(field)
+
+    return dict((canId, makeDecoder(tuple(fields))) for (canId, fields) in fieldsById.items())
+
+
+def hydrogenMassEq2(pressureV, tempV, volumeV):
+    """
+    Calculate the hydrogen mass using more complex equation
+    Value returns in unit kilo grams
+    Only uses arithmetic so pressureV/tempV can also be whole NumPy arrays (see can_batch.py)
+    """
+
+    var1 = 0.000000001348034
+    var2 = 0.000000267013
+    var3 = 0.00004247859
+    var4 = 0.000001195678
+    var5 = 0.0003204561
+    var6 = 0.0867471
+
+    component1 = (((-var1 * (tempV ** 2)) + (var2 * tempV) - var3) * (pressureV ** 2))
+    component2 = ((var4 * (tempV ** 2)) - (var5 * tempV) + var6) * pressureV
+
+    HmassTotal = (component1 + component2) * volumeV
+    HmassTotalKg = HmassTotal / 1000.0
+
+    return HmassTotalKg
+
+
+def canFiltersFor(canIds):
+    """
+    SocketCAN filters that only let frames with exactly these (29 bit) arbitration IDs through to the socket, everything else is
+    dropped by the kernel before Python ever wakes up
+    """
+    return [{'can_id': canId, 'can_mask': 0x1FFFFFFF, 'extended': True} for canId in sorted(canIds)]
@@ -0,0 +1,120 @@
+"""
+PURPOSE: A record of every change of the NIRA fault code and of the DM1 malfunction lamp, with when it happened, for the Fault Info page -- the
+         display used to only show the fault there is right now, so one that came and went while nobody was looking was never seen.
+
+         The history is a fixed size file of fixed size records used as a ring: once it is full each new change overwrites the oldest
+         one, so it never grows past capacity records however long the truck runs, and it is kept when the display is turned off. A
+         change is written (and flushed) as it happens, which is rare enough that it costs nothing. Because every record is the same size,
+         any page of the history is read by seeking straight to it rather than reading through the file.
+
+         The changes are picked up from the decoded frames by can_service.FaultHistoryFeed (in the receive thread), and the display reads
+         pages from the main thread, so all access goes through a lock.
+"""
+
+import io
+import struct
+import threading
+import time
+
+from fault_table import describeFault, noFaultCode
+
+# What changed
+faultKind = 0
+lampKind = 1
+
+_header = struct.Struct('<4sHHII')
+_magic = b'HFLT'
+_version = 1
+# time, kind, previous value (-1 if there wasn't one), new value
+_record = struct.Struct('<dBhh')
+
+
+class FaultHistory(object):
+
+    def __init__(self, fname=None, capacity=4096):
+        """
+        Carries on with the history already in fname (kept in memory only if fname is None). A file made with a different capacity is
+        started again
+        """
+        self.capacity = capacity
+        self.written = 0
+        self._lock = threading.Lock()
+        self._f = None
+        if fname is not None:
+            try:
+                self._f = open(fname, 'r+b')
+                (magic, version, recordSize, fileCapacity, written) = _header.unpack(self._f.read(_header.size))
+                if (magic, version, recordSize, fileCapacity) == (_magic, _version, _record.size, capacity):
+                    self.written = written
+                else:
+                    print('Starting a new fault history in ' + fname + ', the old one was a different size or version')
+                    self._f.truncate(0)
+            except FileNotFoundError:
+                self._f = open(fname, 'w+b')
+            except struct.error:
+                self._f.truncate(0)
+        if self._f is None:
+            self._f = io.BytesIO()
+        self._writeHeader()
+
+        # The newest value of each kind, so a change that happened while the display was off is still recorded as one
+        self.lastValue = {}
+        for i in range(len(self)):
+            (timeStamp, kind, previous, value) = self.entry(i)
+            self.lastValue.setdefault(kind, value)
+            if len(self.lastValue) == 2:
+                break
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def _writeHeader(self):
+        self._f.seek(0)
+        self._f.write(_header.pack(_magic, _version, _record.size, self.capacity, self.written))
+
+    def append(self, timeStamp, kind, previous, value):
+        with self._lock:
+            self._f.seek(_header.size + ((self.written % self.capacity) * _record.size))
+            self._f.write(_record.pack(timeStamp, kind, -1 if previous is None else previous, value))
+            self.written += 1
+            self._writeHeader()
+            self._f.flush()
+            self.lastValue[kind] = value
+
+    def entry(self, i):
+        """
+        (time, kind, previous, value) of the i'th newest change (0 is the latest), previous is None if there wasn't one
+        """
+        with self._lock:
+            if not 0 <= i < len(self):
+                raise IndexError(i)
+            self._f.seek(_header.size + (((self.written - 1 - i) % self.capacity) * _record.size))
+            (timeStamp, kind, previous, value) = _record.unpack(self._f.read(_record.size))
+        return (timeStamp, kind, None if previous < 0 else previous, value)
+
+    def pages(self, pageSize):
+        return max(1, -(-len(self) // pageSize))
+
+    def page(self, number, pageSize):
+        """
+        The changes on one page, newest first -- page 0 is the latest pageSize changes
+        """
+        first = number * pageSize
+        return [self.entry(i) for i in range(first, min(first + pageSize, len(self)))]
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+
+def formatChange(change, faultTable):
+    """
+    One line of text for a change, for the Fault Info page
+    """
+    (timeStamp, kind, previous, value) = change
+    when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timeStamp))
+    if kind == lampKind:
+        return when + '   MIL lamp ' + ('off' if value == 0 else 'on')
+    if value == noFaultCode:
+        return when + '   Fault cleared'
+    return when + '   Fault ' + str(value) + ': ' + describeFault(faultTable, value)
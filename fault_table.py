@@ -0,0 +1,73 @@
+"""
+PURPOSE: The NIRA fault descriptions, looked up by fault code. faultmessages.txt has one fault per line as 'code,number,description' (some
+         with a fourth field giving more detail) and is in descending order, so a fault has to be found by its code rather than by where
+         its line is in the file -- the display used to do the latter and showed the wrong description for nearly every code.
+
+         The file is compiled into a {code: (number, description, detail)} table once and cached next to it as <file>.cache.json, which is
+         used as long as the file hasn't changed since (same size and modified time). A cache that can't be written just means the file is
+         parsed again next time.
+"""
+
+import json
+import os
+
+cacheExt = '.cache.json'
+cacheVersion = 1
+# The code the NIRA sends when there is no fault
+noFaultCode = 255
+
+
+def parseFaultFile(fname):
+    """
+    {code: (number, description, detail)}, detail is '' when the line doesn't have one
+    """
+    table = {}
+    with open(fname, 'r') as f:
+        for line in f:
+            fields = [x.strip() for x in line.split(',')]
+            if len(fields) < 3:
+                continue
+            try:
+                code = int(fields[0])
+            except ValueError:
+                continue
+            table[code] = (fields[1], fields[2], ','.join(fields[3:]))
+    return table
+
+
+def loadFaultTable(fname):
+    """
+    The fault table from the cache if it is up to date, otherwise from the file (and the cache is written again)
+    """
+    stat = os.stat(fname)
+    cacheFname = fname + cacheExt
+    try:
+        with open(cacheFname, 'r') as f:
+            cache = json.load(f)
+        if (cache.get('version') == cacheVersion) and (cache.get('size') == stat.st_size) and (cache.get('mtime') == stat.st_mtime):
+            return dict((int(code), tuple(fault)) for (code, fault) in cache['faults'].items())
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+
+    table = parseFaultFile(fname)
+    cache = {'version': cacheVersion, 'size': stat.st_size, 'mtime': stat.st_mtime,
+             'faults': dict((str(code), list(fault)) for (code, fault) in table.items())}
+    try:
+        with open(cacheFname + '.tmp', 'w') as f:
+            json.dump(cache, f, separators=(',', ':'))
+        os.replace(cacheFname + '.tmp', cacheFname)
+    except OSError as e:
+        print('Could not save the fault table cache: ' + str(e))
+    return table
+
+
+def describeFault(table, code):
+    """
+    The text shown for a fault code
+    """
+    if code == noFaultCode:
+        return 'Running as expected'
+    fault = table.get(code)
+    if fault is None:
+        return 'Invalid Code'
+    return fault[1]
@@ -0,0 +1,141 @@
+"""
+PURPOSE: Running min/max/mean/last/count of every decoded signal over each second, minute and hour, so the once a second feeds, the display and
+         any daily summary can read numbers that are already worked out instead of going back through the raw values.
+
+         A sample only updates the current second (five list stores, the same cost however many resolutions there are). When a second is
+         over it is added to its minute as a whole, and a finished minute is added to its hour the same way, so a minute or an hour costs
+         one update per signal when it closes rather than one per sample. Whoever wants the finished periods registers a listener for a
+         resolution (e.g. can_service.HmassFeed for every second, AggregateFeed for the minutes and hours it writes out in batches), and the
+         last few of each are kept in memory for anything that wants to look back.
+
+         Hours start on the hour in UTC, which is on the hour locally as well in any time zone that is a whole number of hours off.
+"""
+
+from collections import deque
+
+# The periods in seconds, each one has to be a whole number of the one before it
+resolutions = (1, 60, 3600)
+_inf = float('inf')
+
+
+class Bucket(object):
+    """
+    The aggregates of every signal over one period, start is the epoch time the period began. Lists are indexed by signal slot, a signal
+    with count 0 had no samples in the period
+    """
+    __slots__ = ('start', 'seconds', 'count', 'total', 'low', 'high', 'last')
+
+    def __init__(self, start, seconds, size):
+        self.start = start
+        self.seconds = seconds
+        self.count = [0] * size
+        self.total = [0.0] * size
+        self.low = [_inf] * size
+        self.high = [-_inf] * size
+        self.last = [None] * size
+
+    def contains(self, timeStamp):
+        return self.start <= timeStamp < self.start + self.seconds
+
+    def merge(self, other):
+        """
+        Add a finished (shorter) period's aggregates into this one
+        """
+        count = self.count
+        total = self.total
+        low = self.low
+        high = self.high
+        last = self.last
+        for (slot, n) in enumerate(other.count):
+            if n:
+                count[slot] += n
+                total[slot] += other.total[slot]
+                if other.low[slot] < low[slot]:
+                    low[slot] = other.low[slot]
+                if other.high[slot] > high[slot]:
+                    high[slot] = other.high[slot]
+                last[slot] = other.last[slot]
+
+    def stats(self, slot):
+        """
+        {'count', 'min', 'max', 'mean', 'last'} for one signal, None if it had no samples
+        """
+        n = self.count[slot]
+        if n == 0:
+            return None
+        return {'count': n, 'min': self.low[slot], 'max': self.high[slot], 'mean': self.total[slot] / n, 'last': self.last[slot]}
+
+
+class SignalAggregator(object):
+
+    def __init__(self, names, keep=(300, 1440, 168)):
+        """
+        names are the signals in slot order (usually a SignalSnapshot's names). keep is how many finished periods of each resolution are
+        held on to for looking back at -- by default 5 minutes of seconds, a day of minutes and a week of hours
+        """
+        self.names = tuple(names)
+        self.index = dict((name, i) for (i, name) in enumerate(self.names))
+        self.current = [None] * len(resolutions)
+        self.recent = [deque(maxlen=k) for k in keep]
+        self.listeners = [[] for seconds in resolutions]
+        # The second currently being filled, checked on every frame so they are kept as plain attributes
+        self.second = None
+        self.secondStart = _inf
+        self.secondEnd = -_inf
+
+    def listen(self, seconds, listener):
+        """
+        listener(timeStamp, bucket) is called every time a period of the given resolution finishes -- timeStamp is the time of the sample
+        that finished it
+        """
+        self.listeners[resolutions.index(seconds)].append(listener)
+
+    def roll(self, timeStamp):
+        """
+        Finish any periods timeStamp is past and start new ones. Call it before add() whenever timeStamp isn't inside
+        [secondStart, secondEnd)
+        """
+        size = len(self.names)
+        for (level, seconds) in enumerate(resolutions):
+            bucket = self.current[level]
+            if (bucket is not None) and bucket.contains(timeStamp):
+                break
+            if bucket is not None:
+                # Goes into the longer period it belongs to before that one is checked itself
+                if level + 1 < len(resolutions):
+                    upper = self.current[level + 1]
+                    if upper is None:
+                        upperSeconds = resolutions[level + 1]
+                        upper = Bucket(bucket.start - (bucket.start % upperSeconds), upperSeconds, size)
+                        self.current[level + 1] = upper
+                    upper.merge(bucket)
+                self.recent[level].append(bucket)
+                for listener in self.listeners[level]:
+                    listener(timeStamp, bucket)
+            self.current[level] = Bucket(timeStamp - (timeStamp % seconds), seconds, size)
+
+        self.second = self.current[0]
+        self.secondStart = self.second.start
+        self.secondEnd = self.second.start + 1
+
+    def add(self, slot, value):
+        bucket = self.second
+        bucket.count[slot] += 1
+        bucket.total[slot] += value
+        if value < bucket.low[slot]:
+            bucket.low[slot] = value
+        if value > bucket.high[slot]:
+            bucket.high[slot] = value
+        bucket.last[slot] = value
+
+    def summary(self, name, seconds, start, end):
+        """
+        The aggregates of one signal over the finished periods of a resolution that started between start and end (e.g. the hours of a
+        day), as the same dict as Bucket.stats or None
+        """
+        slot = self.index[name]
+        total = Bucket(start, end - start, len(self.names))
+        for bucket in self.recent[resolutions.index(seconds)]:
+            if start <= bucket.start < end:
+                total.merge(bucket)
+        return total.stats(slot)
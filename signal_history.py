@@ -0,0 +1,132 @@
+"""
+PURPOSE: A short history of a few signals for the trend lines on the display, so a driver or technician can see whether the fuel is going down
+         faster than usual instead of only the value right now.
+
+         Every signal has a fixed size ring buffer (a flat array of doubles, NaN where there was no value) and they all share one array of
+         sample times. Samples are taken every 'period' seconds by the publisher, not per frame, so how busy the bus is makes no difference
+         -- and the number of samples kept is worked out from maxBytes when it is made, so the memory it takes never grows past that
+         however long the display has been on.
+
+         For drawing, downsample() squashes the last 'span' seconds into one (min, max) pair per pixel column. The line then always has at
+         most twice as many points as the widget is wide no matter how much history there is, and a short spike still shows up. Samples
+         are put in their column by the time they were taken, so a gap in the sampling (the display busy, or turned off) shows as a gap
+         rather than squeezing older samples into the span.
+"""
+
+from array import array
+
+_nan = float('nan')
+# Bytes per item of an array('d')
+_itemSize = array('d').itemsize
+
+
+class SignalHistory(object):
+
+    def __init__(self, names, period=1.0, maxBytes=512 * 1024):
+        """
+        Keeps as many samples of every signal in names as fit in maxBytes (the sample times included), one every period seconds
+        """
+        self.names = tuple(names)
+        self.index = dict((name, i) for (i, name) in enumerate(self.names))
+        self.period = period
+        self.capacity = max(2, maxBytes // (_itemSize * (len(self.names) + 1)))
+        self.times = array('d', [_nan]) * self.capacity
+        self.buffers = [array('d', [_nan]) * self.capacity for name in self.names]
+        # Where the next sample goes, and how many of the slots have been filled so far
+        self.head = 0
+        self.count = 0
+        self.nextSample = None
+
+    def due(self, now):
+        """
+        True if it is time for the next sample
+        """
+        return (self.nextSample is None) or (now >= self.nextSample)
+
+    def record(self, now, values):
+        """
+        values is in the same order as names, None where there is no value yet
+        """
+        head = self.head
+        self.times[head] = now
+        for (buf, value) in zip(self.buffers, values):
+            buf[head] = _nan if value is None else value
+        self.head = (head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        # Kept to whole periods so the samples don't drift later and later, unless it has fallen more than a period behind
+        if (self.nextSample is None) or (self.nextSample + self.period <= now):
+            self.nextSample = now
+        self.nextSample += self.period
+
+    def _slice(self, buf, first, last):
+        # Items first up to last of a ring buffer, counted from the oldest sample kept
+        start = (self.head - self.count + first) % self.capacity
+        end = start + (last - first)
+        if end <= self.capacity:
+            return buf[start:end]
+        return buf[start:] + buf[:end - self.capacity]
+
+    def _search(self, t, after=False):
+        # How many of the samples kept were taken before t (at or before it if after), a binary search as the times only go up
+        times = self.times
+        oldest = self.head - self.count
+        (lo, hi) = (0, self.count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            sampleTime = times[(oldest + mid) % self.capacity]
+            if (sampleTime <= t) if after else (sampleTime < t):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _end(self, now):
+        # The time a span is counted back from, the newest sample's if now isn't given
+        if now is not None:
+            return now
+        return self.times[self.head - 1] if self.count else 0.0
+
+    def series(self, name, span=None, now=None):
+        """
+        (times, values) of the samples taken in the span seconds up to now (the newest sample's time if None), oldest first -- from
+        the oldest one kept if span is None
+        """
+        last = self.count if now is None else self._search(now, after=True)
+        first = 0 if span is None else self._search(self._end(now) - span)
+        return (self._slice(self.times, first, last), self._slice(self.buffers[self.index[name]], first, last))
+
+    def downsample(self, name, span, width, now=None):
+        """
+        The span seconds of a signal up to now (the newest sample's time if None) as width (min, max) pairs, one per column from oldest
+        to newest -- None for a column with no values. Each sample goes in the column for the time it was taken, so the line fills in
+        from the right and a time with no samples is left empty
+        """
+        width = max(1, int(width))
+        end = self._end(now)
+        start = end - span
+        (times, values) = self.series(name, span, end)
+        lows = [None] * width
+        highs = [None] * width
+        col = None
+        for (t, value) in zip(times, values):
+            # NaN never equals itself, so this skips the gaps
+            if value != value:
+                continue
+            newCol = min(width - 1, int(((t - start) * width) // span))
+            if newCol != col:
+                col = newCol
+                if lows[col] is None:
+                    lows[col] = highs[col] = value
+                    continue
+            if value < lows[col]:
+                lows[col] = value
+            elif value > highs[col]:
+                highs[col] = value
+        return [None if low is None else (low, high) for (low, high) in zip(lows, highs)]
+
+    def latest(self, name):
+        if self.count == 0:
+            return None
+        value = self.buffers[self.index[name]][self.head - 1]
+        return None if value != value else value
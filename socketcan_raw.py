@@ -0,0 +1,149 @@
+"""
+PURPOSE: A lighter weight way of receiving from a SocketCAN interface on Linux than python-can's bus.recv(). Instead of building a can.Message
+         object for every frame, the raw 'struct can_frame' records are read with recvmsg_into straight into one buffer that is allocated once
+         and reused. Every wake up of the receive thread drains as many frames as are waiting (up to batchSize) and hands them on as
+         (timestamp, arbitration ID, dlc, payload) tuples, where the payload is a memoryview into the reused buffer.
+
+         The payload views are only valid until the next call to recv_batch -- anything that wants to keep the bytes has to copy them. The decoders
+         in can_signals.py read the values out straight away so this doesn't cost them anything.
+
+         This only works on Linux (socket.AF_CAN), python-can is still used everywhere else, and for testing with the virtual interface.
+"""
+
+import select
+import socket
+import struct
+import time
+
+# Flags that share the 32 bit can_id field of struct can_frame (see linux/can.h)
+CAN_EFF_FLAG = 0x80000000
+CAN_RTR_FLAG = 0x40000000
+CAN_ERR_FLAG = 0x20000000
+CAN_EFF_MASK = 0x1FFFFFFF
+CAN_SFF_MASK = 0x000007FF
+
+# The socket options that aren't exported by the socket module
+SOL_CAN_RAW = getattr(socket, 'SOL_CAN_RAW', 101)
+CAN_RAW_FILTER = getattr(socket, 'CAN_RAW_FILTER', 1)
+SO_TIMESTAMP = getattr(socket, 'SO_TIMESTAMP', 29)
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40)
+
+# struct can_frame: 32 bit can_id, 8 bit dlc, 3 bytes of padding then the 8 data bytes -- 16 bytes in total
+_canFrame = struct.Struct('=IB3x')
+_frameSize = 16
+# struct timeval as it is sent in the SO_TIMESTAMP ancillary data
+_timeval = struct.Struct('@ll')
+# The SO_RXQ_OVFL ancillary data -- how many frames the kernel has dropped for this socket since it was opened
+_dropCount = struct.Struct('=I')
+_filter = struct.Struct('=II')
+
+
+def isAvailable():
+    return hasattr(socket, 'AF_CAN') and hasattr(socket, 'CAN_RAW')
+
+
+def packFilters(canFilters):
+    """
+    Turn python-can style filter dicts ({'can_id', 'can_mask', 'extended'}) into the array of struct can_filter that CAN_RAW_FILTER takes
+    """
+    packed = b''
+    for f in canFilters:
+        canId = f['can_id']
+        canMask = f['can_mask']
+        if 'extended' in f:
+            # Make the filter match only extended or only standard frames, same as python-can does
+            canMask |= CAN_EFF_FLAG
+            if f['extended']:
+                canId |= CAN_EFF_FLAG
+        packed += _filter.pack(canId, canMask)
+    return packed
+
+
+class RawCanSocket(object):
+
+    def __init__(self, channel, canFilters=None, batchSize=64):
+        self.channel = channel
+        self.batchSize = batchSize
+        self.drops = 0
+
+        self.socket = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+        self.socket.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMP, 1)
+        self.socket.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+        if canFilters is not None:
+            self.set_filters(canFilters)
+        self.socket.bind((channel,))
+        # The socket never blocks by itself -- waiting for the first frame of a batch is done with poll
+        self.socket.setblocking(False)
+        self._poll = select.poll()
+        self._poll.register(self.socket, select.POLLIN)
+
+        # One buffer for the whole batch, plus views of each frame record and each frame's full 8 data bytes made once up front
+        self._buffer = bytearray(_frameSize * batchSize)
+        view = memoryview(self._buffer)
+        self._frameViews = [view[i * _frameSize:(i + 1) * _frameSize] for i in range(batchSize)]
+        self._payloadViews = [view[(i * _frameSize) + 8:(i + 1) * _frameSize] for i in range(batchSize)]
+        self._ancSize = socket.CMSG_SPACE(_timeval.size) + socket.CMSG_SPACE(_dropCount.size)
+
+    def set_filters(self, canFilters=None):
+        """
+        Same meaning as python-can's bus.set_filters -- None lets everything through
+        """
+        if canFilters is None:
+            canFilters = [{'can_id': 0, 'can_mask': 0}]
+        self.socket.setsockopt(SOL_CAN_RAW, CAN_RAW_FILTER, packFilters(canFilters))
+
+    def recv_batch(self, timeout=None):
+        """
+        Wait up to timeout seconds for a frame, then take every frame that is already waiting (up to batchSize) without waiting again
+        Returns a list of (timestamp, arbitration ID, dlc, payload view), empty if the timeout ran out
+        """
+        frames = []
+        sock = self.socket
+
+        # Only the first frame is waited for, the rest of the batch is whatever the kernel already has queued
+        if not self._poll.poll(None if timeout is None else int(timeout * 1000)):
+            return frames
+
+        for i in range(self.batchSize):
+            try:
+                (nbytes, ancdata, msgFlags, addr) = sock.recvmsg_into([self._frameViews[i]], self._ancSize)
+            except BlockingIOError:
+                break
+
+            if nbytes < _frameSize:
+                continue
+
+            (canId, dlc) = _canFrame.unpack_from(self._buffer, i * _frameSize)
+
+            # Error and remote request frames carry no data
+            if canId & (CAN_ERR_FLAG | CAN_RTR_FLAG):
+                continue
+
+            if canId & CAN_EFF_FLAG:
+                canId &= CAN_EFF_MASK
+            else:
+                canId &= CAN_SFF_MASK
+
+            timestamp = None
+            for (level, kind, data) in ancdata:
+                if level != socket.SOL_SOCKET:
+                    continue
+                if kind == SO_TIMESTAMP:
+                    (sec, usec) = _timeval.unpack_from(data)
+                    timestamp = sec + (usec / 1000000.0)
+                elif kind == SO_RXQ_OVFL:
+                    self.drops = _dropCount.unpack_from(data)[0]
+            if timestamp is None:
+                timestamp = time.time()
+
+            if dlc >= 8:
+                payload = self._payloadViews[i]
+            else:
+                payload = self._payloadViews[i][:dlc]
+
+            frames.append((timestamp, canId, dlc, payload))
+
+        return frames
+
+    def shutdown(self):
+        self.socket.close()
@@ -0,0 +1,89 @@
+"""
+PURPOSE: Sunrise and sunset for any date and place, worked out with NOAA's general solar position equations instead of being looked up in a
+         list of sunset times for one city and one year (2021PrinceGeorgeSunsets.txt, which this replaces). The display uses it to dim
+         the backlight at sunset and bring it back up at sunrise wherever the truck is set up to be.
+
+         The equations are good to a minute or two, far closer than the backlight needs. Everything is worked out in epoch seconds; the
+         time zone is only used to decide which calendar day 'today' is, so it is right across DST changes without any DST rules here.
+         Above the Arctic circle there can be days with no sunrise or no sunset, which are handled as all day or all night.
+"""
+
+import calendar
+import datetime
+import math
+
+# The sun's centre is this far from straight up at sunrise and sunset (the 0.833 is for refraction and the size of the sun)
+sunsetZenith = 90.833
+
+
+def localDate(timeStamp, timeZone=None):
+    """
+    The calendar date at timeStamp in timeZone (an IANA name like 'America/Vancouver', the system's own time zone if None)
+    """
+    if timeZone is not None:
+        try:
+            # zoneinfo is only in Python 3.9 and newer, before that the Pi's own time zone is used
+            from zoneinfo import ZoneInfo
+            return datetime.datetime.fromtimestamp(timeStamp, ZoneInfo(timeZone)).date()
+        except ImportError:
+            pass
+    return datetime.datetime.fromtimestamp(timeStamp).date()
+
+
+def sunTimes(date, latitude, longitude, zenith=sunsetZenith):
+    """
+    (sunrise, sunset) on date as epoch seconds, longitude is east positive. Returns 'day' if the sun doesn't set that day and 'night'
+    if it doesn't rise
+    """
+    daysInYear = 366 if calendar.isleap(date.year) else 365
+    dayOfYear = date.timetuple().tm_yday
+    # The fractional year at the place's solar noon, in radians
+    gamma = (2 * math.pi / daysInYear) * (dayOfYear - 1 - (longitude / 360.0))
+
+    # Equation of time (minutes) and solar declination (radians)
+    eqTime = 229.18 * (0.000075 + (0.001868 * math.cos(gamma)) - (0.032077 * math.sin(gamma)) - (0.014615 * math.cos(2 * gamma)) -
+                       (0.040849 * math.sin(2 * gamma)))
+    decl = (0.006918 - (0.399912 * math.cos(gamma)) + (0.070257 * math.sin(gamma)) - (0.006758 * math.cos(2 * gamma)) +
+            (0.000907 * math.sin(2 * gamma)) - (0.002697 * math.cos(3 * gamma)) + (0.00148 * math.sin(3 * gamma)))
+
+    lat = math.radians(latitude)
+    cosHourAngle = (math.cos(math.radians(zenith)) / (math.cos(lat) * math.cos(decl))) - (math.tan(lat) * math.tan(decl))
+    if cosHourAngle > 1:
+        return 'night'
+    if cosHourAngle < -1:
+        return 'day'
+    hourAngle = math.degrees(math.acos(cosHourAngle))
+
+    # Minutes from midnight UTC at the start of date, which can be below 0 or past a day for places far from Greenwich
+    midnight = calendar.timegm((date.year, date.month, date.day, 0, 0, 0))
+    sunrise = 720 - (4 * (longitude + hourAngle)) - eqTime
+    sunset = 720 - (4 * (longitude - hourAngle)) - eqTime
+    return (midnight + (sunrise * 60), midnight + (sunset * 60))
+
+
+def nextTransition(timeStamp, latitude, longitude, timeZone=None, zenith=sunsetZenith):
+    """
+    (night, change) -- whether it is night at timeStamp, and the epoch time of the next sunrise or sunset after it (None if there isn't
+    one in the next day, e.g. the midnight sun)
+    """
+    today = localDate(timeStamp, timeZone)
+    events = []
+    # Yesterday and tomorrow as well, so the last change before now and the next one after it are always in the list
+    for days in (-1, 0, 1, 2):
+        times = sunTimes(today + datetime.timedelta(days=days), latitude, longitude, zenith)
+        if times in ('day', 'night'):
+            # No change that day, it counts as being that way from its start
+            events.append((calendar.timegm((today + datetime.timedelta(days=days)).timetuple()), times == 'night', False))
+        else:
+            events.append((times[0], False, True))
+            events.append((times[1], True, True))
+    events.sort()
+
+    night = events[0][1]
+    for (eventTime, eventNight, change) in events:
+        if eventTime > timeStamp:
+            if change:
+                return (night, eventTime)
+            continue
+        night = eventNight
+    return (night, None)
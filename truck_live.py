@@ -0,0 +1,275 @@
+"""
+PURPOSE: The live side of the truck display that doesn't need Kivy: the latest decoded value of every signal, decoding each received frame into
+         it, and pushing the values that changed onto the app's properties. The receive thread (or coroutine) calls liveUpdateTruck for every
+         frame and the display calls publishTruckValues on its own timer, so the two only share the snapshot list.
+
+         Nothing in here imports Kivy -- 'app' is anything with the display's properties as attributes, which is what lets the benchmark
+         (can_bench.py) drive exactly this code without a screen.
+"""
+
+import time
+
+from can_metrics import CanMetrics
+from signal_aggregates import SignalAggregator
+from signal_history import SignalHistory
+from can_signals import SignalSnapshot, compileDecoders, profileSignalNames, tankTempNames, maxNumTanks, canFiltersFor, hydrogenMassEq2
+
+# The hydrogen mass is only worked out from tank temperatures and a tank pressure that have had a frame in the last this many seconds
+hMassMaxAge = 5.0
+
+
+def newTruckVars(signals, numTank, volumeL):
+    """
+    snapshot holds the latest decoded value of every signal (written by the receive thread), published is what was last shown on the
+    display for each slot, aggregates their per second/minute/hour stats (filled in by can_service.AggregateFeed) and faultHistory
+    the fault changes (filled in by can_service.FaultHistoryFeed, if the display adds one). The rest is state
+    used by the publisher that carries over between updates
+    """
+    snapshot = SignalSnapshot([s.name for s in signals])
+    publishers = tuple((snapshot.index[name], publish) for (name, publish) in _signalPublishers.items() if name in snapshot.index)
+    # The IDs each of the hydrogen mass's inputs can come in under
+    hMassIds = tuple(tuple(s.can_ids) for name in tankTempNames(numTank) + ['presT1'] for s in signals if s.name == name)
+    return {'snapshot': snapshot, 'published': [None] * len(snapshot.names), 'publishers': publishers,
+            'tankTempSlots': [snapshot.index[name] for name in tankTempNames(numTank)], 'presT1Slot': snapshot.index['presT1'],
+            'hMassIds': hMassIds, 'volumeL': volumeL, 'numTank': numTank, 'prevSec': None,
+            'metrics': CanMetrics(), 'decodedSignals': [],
+            'latency': {'last': 0.0, 'max': 0.0, 'total': 0.0, 'count': 0},
+            'hMass': None, 'history': None, 'historySlots': (), 'aggregates': SignalAggregator(snapshot.names),
+            'faultHistory': None}
+
+
+# The decoded signals that get a trend line on the display, the hydrogen mass (worked out by the publisher) is always first
+historySignalNames = ('HinjectionV', 'Hleakage', 'presT1', 'railPressure')
+
+
+def enableHistory(truckVars, period, maxBytes):
+    """
+    Start keeping a history of the hydrogen mass, the historySignalNames and the tank temperatures for the trend lines, one sample every
+    period seconds in no more than maxBytes (see signal_history.py)
+    """
+    index = truckVars['snapshot'].index
+    names = [name for name in historySignalNames + tuple(tankTempNames(truckVars['numTank'])) if name in index]
+    truckVars['historySlots'] = tuple(index[name] for name in names)
+    truckVars['history'] = SignalHistory(['hMass'] + names, period, maxBytes)
+    return truckVars['history']
+
+
+#######################################################################################
+# The functions below take a freshly decoded signal value and show it on the display, they are looked up by signal name
+
+# Nirai7LastFaultNumber_spnPropB_3E
+# Every change is recorded as it is decoded by can_service.FaultHistoryFeed, this only shows the latest one
+def publishNiraFault(app, value, truckVars):
+    app.error_code = str(int(value))
+
+
+# Rail pressure
+def publishRailPressure(app, value, truckVars):
+    app.pressures[1] = str('%.2f' % value) + ' bar'
+
+
+# Tank 1 pressure
+def publishTankPressure(app, value, truckVars):
+    app.pressures[0] = str("%.2f" % value) + ' bar'
+
+
+# Tank temperatures, one publisher per tank
+def tankTempPublisher(index):
+    def publishTankTemp(app, value, truckVars):
+        app.temps[index] = str("%.2f" % value) + '˚C'
+
+    return publishTankTemp
+
+
+# Hydrogen injection rate
+def publishInjection(app, value, truckVars):
+    app.HinjectionV = value
+
+
+# Hydrogen leakage
+def publishLeakage(app, value, truckVars):
+    app.Hleakage = value
+
+
+# Coolant temperature
+def publishCoolant(app, value, truckVars):
+    app.coolant_temp = str(value) + u' \u00BAC'
+
+
+# Diagnostic Message 1 -- Active DTCs
+def publishDM1(app, value, truckVars):
+    if value == 0:
+        app.mil_light = 'Lamp Off'
+    else:
+        app.mil_light = 'Lamp On'
+
+
+# Diesel particulate filter
+def publishDPF(app, value, truckVars):
+    if value == 0:
+        app.dpf_status = 'Not Active'
+    elif value == 1:
+        app.dpf_status = 'Active'
+    elif value == 2:
+        app.dpf_status = 'Regen Needed'
+    else:
+        app.dpf_status = 'Not Available'
+
+
+# Mode requests
+def publishModeNum(app, value, truckVars):
+    if (value == 0) or (value == 1):
+        app.current_mode = 'Hydrogen'
+    elif value == 2:
+        app.current_mode = 'Diesel'
+
+
+def publishModeRequested(app, value, truckVars):
+    if (value == 0) or (value == 1):
+
+        app.truck_reqd = u'H\u2082 Mode '
+
+    elif value == 2:
+
+        app.truck_reqd = 'Diesel Mode'
+
+    else:
+
+        app.truck_reqd = 'Missing'
+        app.mode_color = [1, 0, 0, 1]
+
+
+# Signals that aren't in here (presT2, wheelSpeed) are decoded but not shown
+_signalPublishers = {
+    'nirai7LastFaultNumber': publishNiraFault,
+    'railPressure': publishRailPressure,
+    'presT1': publishTankPressure,
+    'HinjectionV': publishInjection,
+    'Hleakage': publishLeakage,
+    'coolantTemp': publishCoolant,
+    'DM1': publishDM1,
+    'dpf': publishDPF,
+    'modeNum': publishModeNum,
+    'modeBeingRequested': publishModeRequested,
+}
+for t in range(maxNumTanks):
+    _signalPublishers['tankTemp' + str(t + 1)] = tankTempPublisher(t)
+
+
+def liveUpdateTruck(timeStamp, arbId, data, decoderTable, values, metrics):
+    """
+    Decode one received frame straight from its data bytes into the latest values snapshot. This runs in the receive thread so it
+    doesn't touch the display at all -- publishTruckValues picks the new values up on the main thread
+    """
+    metrics.seen += 1
+    idCounts = metrics.idCounts
+    idCounts[arbId] = idCounts.get(arbId, 0) + 1
+
+    decoder = decoderTable.get(arbId)
+
+    # Only full 8 byte frames for the IDs we know about are used
+    if decoder is None:
+        metrics.unknownId += 1
+        return
+    if len(data) != 8:
+        metrics.malformed += 1
+        return
+
+    metrics.accepted += 1
+    metrics.lastFrameTime = timeStamp
+    metrics.idLastSeen[arbId] = timeStamp
+
+    # Timing every decode would cost more than the decode itself, so only a sample of them are timed
+    if metrics.accepted & metrics.sampleMask:
+        decoder(data, values)
+    else:
+        start = time.perf_counter()
+        decoder(data, values)
+        metrics.recordDecodeTime(time.perf_counter() - start)
+
+
+def publishTruckValues(app, truckVars, display=True):
+    """
+    Pushes only the values that changed since the last call to the app's properties, once a second calculates the hydrogen mass, and
+    samples the trend history (if there is one) when it is due. With display False (nothing is looking at the screens) the signals
+    aren't published or formatted at all -- they are all caught up on the next call with display True
+    Must be called from the thread that owns the app (the display calls it display_rate times a second on the main thread)
+    """
+    now = time.time()
+    values = truckVars['snapshot'].values
+    published = truckVars['published']
+    changed = False
+    if display:
+        for (slot, publish) in truckVars['publishers']:
+            value = values[slot]
+            if (value is not None) and (value != published[slot]):
+                published[slot] = value
+                publish(app, value, truckVars)
+                changed = True
+
+    # How long the newest frame behind this update waited before reaching the screen
+    lastFrameTime = truckVars['metrics'].lastFrameTime
+    if changed and (lastFrameTime is not None):
+        latency = truckVars['latency']
+        latency['last'] = now - lastFrameTime
+        latency['max'] = max(latency['max'], latency['last'])
+        latency['total'] += latency['last']
+        latency['count'] += 1
+
+    #######################################################################################
+    curSec = int(now)
+    if curSec != truckVars['prevSec']:
+        ###################################################################################
+        # H mass calculation
+        tempL = [values[slot] for slot in truckVars['tankTempSlots']]
+        presT1 = values[truckVars['presT1Slot']]
+        # The snapshot keeps the last value of a sensor that has stopped sending, so each input must have been seen recently too
+        lastSeen = truckVars['metrics'].idLastSeen
+        since = now - hMassMaxAge
+        fresh = all(any(lastSeen.get(arbId, 0) >= since for arbId in canIds) for canIds in truckVars['hMassIds'])
+        if fresh and (not (None in tempL) and (presT1 != None)):
+            volumeL = truckVars['volumeL']
+            HtotalMassL = []
+            for t in range(truckVars['numTank']):
+                # Only consider tank 1 hydrogen pressure
+                currHtotalMassT = hydrogenMassEq2(presT1, tempL[t], volumeL[t])
+                HtotalMassL.append(currHtotalMassT)
+
+            HtotalMass = round(sum(HtotalMassL), 1)
+            app.hMass = HtotalMass
+            truckVars['hMass'] = HtotalMass
+        else:
+            # No value, rather than the last one going on being shown
+            app.hMass = None
+            truckVars['hMass'] = None
+
+        truckVars['prevSec'] = curSec
+
+    # At most one sample every history period, however often this is called
+    history = truckVars['history']
+    if (history is not None) and history.due(now):
+        history.record(now, [truckVars['hMass']] + [values[slot] for slot in truckVars['historySlots']])
+
+
+def applyTruckProfile(bus, decoderTable, signals, truckVars):
+    """
+    (Re)build the decoders for the truck's number of tanks and install the matching kernel filters on the bus. decoderTable is
+    updated in place so the receive thread that is already using it picks up the change on its next frame
+    """
+    snapshot = truckVars['snapshot']
+    wanted = profileSignalNames(signals, truckVars['numTank'])
+    newDecoders = compileDecoders(signals, snapshot.index, wanted)
+    truckVars['decodedSignals'] = [s for s in signals if s.name in wanted]
+
+    decoderTable.update(newDecoders)
+    for canId in [x for x in decoderTable if x not in newDecoders]:
+        del decoderTable[canId]
+
+    bus.set_filters(canFiltersFor(decoderTable))
+
+
+def metricsReport(truckVars):
+    """
+    The receive/decode metrics along with how stale each decoded signal is and the frame to screen latency
+    """
+    return truckVars['metrics'].report(truckVars['decodedSignals'], truckVars['latency'])
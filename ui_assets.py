@@ -0,0 +1,107 @@
+"""
+PURPOSE: The images and fonts the display's screens use, loaded once and shared by every screen instead of each widget finding its own copy.
+
+         The PNGs are packed into one Kivy atlas (hydra.atlas + hydra-0.png next to the code) when the display is installed, so the
+         VideoCore gets one texture upload at boot rather than one per image and every Image widget draws from that same texture. The
+         atlas is made with
+
+             python3 ui_assets.py <display_code_dir>
+
+         on a machine with Kivy and Pillow (the Pi or anywhere else, the output is just copied over with the code). Without it the
+         screens use the plain PNGs as before, so a missing or out of date atlas never stops the display starting.
+
+         The Montserrat fonts are registered with Kivy under their own names, so every Label shares the same font (and its cached glyphs)
+         whatever the path of the code is, and preload() loads every texture in one pass before the first screen is built.
+"""
+
+import os
+import sys
+import time
+
+from kivy.atlas import Atlas
+from kivy.core.image import Image as CoreImage
+from kivy.core.text import LabelBase
+
+atlasName = 'hydra'
+# The images the screens use, by the name the app gives them (the kv file uses app.<name>_image)
+atlasImages = {'drop': 'hydradrop.png', 'gauge': 'cadran.png', 'needle': 'new_needle.png', 'logo': 'logo.png'}
+# Big enough for all of the images above with the default padding, and a power of two each way for the Pi's GPU
+atlasSize = (2048, 1024)
+
+fontName = 'Montserrat'
+boldFontName = 'Montserrat-Bold'
+
+# The textures loaded by preload() -- held on to so they stay shared for as long as the app is running
+_preloaded = {}
+
+
+def buildAtlas(assetDir):
+    """
+    Pack the atlasImages into assetDir/hydra.atlas, returns the atlas file's name
+    """
+    fnames = [os.path.join(assetDir, fname) for fname in sorted(atlasImages.values())]
+    result = Atlas.create(os.path.join(assetDir, atlasName), fnames, atlasSize)
+    if not result:
+        raise ValueError('The images do not fit in a ' + 'x'.join(str(x) for x in atlasSize) + ' atlas')
+    return result[0]
+
+
+def _atlasCurrent(assetDir):
+    # Out of date if any of the images has changed since the atlas was made
+    atlasFname = os.path.join(assetDir, atlasName + '.atlas')
+    try:
+        built = os.path.getmtime(atlasFname)
+        return all(os.path.getmtime(os.path.join(assetDir, fname)) <= built for fname in atlasImages.values())
+    except OSError:
+        return False
+
+
+def imageSources(assetDir):
+    """
+    {name: source} for every image, from the atlas if there is an up to date one and the plain PNGs if not
+    """
+    if _atlasCurrent(assetDir):
+        atlasPath = 'atlas://' + os.path.join(assetDir, atlasName).replace(os.sep, '/') + '/'
+        return dict((name, atlasPath + os.path.splitext(fname)[0]) for (name, fname) in atlasImages.items())
+    print('No up to date image atlas in ' + assetDir + ', using the plain images')
+    return dict((name, os.path.join(assetDir, fname)) for (name, fname) in atlasImages.items())
+
+
+def registerFonts(assetDir):
+    """
+    Register the Montserrat fonts, returns (regular, bold) font names for font_name
+    """
+    LabelBase.register(fontName, os.path.join(assetDir, 'Montserrat-Regular.ttf'), fn_bold=os.path.join(assetDir, 'Montserrat-Bold.ttf'))
+    LabelBase.register(boldFontName, os.path.join(assetDir, 'Montserrat-Bold.ttf'))
+    return (fontName, boldFontName)
+
+
+def preload(sources):
+    """
+    Load every texture in one go before the screens are built, so each one is uploaded once and the screens all pick up the same
+    copy from Kivy's cache. Returns {'count', 'textures', 'bytes', 'seconds'} for the boot log
+    """
+    start = time.perf_counter()
+    textures = {}
+    for (name, source) in sources.items():
+        try:
+            _preloaded[name] = CoreImage(source)
+        except Exception as e:
+            # The widget using it will try again (and show nothing if it fails too) rather than the app not starting
+            print('Could not load ' + source + ': ' + str(e))
+            continue
+        # Images from the atlas are regions of one texture, which is only counted once
+        texture = _preloaded[name].texture
+        owner = getattr(texture, 'owner', None) or texture
+        textures[id(owner)] = owner
+    return {'count': len(_preloaded), 'textures': len(textures),
+            'bytes': sum(t.width * t.height * 4 for t in textures.values()), 'seconds': time.perf_counter() - start}
+
+
+def main():
+    assetDir = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
+    print('Wrote ' + buildAtlas(assetDir))
+
+
+if __name__ == "__main__":
+    main()